@@ -0,0 +1,641 @@
+"""
+Admission control for expensive callbacks and API routes: per-client rates and
+per-class concurrency caps, with fast "busy, retry in N s" rejections.
+
+Each admitted callback belongs to a class of work: ``fealden`` searches,
+``fit`` (curve fits, uploads and figure exports) or ``light`` calculations. A
+call runs only if
+
+* its client has a token left in its bucket for the class, refilled at
+  ``rate`` tokens a second up to ``burst`` (request bodies over
+  ``BYTES_PER_TOKEN`` cost a token more per ``BYTES_PER_TOKEN``, so pasting a
+  huge table counts for more than a label edit), and
+* one of the class's ``concurrency`` slots is free, or frees up within
+  ``wait`` seconds with no more than ``queue`` calls waiting ahead of it.
+
+Otherwise it is turned away at once, with an estimate of when to retry, and
+the callback's ``busy`` function shows that in the callback's own outputs
+instead of leaving the user waiting for a worker timeout. Routes such as
+``/api/batch`` and ``/api/report`` are admitted with ``admit_response``, which
+holds their slot while the response streams and turns them away with a 429.
+Rejected responses also carry ``Retry-After`` and
+``X-Bonham-Admission: rejected`` headers.
+
+Buckets, slots and waiting calls are kept in a SQLite file
+(``BONHAM_ADMISSION_DB``, on by default), so the limits hold across all the
+Passenger or gunicorn workers, and all the apps, that use the same file. A
+slot whose worker died is reclaimed when the class next looks full. With
+``BONHAM_ADMISSION_DB`` empty, or if the file cannot be used, each worker
+process enforces the limits on its own, so N workers admit up to N times as
+much. Defaults are in ``DEFAULT_LIMITS``; override a class with
+``BONHAM_ADMISSION_<CLASS>``, e.g.
+``BONHAM_ADMISSION_FEALDEN="concurrency=1 rate=0.05"``, and use 0 for no cap
+on concurrency or rate. ``BONHAM_ADMISSION=0`` turns admission control off.
+Clients are told apart by address; behind a proxy that sets
+``X-Forwarded-For``, set ``BONHAM_ADMISSION_FORWARDED=1`` to use it.
+"""
+
+import contextlib
+import functools
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple, TypeVar, cast
+
+import flask
+
+import metrics
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+ADMISSION: bool = os.environ.get("BONHAM_ADMISSION", "1") != "0"
+ADMISSION_DB: str = os.environ.get("BONHAM_ADMISSION_DB", "admission.sqlite3")
+FORWARDED: bool = os.environ.get("BONHAM_ADMISSION_FORWARDED", "0") == "1"
+BYTES_PER_TOKEN: int = int(
+    os.environ.get("BONHAM_ADMISSION_BYTES_PER_TOKEN", str(256 * 1024))
+)
+MAX_CLIENTS = 10000  # token buckets kept per class, least recently used dropped
+HOLD_SMOOTHING = 0.2  # weight of the newest call in the mean time a slot is held
+POLL_SECONDS = (0.01, 0.1)  # first and longest pause between shared slot checks
+STALE_SLOT_SECONDS = 3600.0  # shared slots older than this are reclaimed
+PRUNE_EVERY = 256  # shared admissions between drops of refilled buckets
+
+
+@dataclass
+class Limits:
+    """Admission limits for one class of work."""
+
+    concurrency: int  # calls running at once; 0 for no cap
+    queue: int  # calls waiting for a slot, beyond which calls are turned away
+    wait: float  # seconds a call may wait for a slot
+    rate: float  # tokens a second per client; 0 for no rate limit
+    burst: float  # tokens a client can save up
+
+
+DEFAULT_LIMITS: Dict[str, Limits] = {
+    "fealden": Limits(concurrency=2, queue=4, wait=10.0, rate=0.2, burst=3.0),
+    "fit": Limits(concurrency=4, queue=16, wait=5.0, rate=2.0, burst=20.0),
+    "light": Limits(concurrency=16, queue=64, wait=1.0, rate=10.0, burst=50.0),
+}
+
+
+def parse_limits(spec: str, defaults: Limits) -> Limits:
+    """Read ``name=value`` overrides, separated by spaces or commas.
+
+    Args:
+        spec (str): overrides, e.g. "concurrency=1 rate=0.05"
+        defaults (Limits): values for limits not mentioned
+
+    Raises:
+        ValueError: for an unknown limit or a value that is not a number
+
+    Returns:
+        Limits: the combined limits
+    """
+    values: Dict[str, Any] = asdict(defaults)
+    for item in spec.replace(",", " ").split():
+        name, _, value = item.partition("=")
+        if name not in values:
+            raise ValueError(f"Unknown admission limit {name!r} in {spec!r}")
+        values[name] = type(values[name])(value)
+    return Limits(**values)
+
+
+class Busy(Exception):
+    """A call was turned away; ``retry_after`` says when to try again.
+
+    Args:
+        reason (str): "rate", "queue" or "timeout"
+        retry_after (int): seconds until a retry is likely to be admitted
+    """
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        self.reason = reason
+        self.retry_after = retry_after
+        if reason == "rate":
+            message = "You are sending requests faster than the server allows"
+        else:
+            message = "The server is busy with other requests"
+        super().__init__(f"{message}; please retry in {retry_after} s.")
+
+
+@dataclass
+class Ticket:
+    """An admitted call, to hand back to ``Gate.leave``."""
+
+    admitted: float  # time.monotonic() at admission
+    slot: Optional[int] = None  # row in the shared slots table, if any
+
+
+class Gate:
+    """Token buckets and a slot count for one class of work, in this process.
+
+    Args:
+        work (str): class name, for metrics
+        limits (Limits): the class's limits
+    """
+
+    def __init__(self, work: str, limits: Limits) -> None:
+        self.work = work
+        self.limits = limits
+        self._lock = threading.Lock()
+        self._slots: Optional[threading.Semaphore] = (
+            threading.Semaphore(limits.concurrency) if limits.concurrency else None
+        )
+        self._running = 0
+        self._waiting = 0
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._hold = 1.0  # mean seconds a call holds its slot
+        metrics.record_admission_limits(work, asdict(limits))
+
+    def enter(self, client: str, cost: float = 1.0) -> Ticket:
+        """Admit a call, waiting up to ``limits.wait`` for a slot.
+
+        Args:
+            client (str): client identity
+            cost (float): tokens the call takes
+
+        Raises:
+            Busy: if the client is over its rate, too many calls are waiting,
+                or no slot freed up in time
+
+        Returns:
+            Ticket: to pass to ``leave``
+        """
+        cost = min(cost, self.limits.burst)  # else it could never be admitted
+        self._take(client, cost)
+        start = time.monotonic()
+        if self._slots is not None and not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.limits.queue:
+                    self._reject(client, cost, "queue")
+                self._waiting += 1
+                self._publish()
+            try:
+                acquired = self._slots.acquire(timeout=self.limits.wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+            if not acquired:
+                with self._lock:
+                    self._reject(client, cost, "timeout")
+        admitted = time.monotonic()
+        with self._lock:
+            self._running += 1
+            self._publish()
+        metrics.record_admission(self.work, "admitted", admitted - start)
+        return Ticket(admitted)
+
+    def leave(self, ticket: Ticket) -> None:
+        """Free the slot of an admitted call."""
+        held = time.monotonic() - ticket.admitted
+        with self._lock:
+            self._running -= 1
+            self._hold += HOLD_SMOOTHING * (held - self._hold)
+            self._publish()
+        if self._slots is not None:
+            self._slots.release()
+
+    def _take(self, client: str, cost: float) -> None:
+        """Take tokens from the client's bucket, or raise Busy."""
+        rate, burst = self.limits.rate, self.limits.burst
+        if rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, then = self._buckets.pop(client, (burst, now))
+            tokens = min(burst, tokens + (now - then) * rate)
+            if tokens < cost:
+                self._buckets[client] = (tokens, now)
+                metrics.record_admission(self.work, "rate")
+                raise Busy("rate", math.ceil((cost - tokens) / rate))
+            self._buckets[client] = (tokens - cost, now)
+            if len(self._buckets) > MAX_CLIENTS:
+                self._buckets.popitem(last=False)
+
+    def _reject(self, client: str, cost: float, reason: str) -> None:
+        """Turn a call away for lack of a slot, refunding its tokens.
+
+        Call with the lock held.
+        """
+        tokens, then = self._buckets.get(client, (0.0, 0.0))
+        if client in self._buckets:
+            self._buckets[client] = (min(self.limits.burst, tokens + cost), then)
+        self._publish()
+        raise self._busy(reason)
+
+    def _busy(self, reason: str) -> Busy:
+        """Count a call turned away for lack of a slot, with a retry estimate."""
+        metrics.record_admission(self.work, reason)
+        slots = self.limits.concurrency or 1
+        return Busy(reason, max(1, math.ceil(self._hold * (self._waiting + 1) / slots)))
+
+    def _publish(self) -> None:
+        metrics.record_admission_load(self.work, self._running, self._waiting)
+
+
+class SharedGate(Gate):
+    """A Gate whose buckets and slots are rows in a SQLite file.
+
+    Every process using the file shares the limits. Slots and waiting calls
+    are rows stamped with their process id. When the class looks full, rows
+    of processes that have exited are dropped, as are slots older than
+    ``STALE_SLOT_SECONDS`` and waiting rows older than twice the wait. A call
+    waiting for a slot checks again after a pause that doubles from
+    ``POLL_SECONDS[0]`` to ``POLL_SECONDS[1]``. If the file cannot be used
+    before a call has written to it, the call falls back to this process's
+    own gate; once its tokens are taken and it is waiting, an error gives
+    them back, drops its waiting row and turns the call away instead.
+
+    Args:
+        work (str): class name, also its key in the file
+        limits (Limits): the class's limits, across all processes
+        db_path (str): SQLite file
+    """
+
+    def __init__(self, work: str, limits: Limits, db_path: str) -> None:
+        super().__init__(work, limits)
+        self.db_path = db_path
+        self._fallback = Gate(work, limits)
+        self._local = threading.local()
+        self._admissions = 0
+        if hasattr(os, "register_at_fork"):  # a preloading server's workers
+            os.register_at_fork(after_in_child=self._after_fork)
+        with self._transaction() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS admission_buckets ("
+                " work TEXT, client TEXT, tokens REAL, updated REAL,"
+                " PRIMARY KEY (work, client))"
+            )
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS admission_slots ("
+                " id INTEGER PRIMARY KEY, work TEXT, pid INTEGER, since REAL,"
+                " waiting INTEGER)"
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS admission_slots_work"
+                " ON admission_slots (work, waiting)"
+            )
+
+    def _after_fork(self) -> None:
+        """Open new connections in a forked child; SQLite ones must not be
+        shared across processes."""
+        self._local = threading.local()
+
+    def _connect(self) -> sqlite3.Connection:
+        db: Optional[sqlite3.Connection] = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    @contextlib.contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Hold the write lock from the first read, so checks stay true."""
+        db = self._connect()
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            yield db
+            db.execute("COMMIT")
+        except BaseException:
+            if db.in_transaction:  # also after a failed COMMIT
+                db.execute("ROLLBACK")
+            raise
+
+    def enter(self, client: str, cost: float = 1.0) -> Ticket:
+        """Admit a call against the shared limits; see ``Gate.enter``."""
+        try:
+            return self._enter_shared(client, min(cost, self.limits.burst))
+        except sqlite3.Error:  # nothing was written; see _wait_shared
+            return self._fallback.enter(client, cost)
+
+    def leave(self, ticket: Ticket) -> None:
+        """Free the slot of an admitted call."""
+        if ticket.slot is None:  # admitted by the fallback gate
+            self._fallback.leave(ticket)
+            return
+        held = time.monotonic() - ticket.admitted
+        with self._lock:
+            self._hold += HOLD_SMOOTHING * (held - self._hold)
+        try:
+            with self._transaction() as db:
+                db.execute("DELETE FROM admission_slots WHERE id = ?", (ticket.slot,))
+                self._count(db)
+        except sqlite3.Error:
+            pass  # reclaimed as stale later
+        self._publish()
+
+    def _enter_shared(self, client: str, cost: float) -> Ticket:
+        start = time.monotonic()
+        deadline = start + self.limits.wait
+        with self._transaction() as db:  # a Busy rolls back the tokens taken
+            self._take_shared(db, client, cost)
+            slot = self._claim(db)
+            if slot is None:
+                if self._waiting >= self.limits.queue:
+                    self._reap(db)
+                    self._count(db)
+                if self._waiting >= self.limits.queue:
+                    self._publish()
+                    raise self._busy("queue")
+                waiter = self._insert(db, waiting=True)
+        if slot is None:
+            try:
+                slot = self._wait_shared(client, cost, waiter, deadline)
+            except sqlite3.Error:
+                self._abandon(client, cost, waiter)
+                self._publish()
+                raise self._busy("timeout")
+        admitted = time.monotonic()
+        self._publish()
+        metrics.record_admission(self.work, "admitted", admitted - start)
+        self._admissions += 1
+        if self._admissions % PRUNE_EVERY == 0:
+            self._prune_buckets()
+        return Ticket(admitted, slot)
+
+    def _wait_shared(
+        self, client: str, cost: float, waiter: int, deadline: float
+    ) -> int:
+        """Poll for a slot for a waiting call, or raise Busy at the deadline.
+        An sqlite3.Error leaves the call's tokens and waiting row in the file."""
+        slot: Optional[int] = None
+        pause = POLL_SECONDS[0]
+        while slot is None:
+            time.sleep(max(0.0, min(pause, deadline - time.monotonic())))
+            pause = min(2 * pause, POLL_SECONDS[1])
+            with self._transaction() as db:
+                slot = self._claim(db)
+                if slot is not None or time.monotonic() >= deadline:
+                    db.execute("DELETE FROM admission_slots WHERE id = ?", (waiter,))
+                    self._count(db)
+                if slot is None and time.monotonic() >= deadline:
+                    self._refund(db, client, cost)
+                    timed_out = True
+                else:
+                    timed_out = False
+            if timed_out:
+                self._publish()
+                raise self._busy("timeout")
+        return slot
+
+    def _abandon(self, client: str, cost: float, waiter: int) -> None:
+        """Best effort: give back a failed waiting call's tokens and row."""
+        try:
+            with self._transaction() as db:
+                db.execute("DELETE FROM admission_slots WHERE id = ?", (waiter,))
+                self._refund(db, client, cost)
+                self._count(db)
+        except sqlite3.Error:
+            pass  # the row is reaped as stale later
+
+    def _take_shared(self, db: sqlite3.Connection, client: str, cost: float) -> None:
+        """Take tokens from the client's shared bucket, or raise Busy."""
+        rate, burst = self.limits.rate, self.limits.burst
+        if rate <= 0:
+            return
+        now = time.time()
+        row = db.execute(
+            "SELECT tokens, updated FROM admission_buckets"
+            " WHERE work = ? AND client = ?",
+            (self.work, client),
+        ).fetchone()
+        tokens, then = row if row is not None else (burst, now)
+        tokens = min(burst, tokens + max(0.0, now - then) * rate)
+        if tokens < cost:
+            metrics.record_admission(self.work, "rate")
+            raise Busy("rate", math.ceil((cost - tokens) / rate))
+        db.execute(
+            "INSERT OR REPLACE INTO admission_buckets VALUES (?, ?, ?, ?)",
+            (self.work, client, tokens - cost, now),
+        )
+
+    def _refund(self, db: sqlite3.Connection, client: str, cost: float) -> None:
+        db.execute(
+            "UPDATE admission_buckets SET tokens = MIN(?, tokens + ?)"
+            " WHERE work = ? AND client = ?",
+            (self.limits.burst, cost, self.work, client),
+        )
+
+    def _claim(self, db: sqlite3.Connection) -> Optional[int]:
+        """Take a free slot, returning its row, or None if all are held."""
+        self._count(db)
+        concurrency = self.limits.concurrency
+        if concurrency and self._running >= concurrency:
+            self._reap(db)
+            self._count(db)
+        if concurrency and self._running >= concurrency:
+            return None
+        self._running += 1
+        return self._insert(db, waiting=False)
+
+    def _insert(self, db: sqlite3.Connection, waiting: bool) -> int:
+        cursor = db.execute(
+            "INSERT INTO admission_slots (work, pid, since, waiting)"
+            " VALUES (?, ?, ?, ?)",
+            (self.work, os.getpid(), time.time(), int(waiting)),
+        )
+        if waiting:
+            self._waiting += 1
+        return cast(int, cursor.lastrowid)
+
+    def _count(self, db: sqlite3.Connection) -> None:
+        """Read how many calls of the class hold slots and wait, everywhere."""
+        counts = dict(
+            db.execute(
+                "SELECT waiting, COUNT(*) FROM admission_slots WHERE work = ?"
+                " GROUP BY waiting",
+                (self.work,),
+            ).fetchall()
+        )
+        self._running, self._waiting = counts.get(0, 0), counts.get(1, 0)
+
+    def _reap(self, db: sqlite3.Connection) -> None:
+        """Drop rows of exited processes, and rows held implausibly long."""
+        pids = [
+            pid
+            for (pid,) in db.execute(
+                "SELECT DISTINCT pid FROM admission_slots WHERE work = ?",
+                (self.work,),
+            )
+            if not _alive(pid)
+        ]
+        db.executemany(
+            "DELETE FROM admission_slots WHERE pid = ?", [(pid,) for pid in pids]
+        )
+        now = time.time()
+        db.execute(
+            "DELETE FROM admission_slots WHERE work = ?"
+            " AND since < (CASE waiting WHEN 1 THEN ? ELSE ? END)",
+            (self.work, now - 2 * self.limits.wait - 1, now - STALE_SLOT_SECONDS),
+        )
+
+    def _prune_buckets(self) -> None:
+        """Drop buckets that have refilled; a missing bucket counts as full."""
+        if self.limits.rate <= 0:
+            return
+        try:
+            with self._transaction() as db:
+                db.execute(
+                    "DELETE FROM admission_buckets WHERE work = ? AND updated < ?",
+                    (self.work, time.time() - self.limits.burst / self.limits.rate),
+                )
+        except sqlite3.Error:
+            pass
+
+
+def _alive(pid: int) -> bool:
+    """Whether a process on this host is still running."""
+    if os.name == "nt":  # os.kill would terminate it
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def make_gate(work: str, limits: Limits) -> Gate:
+    """A shared gate when ``ADMISSION_DB`` is set and usable, else a local one.
+
+    Args:
+        work (str): class name
+        limits (Limits): the class's limits
+
+    Returns:
+        Gate: the gate for the class
+    """
+    if ADMISSION_DB:
+        try:
+            return SharedGate(work, limits, ADMISSION_DB)
+        except sqlite3.Error:
+            pass
+    return Gate(work, limits)
+
+
+GATES: Dict[str, Gate] = {
+    work: make_gate(
+        work,
+        parse_limits(os.environ.get(f"BONHAM_ADMISSION_{work.upper()}", ""), limits),
+    )
+    for work, limits in DEFAULT_LIMITS.items()
+}
+
+
+def client_id() -> str:
+    """The current request's client: its address, or the proxy's view of it."""
+    if not flask.has_request_context():
+        return "local"
+    request = flask.request
+    if FORWARDED and request.headers.get("X-Forwarded-For"):
+        return request.headers["X-Forwarded-For"].split(",")[0].strip()
+    return request.remote_addr or "unknown"
+
+
+def request_cost() -> float:
+    """Tokens the current request takes: one, plus one per ``BYTES_PER_TOKEN``."""
+    if not flask.has_request_context():
+        return 1.0
+    return 1.0 + (flask.request.content_length or 0) // BYTES_PER_TOKEN
+
+
+def admit(work: str, busy: Callable[[str], Any]) -> Callable[[F], F]:
+    """Decorate a Dash callback so it runs only when admitted.
+
+    Place it below ``metrics.instrument`` so rejected calls are still counted
+    as calls (fast ones) and time spent waiting for a slot is in the latency.
+
+    Args:
+        work (str): class of work, a key of ``GATES``
+        busy (Callable[[str], Any]): builds the callback's return value from
+            the message to show when a call is turned away
+
+    Returns:
+        Callable[[F], F]: decorator
+    """
+    gate = GATES[work]
+
+    def decorator(func: F) -> F:
+        if not ADMISSION:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            try:
+                ticket = gate.enter(client_id(), request_cost())
+            except Busy as err:
+                if flask.has_request_context():
+                    flask.g.admission_retry_after = err.retry_after
+                return busy(str(err))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                gate.leave(ticket)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def admit_response(
+    work: str,
+    cost: float,
+    busy: Callable[[str], flask.Response],
+    respond: Callable[[], flask.Response],
+) -> flask.Response:
+    """Build a Flask route's response only when the request is admitted.
+
+    The slot is held until the server closes the response, so a streamed
+    response counts against the class's concurrency for as long as it streams.
+
+    Args:
+        work (str): class of work, a key of ``GATES``
+        cost (float): tokens the request takes, at most the class's burst
+        busy (Callable[[str], flask.Response]): builds the response, e.g. a
+            429, from the message to show when the request is turned away
+        respond (Callable[[], flask.Response]): builds the admitted response
+
+    Returns:
+        flask.Response: ``respond``'s response, or ``busy``'s with
+            ``Retry-After`` and ``X-Bonham-Admission`` headers
+    """
+    if not ADMISSION:
+        return respond()
+    gate = GATES[work]
+    try:
+        ticket = gate.enter(client_id(), cost)
+    except Busy as err:
+        flask.g.admission_retry_after = err.retry_after
+        return _mark_rejected(busy(str(err)))
+    try:
+        response = respond()
+    except BaseException:
+        gate.leave(ticket)
+        raise
+    response.call_on_close(lambda: gate.leave(ticket))
+    return response
+
+
+def _mark_rejected(response: flask.Response) -> flask.Response:
+    retry_after: Optional[int] = flask.g.get("admission_retry_after")
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(retry_after)
+        response.headers["X-Bonham-Admission"] = "rejected"
+    return response
+
+
+def register(server: flask.Flask) -> None:
+    """Add ``Retry-After`` headers to responses of turned-away calls.
+
+    Args:
+        server (flask.Flask): the Dash app's Flask server
+    """
+    server.after_request(_mark_rejected)
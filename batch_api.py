@@ -0,0 +1,264 @@
+"""
+JSON batch endpoint for headless clients, registered on each app's server.
+
+``POST /api/batch`` takes many datasets in one request and streams one NDJSON
+result line back per dataset, in completion order, as soon as each is done.
+The body is either JSON (a list of datasets, or ``{"datasets": [...]}``) or
+NDJSON (``Content-Type: application/x-ndjson``, one dataset per line). NDJSON
+is read line by line as it arrives, so fitting starts before a large upload
+has finished. ``BONHAM_BATCH_MAX_BYTES`` caps the bytes read whether or not
+the client sends a Content-Length, and no NDJSON line may be longer than
+``BONHAM_BATCH_MAX_LINE_BYTES``; past either limit reading stops with an
+error line. Each result line is
+
+    {"index": 0, "id": ..., "ok": true, "result": {...}}
+
+or, for a dataset that could not be processed,
+
+    {"index": 0, "id": ..., "ok": false, "error": "..."}
+
+where ``index`` is the dataset's position in the request and ``id`` echoes
+the dataset's own ``id`` field, if any. Each dataset is solved on its own by
+the app's solver, the same code the UI runs. Datasets run on a bounded thread
+pool with a bounded number in flight per request, so one large batch cannot
+tie up a worker's memory or starve the interactive callbacks. Fitting holds
+the GIL for much of its time, so the threads overlap reading and writing the
+stream with fitting rather than fitting several datasets in parallel.
+
+Requests are admitted as ``fit`` work (see ``admission``) before anything is
+streamed: a JSON body costs a token per dataset and an NDJSON body, whose
+length is not known up front, the class's whole burst. An admitted request
+holds one ``fit`` slot until its response is closed; one turned away gets a
+429 with ``Retry-After``.
+"""
+
+import json
+import os
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Set, Tuple
+
+import flask
+import numpy as np
+
+import admission
+import metrics
+
+BATCH_THREADS: int = int(os.environ.get("BONHAM_BATCH_THREADS", "2"))
+MAX_IN_FLIGHT: int = 4 * BATCH_THREADS  # per request
+MAX_DATASETS: int = int(os.environ.get("BONHAM_BATCH_MAX_DATASETS", "10000"))
+MAX_BODY_BYTES: int = int(
+    os.environ.get("BONHAM_BATCH_MAX_BYTES", str(64 * 1024 * 1024))
+)
+MAX_LINE_BYTES: int = int(
+    os.environ.get("BONHAM_BATCH_MAX_LINE_BYTES", str(8 * 1024 * 1024))
+)
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/ndjson")
+
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+Dataset = Dict[str, Any]
+Solver = Callable[[Dataset], Dict[str, Any]]
+
+_POOL = ThreadPoolExecutor(max_workers=BATCH_THREADS, thread_name_prefix="batch")
+
+
+class BodyTooLarge(ValueError):
+    """A request body over ``MAX_BODY_BYTES``."""
+
+
+def _ndjson_datasets() -> Iterator[Tuple[Any, Optional[str]]]:
+    stream = flask.request.stream
+    read = 0
+    while True:
+        # Chunked bodies have no Content-Length, so count what is read
+        line = stream.readline(MAX_LINE_BYTES + 1)
+        if not line:
+            return
+        read += len(line)
+        if read > MAX_BODY_BYTES:
+            yield (None, f"Request body over {MAX_BODY_BYTES} bytes; stopped reading")
+            return
+        if len(line) > MAX_LINE_BYTES and not line.endswith(b"\n"):
+            yield (None, f"Line over {MAX_LINE_BYTES} bytes; stopped reading")
+            return
+        if not line.strip():
+            continue
+        try:
+            yield (json.loads(line), None)
+        except ValueError as err:
+            yield (None, f"Invalid JSON: {err}")
+
+
+def read_datasets() -> Iterable[Tuple[Any, Optional[str]]]:
+    """Read the datasets in the current request body.
+
+    An NDJSON body is read lazily, line by line as it arrives; a JSON body is
+    parsed up front so that a malformed one can be rejected with a 400.
+
+    Raises:
+        BodyTooLarge: if the body is over ``MAX_BODY_BYTES``, by its
+            Content-Length or, for a JSON body, by what was read
+        ValueError: if a JSON body is not a list of datasets
+
+    Returns:
+        Iterable[Tuple[Any, Optional[str]]]: each dataset, or None with the
+            reason its line is unreadable; a list for a JSON body
+    """
+    if (flask.request.content_length or 0) > MAX_BODY_BYTES:
+        raise BodyTooLarge("Request body too large")
+    if flask.request.mimetype in NDJSON_TYPES:
+        return _ndjson_datasets()
+
+    data = flask.request.stream.read(MAX_BODY_BYTES + 1)
+    if len(data) > MAX_BODY_BYTES:
+        raise BodyTooLarge("Request body too large")
+    try:
+        body = json.loads(data)
+    except ValueError:
+        body = None
+    if isinstance(body, dict):
+        body = body.get("datasets")
+    if not isinstance(body, list):
+        raise ValueError('Expected a list of datasets or {"datasets": [...]}')
+    return [(dataset, None) for dataset in body]
+
+
+def admission_cost(datasets: Iterable[Tuple[Any, Optional[str]]]) -> float:
+    """Fit tokens a request takes: one a dataset, when the count is known.
+
+    Args:
+        datasets (Iterable[Tuple[Any, Optional[str]]]): from ``read_datasets``
+
+    Returns:
+        float: the dataset count for a JSON body, or the ``fit`` class's
+            burst for an NDJSON body that has not been read yet
+    """
+    if isinstance(datasets, list):
+        return float(max(1, len(datasets)))
+    return admission.GATES["fit"].limits.burst
+
+
+def admit(respond: Callable[[], flask.Response], cost: float) -> flask.Response:
+    """Build a route's response if the request is admitted as ``fit`` work,
+    else answer 429; see ``admission.admit_response``."""
+    return admission.admit_response(
+        "fit", cost, lambda message: error_response(message, 429), respond
+    )
+
+
+def xy_arrays(dataset: Dataset) -> Tuple[NDArray, NDArray]:
+    """Read a dataset's ``x`` list and its ``y`` list of values or replicates.
+
+    Args:
+        dataset (Dataset): with ``x``, one number per point, and ``y``, one
+            number or one list of replicates per point; null for blanks
+
+    Raises:
+        ValueError: if the values are not numeric or the shapes do not match
+
+    Returns:
+        Tuple[NDArray, NDArray]: x (N,) and y replicates (N, R), NaN for blanks
+    """
+    try:
+        x = np.asarray(dataset["x"], dtype=np.float64)
+        ys = np.asarray(dataset["y"], dtype=np.float64)
+    except ValueError as err:
+        raise ValueError(f"x and y must be numbers or lists of replicates: {err}")
+    if ys.ndim == 1:
+        ys = ys[:, np.newaxis]
+    if x.ndim != 1 or ys.ndim != 2:
+        raise ValueError("x must be a list of numbers, y a list of numbers or lists")
+    if len(x) != len(ys):
+        raise ValueError(f"{len(x)} x values but {len(ys)} y values")
+    return (x, ys)
+
+
+def error_response(message: str, status: int) -> flask.Response:
+    """JSON error body, for requests rejected before streaming starts."""
+    return flask.Response(
+        json.dumps({"error": message}), status=status, mimetype="application/json"
+    )
+
+
+def _line(record: Dict[str, Any]) -> str:
+    return json.dumps(record, allow_nan=False, separators=(",", ":")) + "\n"
+
+
+def _run(
+    solve: Solver, app_name: str, index: int, dataset: Any, error: Optional[str]
+) -> str:
+    """Solve one dataset and format its result line."""
+    dataset_id = dataset.get("id") if isinstance(dataset, dict) else None
+    record: Dict[str, Any] = {"index": index, "id": dataset_id}
+    if error is None and not isinstance(dataset, dict):
+        error = "Each dataset must be a JSON object"
+    if error is None:
+        try:
+            record.update(ok=True, result=solve(dataset))
+        except (ValueError, TypeError, KeyError, RuntimeError) as err:
+            error = f"Missing field {err}" if isinstance(err, KeyError) else str(err)
+        except Exception as err:  # an error line, never a cut-off stream
+            error = f"{type(err).__name__}: {err}"
+    if error is not None:
+        record.update(ok=False, error=error)
+    metrics.record_batch_item(app_name, error is None)
+    return _line(record)
+
+
+def _stream(
+    solve: Solver, app_name: str, datasets: Iterable[Tuple[Any, Optional[str]]]
+) -> Iterator[str]:
+    pending: Set["Future[str]"] = set()
+    try:
+        for index, (dataset, error) in enumerate(datasets):
+            if index >= MAX_DATASETS:
+                yield _line(
+                    {
+                        "index": index,
+                        "ok": False,
+                        "error": f"Batches are limited to {MAX_DATASETS} datasets",
+                    }
+                )
+                break
+            if len(pending) >= MAX_IN_FLIGHT:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+            pending.add(_POOL.submit(_run, solve, app_name, index, dataset, error))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+    finally:
+        for future in pending:  # client went away; drop work not yet started
+            future.cancel()
+
+
+def register(server: flask.Flask, app_name: str, solve: Solver) -> None:
+    """Add the ``/api/batch`` route to a server.
+
+    Args:
+        server (flask.Flask): the app's Flask server
+        app_name (str): app label for metrics
+        solve (Solver): turns one dataset into a JSON-ready result, raising
+            ValueError (or TypeError, KeyError, RuntimeError) with a message
+            for datasets it cannot use
+    """
+
+    def batch() -> flask.Response:
+        try:
+            datasets = read_datasets()
+        except BodyTooLarge as err:
+            return error_response(str(err), 413)
+        except ValueError as err:
+            return error_response(str(err), 400)
+        return admit(
+            lambda: flask.Response(
+                flask.stream_with_context(_stream(solve, app_name, datasets)),
+                mimetype="application/x-ndjson",
+            ),
+            admission_cost(datasets),
+        )
+
+    server.add_url_rule(
+        "/api/batch", f"bonham_batch_{app_name}", batch, methods=["POST"]
+    )
@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+
+"""
+Headless batch runner: fit directories of experiment files, or work out buffer
+recipes, without a browser.
+
+Each input file is one experiment, read like an upload to the apps (CSV, TSV,
+XLSX or plate-reader export; X in the first column, replicates in the rest)
+and fitted with the app's candidate models. For ``buffer``, each row of each
+input CSV is one recipe, with a column per calculator field. Files are spread
+over a pool of worker processes, each of which imports the app once, and the
+results are written as they arrive to one CSV, Parquet or Arrow file (by the
+output's extension): one row per fitted model, or per recipe. With a robust
+``--loss``, each worker reads a chunk of files and fits every candidate model
+to all of their curves at once.
+
+Usage:
+    python batch_run.py michaelis experiments/ --output fits.csv --jobs 8
+    python batch_run.py dose plates/*.xlsx --output fits.parquet --plots plots/
+    python batch_run.py dose plates/ --output fits.csv --loss huber
+    python batch_run.py buffer recipes.csv --output volumes.arrow
+"""
+
+import argparse
+import csv
+import importlib.util
+import io
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import ModuleType
+from typing import IO, Any, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import loadtest
+
+ROOT = Path(__file__).resolve().parent
+APP_FILES = {
+    "michaelis": "dashmichaelis.py",
+    "dose": "dbc-dose.py",
+    "buffer": "dbc-buffer.py",
+}
+INPUT_SUFFIXES = (".csv", ".tsv", ".tab", ".txt", ".xlsx", ".xlsm")
+PLOT_FORMATS = ("png", "svg", "pdf")
+ARROW_BATCH_ROWS = 4096
+CURVES_PER_CHUNK = 64  # files fitted together by one worker for robust losses
+
+# Each worker fits with one thread; the process pool provides the parallelism.
+# OpenBLAS reads these once, when NumPy loads it, and forked workers keep the
+# parent's thread count, so nothing here imports NumPy (or pyarrow, which
+# loads it) before ``apply_worker_environment``.
+WORKER_ENVIRONMENT = {
+    "BONHAM_ADMISSION_DB": "",
+    "BONHAM_SESSION_DB": "",
+    "OMP_NUM_THREADS": "1",
+    "OPENBLAS_NUM_THREADS": "1",
+    "MKL_NUM_THREADS": "1",
+}
+
+Row = Dict[str, Any]
+Column = Tuple[str, str]  # name, "str" / "int" / "float" / "bool"
+
+_kind = ""  # this worker's run kind
+_app: Optional[ModuleType] = None  # and its app module
+_plots: Optional[Tuple[Path, str]] = None  # image directory and format
+_loss = "linear"  # and fit loss
+
+
+def columns_for(kind: str) -> List[Column]:
+    """Output columns for a kind of run.
+
+    Args:
+        kind (str): "michaelis", "dose" or "buffer"
+
+    Returns:
+        List[Column]: column names and types, in output order
+    """
+    columns: List[Column] = [("file", "str"), ("status", "str"), ("error", "str")]
+    if kind == "buffer":
+        return columns + [
+            ("row", "int"),
+            ("buffer_volume", "float"),
+            ("titrant", "str"),
+            ("titrant_volume", "float"),
+            ("water_volume", "float"),
+        ]
+
+    import models
+
+    registry = models.MICHAELIS_MODELS if kind == "michaelis" else models.DOSE_MODELS
+    parameters: List[str] = []
+    for model in registry.values():
+        parameters += [name for name in model.parameters if name not in parameters]
+    columns += [
+        ("rank", "int"),
+        ("model", "str"),
+        ("best", "bool"),
+        ("points", "int"),
+        ("r_squared", "float"),
+        ("aicc", "float"),
+        ("bic", "float"),
+        ("weight", "float"),
+        ("loss", "str"),
+        ("downweighted", "int"),
+    ]
+    for name in parameters:
+        columns += [(name, "float"), (f"{name}_error", "float")]
+    return columns
+
+
+def find_inputs(paths: Sequence[Path], kind: str) -> List[Tuple[Path, Path]]:
+    """Expand input paths, walking directories for experiment files.
+
+    Args:
+        paths (Sequence[Path]): files and directories
+        kind (str): run kind; buffer runs read text files only
+
+    Returns:
+        List[Tuple[Path, Path]]: each file and its path relative to the input
+            it was found under, sorted
+    """
+    suffixes = INPUT_SUFFIXES[:4] if kind == "buffer" else INPUT_SUFFIXES
+    found: List[Tuple[Path, Path]] = []
+    for path in paths:
+        if path.is_dir():
+            found += sorted(
+                (item, item.relative_to(path))
+                for item in path.rglob("*")
+                if item.is_file() and item.suffix.lower() in suffixes
+            )
+        else:
+            found.append((path, Path(path.name)))
+    return found
+
+
+def _init_worker(kind: str, plots: Optional[Tuple[Path, str]], loss: str) -> None:
+    global _kind, _app, _plots, _loss
+    _kind = kind
+    _app = loadtest.load_app_module(ROOT / APP_FILES[kind])
+    _plots = plots
+    _loss = loss
+
+
+def _write_plot(figure: Any, relative: Path) -> Optional[str]:
+    """Save a figure under the plot directory, returning any failure message."""
+    assert _plots is not None
+    import plotly.graph_objs as go
+
+    directory, image_format = _plots
+    target = (directory / relative).with_suffix(f".{image_format}")
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        go.Figure(figure).write_image(str(target), format=image_format)
+    except (ValueError, RuntimeError, OSError) as err:
+        return f"Plot failed: {err}"
+    return None
+
+
+def _read_curve(path: Path) -> Tuple[Any, Any, Any, str]:
+    """Read one experiment file as its usable x, y, y std dev and x title."""
+    assert _app is not None
+    import uploads
+
+    upload = uploads.parse_bytes(path.read_bytes(), path.name, min_points=3)
+    x, ys = upload.matrix[:, 0], upload.matrix[:, 1:]
+    if _kind == "michaelis":
+        x, y, y_std = _app.usable_points(x, ys)
+    else:
+        (x, y), y_std = _app.usable_points(x, ys), None
+    return (x, y, y_std, upload.names[0] or "Concentration")
+
+
+def _fit_rows(path: Path, relative: Path) -> List[Row]:
+    assert _app is not None
+    import models
+
+    x, y, y_std, x_title = _read_curve(path)
+    registry = models.MICHAELIS_MODELS if _kind == "michaelis" else models.DOSE_MODELS
+    fits = models.fit_models(
+        list(registry.values()), x, y, y_std, app_name=_kind, loss=_loss
+    )
+    return _result_rows(path, relative, (x, y, y_std), fits, x_title)
+
+
+def _result_rows(
+    path: Path,
+    relative: Path,
+    curve: Tuple[Any, Any, Any],
+    fits: List[Any],
+    x_title: str,
+) -> List[Row]:
+    """Output rows for one file's fits, saving its plot if asked to."""
+    assert _app is not None
+    import models
+
+    x, y, y_std = curve
+    plot_error = None
+    if _plots is not None and _kind == "michaelis":
+        data, layout = _app.generate_figure(
+            x, y, y_std, fits[0], x_title, "Enzyme Activity"
+        )
+        plot_error = _write_plot({"data": data, "layout": layout}, relative)
+    elif _plots is not None:
+        plot_error = _write_plot(_app.dose_figure(x, y, fits), relative)
+
+    rows: List[Row] = []
+    for rank, summary in enumerate(models.fit_summary(fits), start=1):
+        row: Row = {
+            "file": str(path),
+            "status": "ok",
+            "error": plot_error,
+            "rank": rank,
+            "model": summary["model"],
+            "best": rank == 1,
+            "points": len(x),
+        }
+        for key in ("r_squared", "aicc", "bic", "weight", "loss"):
+            row[key] = summary[key]
+        row["downweighted"] = len(summary["downweighted"])
+        for name, value in summary["parameters"].items():
+            row[name] = value
+            row[f"{name}_error"] = summary["errors"][name]
+        rows.append(row)
+    return rows
+
+
+def _buffer_rows(path: Path) -> List[Row]:
+    assert _app is not None
+    text = path.read_text(encoding="utf-8-sig")
+    delimiter = "\t" if path.suffix.lower() in (".tsv", ".tab") else ","
+    rows: List[Row] = []
+    for i, fields in enumerate(csv.DictReader(io.StringIO(text), delimiter=delimiter)):
+        row: Row = {"file": str(path), "row": i + 1}
+        try:
+            row.update(_app.solve_dataset(fields), status="ok")
+        except ValueError as err:
+            row.update(status="error", error=str(err))
+        rows.append(row)
+    return rows
+
+
+def process(item: Tuple[Path, Path]) -> List[Row]:
+    """Fit one file, or work out its recipes, in a worker process.
+
+    Args:
+        item (Tuple[Path, Path]): file and its relative path, for plot names
+
+    Returns:
+        List[Row]: output rows; one error row if the file could not be used
+    """
+    path, relative = item
+    try:
+        if _kind == "buffer":
+            return _buffer_rows(path)
+        return _fit_rows(path, relative)
+    except (ValueError, RuntimeError, OSError) as err:
+        return [{"file": str(path), "status": "error", "error": str(err)}]
+
+
+def process_chunk(items: List[Tuple[Path, Path]]) -> List[Row]:
+    """Fit a chunk of files together with a robust loss, in a worker process.
+
+    Every file is read first; each candidate model is then fitted to all of
+    the usable curves in one vectorized batch.
+
+    Args:
+        items (List[Tuple[Path, Path]]): files and their relative paths
+
+    Returns:
+        List[Row]: output rows for every file, in order; one error row for
+            each file that could not be read or fitted
+    """
+    import models
+
+    registry = models.MICHAELIS_MODELS if _kind == "michaelis" else models.DOSE_MODELS
+    read: List[Tuple[Path, Path, Tuple[Any, Any, Any], str]] = []
+    errors: Dict[Path, str] = {}
+    for path, relative in items:
+        try:
+            x, y, y_std, x_title = _read_curve(path)
+        except (ValueError, OSError) as err:
+            errors[path] = str(err)
+            continue
+        read.append((path, relative, (x, y, y_std), x_title))
+    batch = models.fit_batch(
+        list(registry.values()), [curve for _, _, curve, _ in read], _loss, _kind
+    )
+    fitted = {
+        path: _result_rows(path, relative, curve, fits, x_title)
+        for (path, relative, curve, x_title), fits in zip(read, batch)
+        if fits
+    }
+    rows: List[Row] = []
+    for path, _ in items:
+        if path in fitted:
+            rows += fitted[path]
+        else:
+            error = errors.get(path, "No model could be fitted to the data")
+            rows.append({"file": str(path), "status": "error", "error": error})
+    return rows
+
+
+class CsvSink:
+    """Write rows to CSV as they arrive."""
+
+    def __init__(self, path: Path, columns: List[Column]) -> None:
+        self._file: IO[str] = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, [name for name, _ in columns])
+        self._writer.writeheader()
+
+    def write(self, rows: List[Row]) -> None:
+        self._writer.writerows(rows)
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class ArrowSink:
+    """Write rows to Parquet or an Arrow IPC file in record batches."""
+
+    TYPES = {"str": "string", "int": "int64", "float": "float64", "bool": "bool_"}
+
+    def __init__(self, path: Path, columns: List[Column]) -> None:
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        self._schema = pyarrow.schema(
+            [(name, getattr(pyarrow, self.TYPES[kind])()) for name, kind in columns]
+        )
+        self._pending: List[Row] = []
+        self._writer: Any
+        if path.suffix.lower() == ".parquet":
+            self._writer = pyarrow.parquet.ParquetWriter(str(path), self._schema)
+        else:
+            self._writer = pyarrow.ipc.new_file(str(path), self._schema)
+
+    def write(self, rows: List[Row]) -> None:
+        self._pending += rows
+        if len(self._pending) >= ARROW_BATCH_ROWS:
+            self._flush()
+
+    def _flush(self) -> None:
+        import pyarrow
+
+        if self._pending:
+            batch = pyarrow.RecordBatch.from_pylist(self._pending, schema=self._schema)
+            self._writer.write_batch(batch)
+            self._pending = []
+
+    def close(self) -> None:
+        self._flush()
+        self._writer.close()
+
+
+def run(
+    kind: str,
+    inputs: List[Tuple[Path, Path]],
+    output: Path,
+    jobs: int,
+    plots: Optional[Tuple[Path, str]] = None,
+    loss: str = "linear",
+) -> Tuple[int, int]:
+    """Process every input on a pool of worker processes.
+
+    Args:
+        kind (str): "michaelis", "dose" or "buffer"
+        inputs (List[Tuple[Path, Path]]): files and relative paths
+        output (Path): .csv, .parquet or .arrow/.feather results file
+        jobs (int): worker processes
+        plots (Optional[Tuple[Path, str]]): image directory and format
+        loss (str): fit loss; robust losses fit files in chunks
+
+    Returns:
+        Tuple[int, int]: rows written and error rows among them
+    """
+    apply_worker_environment()  # in case NumPy is not loaded yet
+    columns = columns_for(kind)
+    sink: Union[CsvSink, ArrowSink]
+    if output.suffix.lower() == ".csv":
+        sink = CsvSink(output, columns)
+    else:
+        sink = ArrowSink(output, columns)
+
+    written = errors = 0
+    chunksize = max(1, min(32, len(inputs) // (jobs * 8)))
+    with ProcessPoolExecutor(
+        jobs, initializer=_init_worker, initargs=(kind, plots, loss)
+    ) as pool:
+        results: Iterator[List[Row]]
+        if kind != "buffer" and loss != "linear":
+            size = max(1, min(CURVES_PER_CHUNK, -(-len(inputs) // jobs)))
+            chunks = [inputs[i : i + size] for i in range(0, len(inputs), size)]
+            results = pool.map(process_chunk, chunks)
+        else:
+            results = pool.map(process, inputs, chunksize=chunksize)
+        for rows in results:
+            sink.write(rows)
+            written += len(rows)
+            errors += sum(row["status"] == "error" for row in rows)
+    sink.close()
+    return (written, errors)
+
+
+def apply_worker_environment() -> None:
+    """Make worker processes single-threaded; call before NumPy is imported."""
+    for name, value in WORKER_ENVIRONMENT.items():
+        os.environ.setdefault(name, value)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    apply_worker_environment()
+    import robust
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("kind", choices=sorted(APP_FILES))
+    parser.add_argument("inputs", nargs="+", type=Path, help="files or directories")
+    parser.add_argument("--output", type=Path, default=Path("results.csv"))
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--plots", type=Path, help="also save each fit's figure here")
+    parser.add_argument("--plot-format", choices=PLOT_FORMATS, default="png")
+    parser.add_argument(
+        "--loss",
+        choices=list(robust.LOSSES),
+        default="linear",
+        help="robust loss to downweight outliers (default: least squares)",
+    )
+    args = parser.parse_args(argv)
+
+    suffix = args.output.suffix.lower()
+    if suffix not in (".csv", ".parquet", ".arrow", ".feather"):
+        parser.error("--output must end in .csv, .parquet, .arrow or .feather")
+    if suffix != ".csv" and importlib.util.find_spec("pyarrow") is None:
+        parser.error("Parquet and Arrow output need the optional pyarrow package")
+    if args.loss != "linear" and args.kind == "buffer":
+        parser.error("--loss applies to fits only")
+    if args.plots is not None:
+        if args.kind == "buffer":
+            parser.error("--plots applies to fits only")
+        try:
+            import kaleido  # noqa: F401
+        except ImportError:
+            parser.error("--plots needs the optional kaleido package")
+
+    inputs = find_inputs(args.inputs, args.kind)
+    if not inputs:
+        parser.error("No input files found")
+    plots = (args.plots, args.plot_format) if args.plots is not None else None
+
+    start = time.perf_counter()
+    written, errors = run(args.kind, inputs, args.output, args.jobs, plots, args.loss)
+    print(
+        f"{len(inputs)} files, {written} rows ({errors} errors) written to "
+        f"{args.output} in {time.perf_counter() - start:.1f} s",
+        file=sys.stderr,
+    )
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
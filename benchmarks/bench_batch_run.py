@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark how the headless batch runner scales with worker processes.
+
+Writes a directory of simulated Michaelis-Menten experiments (8 substrate
+concentrations, 3 replicates each) to a temporary directory and runs
+batch_run.run over it with 1, 2, 4... workers up to the CPU count, printing
+files per second and the speedup over one worker.
+
+Usage:
+    python benchmarks/bench_batch_run.py [--files 2000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import batch_run  # noqa: E402
+
+batch_run.apply_worker_environment()  # before NumPy, as batch_run.main does
+
+import numpy as np  # noqa: E402
+
+SUBSTRATE = np.array([0.5, 1, 2, 5, 10, 20, 50, 100.0])
+VMAX, KM = 10.0, 3.0
+
+
+def write_experiments(directory: Path, n_files: int) -> None:
+    rng = np.random.default_rng(0)
+    rates = VMAX * SUBSTRATE / (KM + SUBSTRATE)
+    for i in range(n_files):
+        replicates = rates[:, np.newaxis] * (1 + rng.normal(0, 0.03, (8, 3)))
+        lines = ["Substrate,Rate 1,Rate 2,Rate 3"] + [
+            f"{s:g}," + ",".join(f"{r:.5f}" for r in row)
+            for s, row in zip(SUBSTRATE, replicates)
+        ]
+        (directory / f"run{i:05d}.csv").write_text("\n".join(lines) + "\n")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark batch runner scaling")
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--max-jobs", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        (root / "in").mkdir()
+        write_experiments(root / "in", args.files)
+        inputs = batch_run.find_inputs([root / "in"], "michaelis")
+
+        jobs, baseline = 1, 0.0
+        while jobs <= args.max_jobs:
+            start = time.perf_counter()
+            batch_run.run("michaelis", inputs, root / "out.csv", jobs)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                f"{jobs:>3} workers: {len(inputs) / elapsed:7.0f} files/s, "
+                f"{baseline / elapsed:4.2f}x"
+            )
+            jobs *= 2
+
+
+if __name__ == "__main__":
+    main()
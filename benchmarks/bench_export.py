@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark figure export: renderer startup, warm renders, cache hits, reports.
+
+Builds simulated dose-response fits with the dose app's own figure code and
+times rendering each to PNG with a fresh Kaleido browser per image (what the
+renderer pool avoids), on the pool's long-lived renderers, and again from the
+image cache. Then streams an HTML report of the same datasets, printing the
+time to its first page and to the whole document.
+
+Usage:
+    python benchmarks/bench_export.py [--figures 20]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import figure_export  # noqa: E402
+import loadtest  # noqa: E402
+
+LOG_DOSES = np.linspace(-3.0, 3.0, 12)
+
+
+def datasets(n: int) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(0)
+    result = []
+    for i in range(n):
+        log_ec50 = rng.uniform(-1.0, 1.0)
+        y = 1 / (1 + 10 ** (log_ec50 - LOG_DOSES)) + rng.normal(0, 0.03, 12)
+        result.append({"id": f"well {i}", "x": LOG_DOSES.tolist(), "y": y.tolist()})
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark figure export")
+    parser.add_argument("--figures", type=int, default=20)
+    args = parser.parse_args()
+    if figure_export.PlotlyScope is None:
+        sys.exit("Figure export needs kaleido: pip install .[plots]")
+
+    app = loadtest.load_app_module(ROOT / "dbc-dose.py")
+    data = datasets(args.figures)
+    figures = [app.dataset_figure(dataset) for dataset in data]
+    figure_export.CACHE = figure_export.ImageCache(directory=None)
+
+    cold = min(3, len(figures))
+    start = time.perf_counter()
+    for figure in figures[:cold]:
+        scope = figure_export.PlotlyScope(
+            plotlyjs=figure_export.PLOTLY_JS, mathjax=False
+        )
+        scope.transform(json.loads(figure_export.figure_json(figure)), format="png")
+        scope._shutdown_kaleido()
+    per_cold = (time.perf_counter() - start) / cold
+    print(f"new browser per image:  {per_cold * 1000:7.1f} ms/image")
+
+    warm_up = figures[: figure_export.RENDER_PROCESSES]  # start every browser
+    for future in [figure_export.render_async(figure) for figure in warm_up]:
+        figure_export.wait_for(future)
+    figure_export.CACHE = figure_export.ImageCache(directory=None)
+    for label in ("renderer pool (warm):", "image cache hits:"):
+        start = time.perf_counter()
+        futures = [figure_export.render_async(figure) for figure in figures]
+        for future in futures:
+            figure_export.wait_for(future)
+        per_image = (time.perf_counter() - start) / len(figures)
+        print(f"{label:<23} {per_image * 1000:7.1f} ms/image")
+
+    figure_export.CACHE = figure_export.ImageCache(directory=None)
+    start = time.perf_counter()
+    pages = figure_export._pages(
+        app.dataset_figure, "dose", "svg", iter([(d, None) for d in data])
+    )
+    first = 0.0
+    for chunk in figure_export.html_report(pages, "svg"):
+        if not first and chunk.startswith("<section>"):
+            first = time.perf_counter() - start
+    total = time.perf_counter() - start
+    print(
+        f"HTML report of {len(data)} fits: first page after {first * 1000:.0f} ms, "
+        f"complete after {total * 1000:.0f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark Fealden searches in a fresh interpreter against the warm worker pool.
+
+Times the same short search run in a new Python process each time (importing
+Fealden and its folding backend on every run), then on ``fealden_workers``'
+pool once its workers have started. The difference is the per-run overhead the
+pool removes, together with the folding cache hits of repeat searches.
+Needs Fealden importable as ``fealden.fealden.fealden``.
+
+Usage:
+    python benchmarks/bench_fealden_workers.py [--runs 5] [--sequence CACGTG]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import fealden_workers  # noqa: E402
+
+COLD_RUN = (
+    "import sys; import fealden_workers; "
+    "fealden_workers.search(sys.argv[1], 50, False, sys.argv[2])"
+)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark Fealden workers")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--sequence", default="CACGTG")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        output = str(Path(directory) / "results.csv")
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            subprocess.run(
+                [sys.executable, "-c", COLD_RUN, args.sequence, output],
+                cwd=ROOT,
+                env={**os.environ, "BONHAM_FOLD_CACHE": ""},  # cold means uncached
+                check=True,
+            )
+        cold = (time.perf_counter() - start) / args.runs
+        print(f"fresh interpreter per run: {cold * 1000:8.1f} ms/run")
+
+        pool = fealden_workers.POOL
+        pool.size = max(pool.size, 1)
+        pool.max_runs = max(pool.max_runs, args.runs + 1)
+        first = fealden_workers.run(args.sequence, 50, False, output)
+        start = time.perf_counter()
+        for _ in range(args.runs):
+            stats = fealden_workers.run(args.sequence, 50, False, output)
+        warm = (time.perf_counter() - start) / args.runs
+        print(f"warm worker pool:          {warm * 1000:8.1f} ms/run")
+        print(f"overhead removed per run:  {(cold - warm) * 1000:8.1f} ms")
+        print(
+            f"folding cache hits: {first.hit_rate:.0%} on the first search, "
+            f"{stats.hit_rate:.0%} on repeats"
+        )
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark the compiled model kernels against their NumPy fallback.
+
+Runs itself once with BONHAM_JIT=0 and once with every size compiled (Numba,
+if installed), timing each worker's import (compile or cache load), one
+evaluation of a 4-parameter logistic with its Jacobian and fit statistics at
+a range of data sizes, and a whole dose-response model comparison. Prints
+both side by side and the largest size up to which the compiled kernels win,
+which is where BONHAM_JIT_MAX_POINTS belongs.
+
+Usage:
+    python benchmarks/bench_kernels.py [--repeat 200]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import timeit
+from pathlib import Path
+from typing import Any, Dict
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+SIZES = (8, 32, 128, 512, 2048, 8192, 32768, 131072)
+PARAMETERS = (1.0, 10.0, 2.2, 1.0)
+
+
+def measure(repeat: int) -> Dict[str, Any]:
+    """Time the kernels in this process, with whichever backend is active."""
+    start = time.perf_counter()
+    sys.path.insert(0, str(ROOT))
+    import kernels
+    import models
+
+    results: Dict[str, Any] = {
+        "jit": kernels.JIT_ENABLED,
+        "import_ms": (time.perf_counter() - start) * 1000,
+        "per_call_us": {},
+    }
+    rng = np.random.default_rng(0)
+    for size in SIZES:
+        x = np.linspace(0.0, 5.0, size)
+        y = kernels.logistic_4pl(x, *PARAMETERS) + rng.normal(0, 0.2, size)
+        weights = np.ones_like(y)
+
+        def evaluate() -> None:
+            fitted = kernels.logistic_4pl(x, *PARAMETERS)
+            kernels.logistic_4pl_jac(x, *PARAMETERS)
+            kernels.fit_statistics(y, fitted, weights)
+
+        number = max(1, repeat * 512 // size)
+        best = min(timeit.repeat(evaluate, number=number, repeat=5)) / number
+        results["per_call_us"][str(size)] = best * 1e6
+
+    x = np.linspace(0.0, 5.0, 12)
+    y = kernels.logistic_4pl(x, *PARAMETERS) + rng.normal(0, 0.2, 12)
+    candidates = list(models.DOSE_MODELS.values())
+    best = min(
+        timeit.repeat(
+            lambda: models.fit_models(candidates, x, y), number=repeat, repeat=5
+        )
+    )
+    results["comparison_ms"] = best / repeat * 1000
+    return results
+
+
+def run_worker(jit: bool, repeat: int) -> Dict[str, Any]:
+    env = dict(os.environ, BONHAM_JIT="1" if jit else "0")
+    env["BONHAM_JIT_MAX_POINTS"] = str(max(SIZES))
+    output = subprocess.run(
+        [sys.executable, __file__, "--worker", "--repeat", str(repeat)],
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    result: Dict[str, Any] = json.loads(output)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark compiled kernels")
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(measure(args.repeat)))
+        return
+
+    numpy_run = run_worker(False, args.repeat)
+    jit_run = run_worker(True, args.repeat)
+    if not jit_run["jit"]:
+        print("Numba is not installed; only the NumPy kernels were timed")
+    print(f"import: NumPy {numpy_run['import_ms']:.0f} ms, ", end="")
+    print(f"JIT {jit_run['import_ms']:.0f} ms (compiles once, then loads from cache)")
+
+    print(f"{'points':>8} {'NumPy us':>10} {'JIT us':>10} {'speedup':>8}")
+    crossover, behind = 0, False
+    for size in SIZES:
+        slow = numpy_run["per_call_us"][str(size)]
+        fast = jit_run["per_call_us"][str(size)]
+        print(f"{size:>8} {slow:>10.1f} {fast:>10.1f} {slow / fast:>7.2f}x")
+        behind = behind or fast >= slow
+        if not behind:
+            crossover = size
+    if crossover:
+        print(f"JIT kernels win up to {crossover} points")
+    else:
+        print("JIT kernels win at none of these sizes")
+
+    print(
+        f"dose-response model comparison (12 points, 3 models): "
+        f"NumPy {numpy_run['comparison_ms']:.2f} ms, "
+        f"JIT {jit_run['comparison_ms']:.2f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
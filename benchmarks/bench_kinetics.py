@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark initial-rate extraction from kinetic plate-reader runs.
+
+Times kinetics.initial_rates on a simulated 384-well x 200-timepoint run
+(with a lag phase, substrate depletion and read noise) and checks that the
+Michaelis-Menten parameters fitted to the extracted rates are close to the
+ones the run was simulated with.
+
+Usage:
+    python benchmarks/bench_kinetics.py [--wells 384] [--timepoints 200]
+"""
+
+import argparse
+import sys
+import timeit
+from pathlib import Path
+from typing import Tuple
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import dashmichaelis  # noqa: E402
+import kinetics  # noqa: E402
+import models  # noqa: E402
+from kinetics import NDArray  # noqa: E402
+
+VMAX, KM = 0.001, 5.0
+
+
+def simulate(n_wells: int, n_times: int) -> Tuple[NDArray, NDArray, NDArray]:
+    rng = np.random.default_rng(0)
+    times: NDArray = np.arange(n_times, dtype=np.float64) * 30.0
+    concentrations: NDArray = np.repeat(np.geomspace(0.5, 100, n_wells // 4), 4)
+    rates = VMAX * concentrations / (KM + concentrations)
+    elapsed = np.clip(times - 60.0, 0.0, None)[:, np.newaxis]  # one-minute lag
+    product = concentrations * (1 - np.exp(-rates * elapsed / concentrations))
+    signals: NDArray = (
+        0.1 + product + rng.normal(0, 0.002, (n_times, len(concentrations)))
+    )
+    return times, signals, concentrations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark rate extraction")
+    parser.add_argument("--wells", type=int, default=384)
+    parser.add_argument("--timepoints", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    times, signals, concentrations = simulate(args.wells, args.timepoints)
+    best = min(
+        timeit.repeat(
+            lambda: kinetics.initial_rates(times, signals),
+            number=1,
+            repeat=args.repeat,
+        )
+    )
+    print(f"{signals.shape[1]} wells x {len(times)} points: {best * 1000:.1f} ms")
+
+    rates, _ = kinetics.initial_rates(times, signals)
+    matrix = kinetics.rates_by_concentration(concentrations, rates)
+    y, y_std = dashmichaelis.clean_up_y_data(matrix[:, 1:])
+    fit = models.fit_model(
+        models.MICHAELIS_MODELS["michaelis_menten"], matrix[:, 0], y, y_std
+    )
+    assert fit is not None
+    vmax, km = fit.variables
+    print(f"Vmax {vmax:.4g} (simulated {VMAX}), Km {km:.4g} (simulated {KM})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark robust-loss fitting of a plate of dose-response curves.
+
+Simulates a plate of 4-parameter logistic curves, each with one gross
+outlier, and fits the dose models to every curve: one curve_fit call per
+curve and model (what the apps do for least squares), then one vectorized
+batch per model with each loss. Prints the time per plate, the cost of each
+robust loss relative to the least-squares batch, the median EC50 error and
+how many of the planted outliers were flagged.
+
+Usage:
+    python benchmarks/bench_robust.py [--curves 384] [--repeat 3]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import List, Tuple
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import models  # noqa: E402
+import robust  # noqa: E402
+
+LOG_DOSES = np.linspace(-3.0, 3.0, 12)
+
+
+def plate(n: int) -> Tuple[List[models.Curve], np.ndarray, np.ndarray]:
+    """Simulated curves, their true log EC50s and outlier positions."""
+    rng = np.random.default_rng(0)
+    curves: List[models.Curve] = []
+    log_ec50s = rng.uniform(-1.0, 1.0, n)
+    outliers = rng.integers(2, len(LOG_DOSES) - 2, n)
+    for log_ec50, outlier in zip(log_ec50s, outliers):
+        y = 1 / (1 + 10 ** (log_ec50 - LOG_DOSES)) + rng.normal(0, 0.03, 12)
+        y[outlier] += rng.choice((-0.4, 0.4))
+        curves.append((LOG_DOSES, y, None))
+    return (curves, log_ec50s, outliers)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark robust fitting")
+    parser.add_argument("--curves", type=int, default=384)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    candidates = list(models.DOSE_MODELS.values())
+    curves, log_ec50s, outliers = plate(args.curves)
+    models.fit_batch(candidates, curves[:2], "huber")  # compile the kernels
+
+    start = time.perf_counter()
+    for x, y, _ in curves:
+        models.fit_models(candidates, x, y)
+    loop = time.perf_counter() - start
+    print(f"curve_fit per curve:    {loop * 1000:8.1f} ms/plate")
+
+    baseline = 0.0
+    for loss in robust.LOSSES:
+        best = np.inf
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            results = models.fit_batch(candidates, curves, loss)
+            best = min(best, time.perf_counter() - start)
+        baseline = baseline or best
+        fits = [
+            next(fit for fit in fitted if fit.model.name == "logistic_4pl")
+            for fitted in results
+        ]
+        error = np.median(  # Kd is the log EC50
+            [abs(fit.variables[2] - truth) for fit, truth in zip(fits, log_ec50s)]
+        )
+        flagged = np.mean(
+            [fit.downweighted[outlier] for fit, outlier in zip(fits, outliers)]
+        )
+        print(
+            f"{robust.LOSS_LABELS[loss] + ' batch:':<23} {best * 1000:8.1f} ms/plate"
+            f"  {best / baseline:4.2f}x  EC50 error {error:.3f}"
+            f"  outliers flagged {flagged:4.0%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
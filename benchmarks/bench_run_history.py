@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark run history lookups against a large index.
+
+Fills a temporary index with random runs, then times a page of results for
+each match mode, and for a substring too short for the trigram index (which
+scans). Indexing is timed in one transaction, as ``rebuild`` does, and one
+run at a time, as the app does; reading the CSVs a rebuild also does is not.
+
+Usage:
+    python benchmarks/bench_run_history.py [--runs 100000] [--repeat 50]
+"""
+
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import run_history  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark run history lookups")
+    parser.add_argument("--runs", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        history = run_history.RunHistory(str(Path(directory) / "history.sqlite3"))
+        sequences = [
+            "".join(rng.choice("ACGT") for _ in range(rng.randint(6, 40)))
+            for _ in range(args.runs)
+        ]
+        runs = [
+            {
+                "id": f"run-{number:07d}",
+                "started": float(number),
+                "sequence": sequence,
+                "status": "ok",
+            }
+            for number, sequence in enumerate(sequences)
+        ]
+        start = time.perf_counter()
+        history.add(*runs)  # as a rebuild does
+        fill = time.perf_counter() - start
+        print(f"rebuild:           {fill / args.runs * 1e6:8.1f} us/run")
+        start = time.perf_counter()
+        for run in runs[:100]:
+            history.add(run)  # as each finished run does
+        print(f"one run:           {(time.perf_counter() - start) * 10:8.2f} ms/run")
+
+        probe = sequences[args.runs // 2]
+        for label, query, match in [
+            ("exact", probe, "exact"),
+            ("prefix", probe[:5], "prefix"),
+            ("substring", probe[1:7], "substring"),
+            ("short substring", probe[1:3], "substring"),
+        ]:
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                _, total = history.search(query, match)
+            each = (time.perf_counter() - start) / args.repeat
+            print(f"{label + ':':<17} {each * 1000:8.2f} ms/page ({total} matches)")
+
+
+if __name__ == "__main__":
+    main()
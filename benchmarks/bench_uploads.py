@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark parsing of uploaded data files.
+
+Times uploads.parse_upload on a CSV of 100k points with three replicate
+columns, a few blanks and a metadata preamble, and on a plate-reader export,
+both as ``dcc.Upload`` delivers them (base64 data URLs).
+
+Usage:
+    python benchmarks/bench_uploads.py [--points 100000]
+"""
+
+import argparse
+import base64
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import uploads  # noqa: E402
+
+
+def data_url(text: str) -> str:
+    return "data:text/csv;base64," + base64.b64encode(text.encode()).decode()
+
+
+def make_csv(n_points: int) -> str:
+    rng = random.Random(0)
+    lines = ["Exported by plate reader", "Date,2024-01-01", "", "Conc,R1,R2,R3"]
+    for i in range(n_points):
+        x = i * 0.01
+        cells = [f"{12.0 * x / (1.5 + x) + rng.gauss(0, 0.4):.4f}" for _ in range(3)]
+        if rng.random() < 0.05:
+            cells[rng.randrange(3)] = ""
+        lines.append(",".join([f"{x:g}"] + cells))
+    return "\n".join(lines) + "\n"
+
+
+def make_plate() -> str:
+    lines = ["Read 1", "," + ",".join(str(i) for i in range(1, 13))]
+    for row in "ABCDEFGH":
+        lines.append(row + "," + ",".join(f"{i * 0.5:.3f}" for i in range(12)))
+    return "\n".join(lines) + "\n"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark upload parsing")
+    parser.add_argument("--points", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, contents in (
+        (f"csv, {args.points} points", data_url(make_csv(args.points))),
+        ("96-well plate", data_url(make_plate())),
+    ):
+        best = min(
+            timeit.repeat(
+                lambda: uploads.parse_upload(contents, "upload.csv"),
+                number=1,
+                repeat=args.repeat,
+            )
+        )
+        print(f"{name:>20}: {best * 1000:8.1f} ms")
+
+    assert len(uploads.parse_upload(data_url(make_plate()), "p.csv").matrix) == 12
+
+
+if __name__ == "__main__":
+    main()
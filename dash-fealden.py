@@ -1,16 +1,28 @@
+import math
 import time
+import uuid
 from pathlib import Path
-from typing import Tuple
+from typing import Any, Dict, List, Tuple
 
 import dash_bootstrap_components as dbc
 import pandas as pd
-from dash import Dash, Input, Output, State, dash_table, dcc, html
-from fealden.fealden.fealden import Fealden
+from dash import Dash, Input, Output, State, ctx, dash_table, dcc, html, no_update
+
+import admission
+import fealden_workers
+import http_cache
+import metrics
+import run_history
+import sampling_profiler
 
 # Set up dash server
 app = Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 app.title = "Fealden"
 server = app.server  # Export server for use by Passenger framework
+metrics.register(server)
+admission.register(server)
+sampling_profiler.register(server)
+run_history.register(server)
 
 # Components for Layout
 init_sequence_input = dbc.Row(
@@ -29,6 +41,60 @@ init_sequence_input = dbc.Row(
 
 form1 = dbc.Form(children=[init_sequence_input])
 
+HISTORY_COLUMNS = [
+    {"name": "Started", "id": "started"},
+    {"name": "Sequence", "id": "sequence"},
+    {"name": "Max length", "id": "max_length"},
+    {"name": "3' Fixed MB", "id": "fixed"},
+    {"name": "Seconds", "id": "seconds"},
+    {"name": "Status", "id": "status"},
+    {"name": "Designs", "id": "results"},
+    {"name": "Results", "id": "download", "presentation": "markdown"},
+]
+
+history = html.Div(
+    children=[
+        dbc.Row(
+            children=[
+                dbc.Col(
+                    dbc.Input(
+                        type="text",
+                        id="history-query",
+                        placeholder="Search past runs by sequence",
+                        debounce=True,
+                    ),
+                    md=8,
+                ),
+                dbc.Col(
+                    dbc.Select(
+                        id="history-match",
+                        options=[
+                            {"label": "Contains", "value": "substring"},
+                            {"label": "Starts with", "value": "prefix"},
+                            {"label": "Exactly", "value": "exact"},
+                        ],
+                        value="substring",
+                    ),
+                    md=4,
+                ),
+            ],
+            className="mb-2",
+        ),
+        dash_table.DataTable(
+            id="history-table",
+            columns=HISTORY_COLUMNS,
+            page_action="custom",
+            page_current=0,
+            page_size=run_history.PAGE_SIZE,
+            page_count=1,
+            markdown_options={"link_target": "_blank"},
+            style_table={"overflowX": "auto"},
+            style_cell={"font_family": "Arial", "text_align": "left"},
+        ),
+        dcc.Store(id="history-version"),
+    ]
+)
+
 intro = dcc.Markdown(
     """
 Experimental web-server for the [Fealden](https://github.com/Paradoxdruid/fealden)
@@ -109,6 +175,24 @@ app.layout = dbc.Container(
             style={"padding-top": "50px"},
             justify="center",
         ),
+        dbc.Row(
+            children=[
+                dbc.Col(
+                    dbc.Card(
+                        children=[
+                            dbc.CardHeader(html.H5("Past runs")),
+                            dbc.CardBody(history),
+                        ],
+                        className="shadow-lg border-primary mb-3",
+                    ),
+                    xs={"size": 12},
+                    sm={"size": 10},
+                    md={"size": 10},
+                    lg={"size": 8},
+                ),
+            ],
+            justify="center",
+        ),
     ],
     fluid=True,
     className="bg-secondary",
@@ -121,33 +205,56 @@ app.layout = dbc.Container(
     Output(component_id="output-div", component_property="children"),
     Output(component_id="recipe", component_property="is_open"),
     Output(component_id="recipe", component_property="color"),
+    Output(component_id="history-version", component_property="data"),
     [Input("submit-button", "n_clicks")],
     [
         State("sequence", "value"),
         State("max_length", "value"),
         State("fixed", "value"),
     ],
+    prevent_initial_call=True,  # page loads must not spend Fealden admissions
 )  # type: ignore[misc]
+@metrics.instrument("fealden")
+@sampling_profiler.sampled("fealden")
+@admission.admit("fealden", busy=lambda message: (message, True, "warning", no_update))
 def run_Fealden(
     n_clicks: int,
     _sequence: str,
     _max_length: int,
     _fixed: str,
-) -> Tuple[str, bool, str]:
+) -> Tuple[Any, bool, str, str]:
     # LOGIC
-
     fixed = False
     if _fixed == ["3' Fixed MB"]:
         fixed = True
 
-    this_output_file = f'./results/{time.strftime("%Y%m%d-%H%M%S")}-results.csv'
-
-    Fealden(_sequence, 1, int(_max_length), 500, False, this_output_file, fixed)
-
+    # Runs can now overlap, so the timestamp alone no longer names them uniquely
+    run_id = f'{time.strftime("%Y%m%d-%H%M%S")}-{uuid.uuid4().hex[:8]}'
+    this_output_file = f"./results/{run_id}-results.csv"
     results_path = Path.cwd() / this_output_file
 
+    started = time.time()
+    try:
+        stats = fealden_workers.run(
+            _sequence, int(_max_length), fixed, this_output_file
+        )
+    except fealden_workers.WorkerError as err:
+        run_history.HISTORY.record(
+            results_path,
+            _sequence,
+            int(_max_length),
+            fixed,
+            started,
+            time.time() - started,
+            str(err),
+        )
+        return (f"Run failed for: {_sequence}: {err}", True, "danger", run_id)
+    run_history.HISTORY.record(
+        results_path, _sequence, int(_max_length), fixed, started, time.time() - started
+    )
+
     if not results_path.exists():
-        output = f"Run failed for: {_sequence}, {_fixed}, {results_path}"
+        output: Any = f"Run failed for: {_sequence}, {_fixed}, {results_path}"
     else:
         df = pd.read_csv(results_path)
 
@@ -163,16 +270,62 @@ def run_Fealden(
             style_header={"backgroundColor": "rgb(30, 30, 30)", "color": "white"},
             style_data={"backgroundColor": "rgb(50, 50, 50)", "color": "white"},
         )
+        if stats.lookups:
+            cache_note = html.P(
+                f"Folding cache: {stats.hits} of {stats.lookups} structures reused "
+                f"({stats.hit_rate:.0%})",
+                className="small",
+            )
+            output = html.Div([cache_note, output])
 
     # Return functional recipe
-    if n_clicks == 0:  # Initial non-clicked state
-        return ("", False, "warning")
-    else:
-        return (
-            output,
-            True,
-            "success",
-        )
+    return (
+        output,
+        True,
+        "success",
+        run_id,
+    )
+
+
+def history_row(run: run_history.Run) -> Dict[str, Any]:
+    """One run as a row of the history table."""
+    ok = run["status"] == "ok"
+    return {
+        "started": time.strftime("%Y-%m-%d %H:%M", time.localtime(run["started"] or 0)),
+        "sequence": run["sequence"] or "unknown",
+        "max_length": run["max_length"],
+        "fixed": "yes" if run["fixed"] else "",
+        "seconds": run["seconds"],
+        "status": run["status"] if ok else f"{run['status']}: {run['error'] or ''}",
+        "results": run["results"],
+        "download": f"[CSV](/api/history/{run['id']}.csv)" if ok else "",
+    }
+
+
+# Page through past runs on the server, newest first
+@app.callback(
+    Output("history-table", "data"),
+    Output("history-table", "page_count"),
+    Output("history-table", "page_current"),
+    Input("history-query", "value"),
+    Input("history-match", "value"),
+    Input("history-table", "page_current"),
+    Input("history-version", "data"),
+)  # type: ignore[misc]
+@admission.admit("light", busy=lambda message: (no_update,) * 3)
+def show_history(
+    query: str, match: str, page: int, _version: str
+) -> Tuple[List[Dict[str, Any]], int, int]:
+    if ctx.triggered_id in ("history-query", "history-match"):
+        page = 0  # a new search starts at its first page
+    runs, total = run_history.HISTORY.search(
+        query or "", match, page or 0, run_history.PAGE_SIZE
+    )
+    pages = max(1, math.ceil(total / run_history.PAGE_SIZE))
+    return ([history_row(run) for run in runs], pages, page or 0)
+
+
+http_cache.enable(app)
 
 
 # Main magic
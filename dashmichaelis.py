@@ -4,16 +4,30 @@
 Dash web app for fitting Michaelis-Menten enzyme kinetics.
 """
 
-from typing import Any, Dict, List, Tuple, Union
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 
 # Imports
 import dash
 import dash_bootstrap_components as dbc
 import numpy as np
-import pandas
 import plotly.graph_objs as go
-from dash import Input, Output, State, dash_table, dcc, html
-from scipy.optimize import curve_fit
+from dash import Input, Output, Patch, State, ctx, dash_table, dcc, html, no_update
+from dash.exceptions import PreventUpdate
+
+import admission
+import batch_api
+import downsample
+import figure_export
+import http_cache
+import kinetics
+import metrics
+import models
+import robust
+import sampling_profiler
+import session_store
+import uploads
+from session_store import Session
 
 NDArray = np.ndarray[Any, np.dtype[np.float64]]
 
@@ -37,6 +51,11 @@ app: dash.Dash = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 
 server: Any = app.server  # server initialization for passenger wsgi
 
+SESSIONS = session_store.SessionStore("michaelis")
+metrics.register(server)
+admission.register(server)
+sampling_profiler.register(server)
+
 # Layout Widgets
 xaxis_label: html.Div = html.Div(
     children=[
@@ -54,7 +73,24 @@ yaxis_label: html.Div = html.Div(
     className="mr-3",
 )
 
-input_form: dbc.Col = dbc.Col([dbc.Form(children=[xaxis_label, yaxis_label])])
+loss_select: html.Div = html.Div(
+    children=[
+        dbc.Label("Outlier handling:", className="mr-2"),
+        dbc.Select(
+            id="fit-loss",
+            options=[
+                {"label": label, "value": name}
+                for name, label in robust.LOSS_LABELS.items()
+            ],
+            value="linear",
+        ),
+    ],
+    className="mr-3",
+)
+
+input_form: dbc.Col = dbc.Col(
+    [dbc.Form(children=[xaxis_label, yaxis_label, loss_select])]
+)
 
 row_button: dbc.Col = dbc.Col(
     children=[
@@ -92,6 +128,67 @@ table_input: dbc.Col = dbc.Col(
             n_clicks=0,
             className="mt-1",
         ),
+        dcc.Upload(
+            id="upload-data",
+            children=html.Div(
+                ["Drop or ", html.A("select"), " a CSV, TSV, XLSX or plate-reader file"]
+            ),
+            accept=".csv,.tsv,.tab,.txt,.xlsx,.xlsm",
+            max_size=uploads.MAX_UPLOAD_BYTES,
+            className="mt-2 p-2 text-center",
+            style={"border": "1px dashed", "border-radius": "5px"},
+        ),
+        html.Div(
+            children=[
+                dbc.Label("Kinetic run:", className="mr-2"),
+                dbc.RadioItems(
+                    id="kinetic-mode",
+                    options=[
+                        {"label": "Initial rates to the table", "value": "rates"},
+                        {"label": "Fit progress curves", "value": "progress"},
+                    ],
+                    value="rates",
+                    inline=True,
+                ),
+                dbc.Textarea(
+                    id="kinetic-concentrations",
+                    placeholder="Substrate concentration of each well, in column order",
+                    rows=1,
+                ),
+                dbc.InputGroup(
+                    children=[
+                        dbc.InputGroupText("Rate window (time points)"),
+                        dbc.Input(
+                            id="kinetic-window",
+                            type="number",
+                            min=2,
+                            step=1,
+                            value=kinetics.DEFAULT_WINDOW,
+                        ),
+                    ],
+                    className="mt-1",
+                ),
+                dcc.Upload(
+                    id="kinetic-upload",
+                    children=html.Div(
+                        ["Drop or ", html.A("select"), " a time × wells kinetic read"]
+                    ),
+                    accept=".csv,.tsv,.tab,.txt,.xlsx,.xlsm",
+                    max_size=uploads.MAX_UPLOAD_BYTES,
+                    className="mt-1 p-2 text-center",
+                    style={"border": "1px dashed", "border-radius": "5px"},
+                ),
+            ],
+            className="mt-2",
+        ),
+        dbc.Alert(
+            id="upload-status", is_open=False, dismissable=True, className="mt-2"
+        ),
+        # Browser-side bookkeeping; only the session id and diffs reach the server
+        dcc.Store(id="fit-data"),
+        dcc.Store(id="table-diff"),
+        dcc.Store(id="table-resync"),
+        dcc.Store(id="session-id"),
     ],
 )
 
@@ -116,6 +213,26 @@ graph_output: dbc.Col = dbc.Col(
             ],
             className="mt-3 border-primary p-1",
         ),
+        dbc.ButtonGroup(
+            children=[
+                dbc.Button("PNG", id="export-png", outline=True, color="primary"),
+                dbc.Button("SVG", id="export-svg", outline=True, color="primary"),
+                dbc.Button("PDF", id="export-pdf", outline=True, color="primary"),
+            ],
+            size="sm",
+            className="mt-2",
+        ),
+        dcc.Download(id="figure-download"),
+        dash_table.DataTable(
+            id="model-comparison",
+            columns=models.COMPARISON_COLUMNS,
+            style_table={"padding-top": "10px"},
+            style_cell={"font-family": "lato", "text-align": "left"},
+            style_header={"font-weight": "bold"},
+            style_data_conditional=[
+                {"if": {"filter_query": "{rank} = 1"}, "font-weight": "bold"}
+            ],
+        ),
     ]
 )
 
@@ -156,159 +273,228 @@ app.layout = dbc.Container(
 
 
 # Functions
-def clean_up_y_data(ys: pandas.DataFrame) -> Tuple[NDArray, List[float]]:
-    """Take user entered Y values and return average and std dev for plotting.
+def parse_cells(cells: List[Any]) -> NDArray:
+    """Convert table cell values to floats in one pass, blanks as NaN.
 
     Args:
-        ys (pandas.DataFrame): user-entered y-value columns
+        cells (List[Any]): cell values, numbers or numeric strings
 
     Returns:
-        Tuple[NDArray, List[float]]: average Y and std dev of Y values
+        NDArray: float64 values
     """
-    ys = ys.replace("", 0)
-    ys = ys.fillna(0)
-    ys = ys.astype(float).values
-    y = ys.mean(axis=1)
-    y_std = ys.std(axis=1)
-    y_std = [value if value > 0 else 0.00000001 for value in y_std]
-    # fitting fails with zero std values; this is a kludge
-
-    return (y, y_std)
-
-
-def equation(x: NDArray, vmax: float, km: float) -> NDArray:
-    """Michaelis-Menten equation for testing and plotting.
+    values = [None if value == "" else value for value in cells]
+    try:
+        parsed: NDArray = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):  # stray text; treat those cells as blank
+        parsed = np.empty(len(values), dtype=np.float64)
+        for i, value in enumerate(values):
+            try:
+                parsed[i] = float(value) if value is not None else np.nan
+            except (TypeError, ValueError):
+                parsed[i] = np.nan
+    return parsed
+
+
+def apply_table_diff(
+    session: Optional[Session], diff: Dict[str, Any]
+) -> Optional[Session]:
+    """Bring a session's stored table up to date with a diff from the browser.
 
     Args:
-        x (NDArray): x values
-        vmax (float): guess or value for Vmax
-        km (float): guess or value for Km
+        session (Optional[Session]): stored session state, if any
+        diff (Dict[str, Any]): either a "full" table (columns and list rows) or
+            the changed [row, column, value] "cells" since version "base"
 
     Returns:
-        NDArray: return predicted y values
+        Optional[Session]: new session state, or None if the diff does not
+            apply to what is stored and the full table is needed
     """
-    return (vmax * x) / (km + x)
-
+    if diff["full"]:
+        rows: List[List[Any]] = diff["rows"]
+        columns: List[str] = diff["columns"]
+        matrix = parse_cells([value for row in rows for value in row])
+        return {
+            "version": diff["version"],
+            "columns": columns,
+            "matrix": matrix.reshape(len(rows), len(columns)),
+        }
+    if session is None or session["version"] != diff["base"]:
+        return None
+
+    matrix = session["matrix"].copy()
+    if diff["cells"]:
+        row_index, column_index, values = zip(*diff["cells"])
+        matrix[list(row_index), list(column_index)] = parse_cells(list(values))
+    return {**session, "version": diff["version"], "matrix": matrix}
+
+
+def clean_up_y_data(ys: NDArray) -> Tuple[NDArray, NDArray]:
+    """Take user entered Y values and return average and std dev for plotting.
 
-def fit_data(x: NDArray, y: NDArray, y_std: List[float]) -> Tuple[NDArray, NDArray]:
-    """Perform curve fitting against the average data.
+    Blank cells are skipped rather than counted as zero; rows with no values
+    at all get a NaN average.
 
     Args:
-        x (List[float]): x values
-        y (NDArray): average y values
-        y_std (List[float]): y std dev values
+        ys (NDArray): user-entered y-value columns, NaN for blanks
 
     Returns:
-        Tuple[NDArray, NDArray]: fitting variables and associated errors
+        Tuple[NDArray, NDArray]: average Y and std dev of Y values
     """
-    variable_guesses = [np.max(y), np.min(y)]  # FIXME: better guesses!
-    variables, cov = curve_fit(equation, x, y, p0=variable_guesses, sigma=y_std)
-    var_errors: NDArray = np.sqrt(np.diag(cov))
+    filled = ~np.isnan(ys)
+    counts = filled.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        y: NDArray = np.where(filled, ys, 0.0).sum(axis=1) / counts
+        deviations = np.where(filled, ys - y[:, np.newaxis], 0.0)
+        y_std: NDArray = np.sqrt((deviations**2).sum(axis=1) / counts)
+    y_std[~(y_std > 0)] = 0.00000001
+    # fitting fails with zero std values; this is a kludge
 
-    return (variables, var_errors)
+    return (y, y_std)
 
 
-def find_r_squared(x: NDArray, y: NDArray, variables: NDArray) -> float:
-    """Find r squared value of fit
+def generate_plot1(x: NDArray, y: NDArray, y_std: NDArray) -> downsample.Trace:
+    """Generate plot of actual average data, downsampled for display.
 
     Args:
         x (NDArray): x values
         y (NDArray): average y values
-        variables (NDArray): fitting variables
+        y_std (NDArray): y std dev values
 
     Returns:
-        float: r squared value
+        downsample.Trace: scatter plot of data
     """
-    residuals: NDArray = y - equation(x, *variables)
-    ss_res: float = np.sum(residuals**2)
-    ss_tot: float = np.sum((y - np.mean(y)) ** 2)
-    r_squared: float = 1 - (ss_res / ss_tot)
-
-    return r_squared
+    keep = downsample.display_indices(x, y)
+    return downsample.scatter(
+        x=x[keep],
+        y=y[keep],
+        mode="markers",
+        error_y={"type": "data", "array": y_std[keep], "visible": True},
+    )
 
 
-def generate_plot1(x: NDArray, y: NDArray, y_std: List[float]) -> go.Scatter:
-    """Generate plot of actual average data.
+def generate_outlier_plot(
+    x: NDArray, y: NDArray, fit: models.ModelFit
+) -> downsample.Trace:
+    """Generate plot marking the points a robust fit downweighted.
 
     Args:
         x (NDArray): x values
         y (NDArray): average y values
-        y_std (List[float]): y std dev values
+        fit (models.ModelFit): robust model fit
 
     Returns:
-        go.Scatter: scatter plot of data
+        downsample.Trace: scatter plot of the downweighted points
     """
-    return go.Scatter(
-        x=x,
-        y=y,
+    flagged = fit.downweighted
+    return downsample.scatter(
+        x=x[flagged],
+        y=y[flagged],
         mode="markers",
-        error_y={"type": "data", "array": y_std, "visible": True},
+        marker={"symbol": "x-open", "size": 14, "color": "#d62728"},
+        hovertext="Downweighted",
     )
 
 
-def generate_plot2(x_range: NDArray, variables: NDArray) -> go.Scatter:
-    """Generate plot of predicted Michaelis-Menten curve values.
+def generate_plot2(x_range: NDArray, fit: models.ModelFit) -> downsample.Trace:
+    """Generate plot of the best model's predicted curve values.
 
     Args:
         x_range (NDArray): evenly spaced range of x values
-        variables (NDArray): fitting variables
+        fit (models.ModelFit): best model fit
 
     Returns:
-        go.Scatter: scatter plot of data
+        downsample.Trace: scatter plot of data
     """
-    return go.Scatter(x=x_range, y=equation(x_range, *variables), mode="lines")
+    return downsample.scatter(
+        x=x_range, y=fit.model.equation(x_range, *fit.variables), mode="lines"
+    )
+
+
+def generate_progress_plots(
+    times: NDArray, signals: NDArray, s0: NDArray, variables: NDArray
+) -> List[downsample.Trace]:
+    """Generate plots of progress-curve data and the fitted curves.
+
+    Each kind is one trace with curves separated by gaps, however many wells.
+    The points per curve shrink with the number of curves so each trace stays
+    near ``downsample.MAX_DISPLAY_POINTS``.
+
+    Args:
+        times (NDArray): time points
+        signals (NDArray): readings per time point and well
+        s0 (NDArray): initial substrate concentration per well
+        variables (NDArray): fitted Vmax, Km and signal scale
+
+    Returns:
+        List[downsample.Trace]: data markers and fitted lines
+    """
+    DEFAULT_INCREMENTS: int = 100
+    per_curve = max(2, downsample.MAX_DISPLAY_POINTS // len(s0))
+    t = times - times[0]
+    t_range: NDArray = np.linspace(0, np.max(t), min(DEFAULT_INCREMENTS, per_curve))
+    product, _, _ = kinetics.progress_curves(t_range, s0, variables[0], variables[1])
+    gap = np.full((1, len(s0)), np.nan)
+
+    def flat(columns: NDArray) -> NDArray:
+        return np.vstack([columns, gap]).T.ravel()
+
+    observed = signals - signals[:1]
+    keep = downsample.lttb_columns(t, observed, per_curve)
+    data_y = np.take_along_axis(observed, keep, axis=0)
+    fit_x = flat(np.repeat(t_range[:, np.newaxis], len(s0), axis=1))
+    return [
+        downsample.scatter(x=flat(t[keep]), y=flat(data_y), mode="markers"),
+        downsample.scatter(x=fit_x, y=flat(variables[2] * product), mode="lines"),
+    ]
 
 
 def generate_graph_layout(
     r_squared: float,
+    names: Sequence[str],
     variables: NDArray,
     var_errors: NDArray,
     x_title: str,
     y_title: str,
+    title: str = "Michaelis-Menten Fit",
+    notes: Sequence[str] = (),
 ) -> go.Layout:
     """Return formatted layout and annotations for final display.
 
     Args:
         r_squared (float): r squared value
+        names (Sequence[str]): names of the fitting variables
         variables (NDArray): fitting variables
         var_errors (NDArray): fitting variable errors
         x_title (str): x axis title
         y_title (str): y axis title
+        title (str): figure title
+        notes (Sequence[str]): further annotation lines
 
     Returns:
         go.Layout: plotly figure layout
     """
+    texts = (
+        [f"R squared = {round(r_squared, 3)}"]
+        + [
+            f"{name} = {value:0.3e} \u00b1 {error:0.3e}"
+            for name, value, error in zip(names, variables, var_errors)
+        ]
+        + list(notes)
+    )
     return go.Layout(
-        title={"text": "Michaelis-Menten Fit", "font": {"family": "lato"}},
+        title={"text": title, "font": {"family": "lato"}},
         # width=600,
         template="seaborn",
         annotations=[
             {
                 "x": 0.5,
-                "y": 0.5,
+                "y": 0.5 - 0.06 * i,
                 "xref": "paper",
                 "yref": "paper",
-                "text": f"R squared = {round(r_squared, 3)}",
+                "text": text,
                 "showarrow": False,
-            },
-            {
-                "x": 0.5,
-                "y": 0.44,
-                "xref": "paper",
-                "yref": "paper",
-                "text": f"Km = {variables[1]:0.3e} \u00B1 {var_errors[1]:0.3e}",
-                "showarrow": False,
-            },
-            {
-                "x": 0.5,
-                "y": 0.38,
-                "xref": "paper",
-                "yref": "paper",
-                "text": "Vmax = {:0.3e} \u00B1 {:0.3e}".format(
-                    variables[0], var_errors[0]
-                ),
-                "showarrow": False,
-            },
+            }
+            for i, text in enumerate(texts)
         ],
         xaxis={
             "title": x_title,
@@ -329,111 +515,622 @@ def generate_graph_layout(
     )
 
 
-@app.callback(
+def generate_figure(
+    x: NDArray,
+    y: NDArray,
+    y_std: NDArray,
+    best: models.ModelFit,
+    x_title: str,
+    y_title: str,
+) -> Tuple[List[downsample.Trace], go.Layout]:
+    """Build the data plot, best-fit curve and layout for a fit.
+
+    Args:
+        x (NDArray): x values
+        y (NDArray): average y values
+        y_std (NDArray): y std dev values
+        best (models.ModelFit): best model fit
+        x_title (str): x axis title
+        y_title (str): y axis title
+
+    Returns:
+        Tuple[List[downsample.Trace], go.Layout]: traces and layout
+    """
+    # Calculate useful range for plotting
+    DEFAULT_INCREMENTS: int = 100
+    x_range: NDArray = np.arange(
+        np.min(x), np.max(x), abs(np.max(x) / DEFAULT_INCREMENTS)
+    )
+
+    # Return plots and a graph data layout
+    plots = [generate_plot1(x, y, y_std), generate_plot2(x_range, best)]
+    notes = []
+    if best.loss != "linear":
+        flagged = int(best.downweighted.sum())
+        notes.append(f"{robust.LOSS_LABELS[best.loss]} loss: {flagged} downweighted")
+        if flagged:
+            plots.append(generate_outlier_plot(x, y, best))
+    layout: go.Layout = generate_graph_layout(
+        best.r_squared,
+        best.model.parameters,
+        best.variables,
+        best.errors,
+        x_title,
+        y_title,
+        f"{best.model.label} Fit",
+        notes,
+    )
+    return (plots, layout)
+
+
+def busy_figure(message: str) -> Patch:
+    """Show why a fit was turned away or failed as the graph's title; the plot stays."""
+    figure = Patch()
+    figure["layout"]["title"]["text"] = message
+    return figure
+
+
+# Table structure changes run in the browser; no server round trip needed
+app.clientside_callback(
+    """
+    function(n_clicks, rows, columns) {
+        if (!n_clicks) {
+            return window.dash_clientside.no_update;
+        }
+        const row = {};
+        columns.forEach(function(column) { row[column.id] = ""; });
+        return rows.concat([row]);
+    }
+    """,
     Output("adding-rows-table", "data"),
     [Input("editing-rows-button", "n_clicks")],
     [State("adding-rows-table", "data"), State("adding-rows-table", "columns")],
+)
+
+app.clientside_callback(
+    """
+    function(n_clicks, columns) {
+        if (!n_clicks) {
+            return window.dash_clientside.no_update;
+        }
+        const ids = columns.map(function(column) { return column.id; });
+        let next = columns.length;
+        while (ids.indexOf("Y" + next) !== -1) {
+            next += 1;
+        }
+        const counter = "Y" + next;
+        return columns.concat([
+            {id: counter, name: counter, editable: true, deletable: true}
+        ]);
+    }
+    """,
+    Output("adding-rows-table", "columns"),
+    [Input("adding-rows-button", "n_clicks")],
+    [State("adding-rows-table", "columns")],
+)
+
+# Only the filled-in part of the table reaches the fit, so adding an empty row
+# or column changes nothing and does not trigger a refit. The server keeps the
+# table per session, so single-cell edits are sent as [row, column, value]
+# diffs; the whole table is sent on structure changes or when asked to resync.
+app.clientside_callback(
+    """
+    function(rows, columns, resync, previous, lastDiff, sessionId) {
+        const noUpdate = window.dash_clientside.no_update;
+        const blank = function(value) {
+            return value === "" || value === null || value === undefined;
+        };
+        const ids = columns.map(function(column) { return column.id; });
+        const xId = ids[0];
+        const yIds = ids.slice(1).filter(function(id) {
+            return rows.some(function(row) { return !blank(row[id]); });
+        });
+        const kept = [xId].concat(yIds);
+        const data = {
+            columns: kept,
+            rows: rows.filter(function(row) {
+                return !blank(row[xId]) && yIds.some(function(id) {
+                    return !blank(row[id]);
+                });
+            }).map(function(row) {
+                return kept.map(function(id) { return row[id]; });
+            }),
+        };
+
+        const triggered = window.dash_clientside.callback_context.triggered.map(
+            function(t) { return t.prop_id; }
+        );
+        const resyncing = triggered.indexOf("table-resync.data") !== -1;
+        if (!resyncing && previous
+                && JSON.stringify(previous) === JSON.stringify(data)) {
+            return [noUpdate, noUpdate, noUpdate];
+        }
+
+        const version = lastDiff ? lastDiff.version + 1 : 1;
+        let diff;
+        if (resyncing || !lastDiff || !previous
+                || JSON.stringify(previous.columns) !== JSON.stringify(data.columns)
+                || previous.rows.length !== data.rows.length) {
+            diff = {full: true, version: version, columns: data.columns,
+                    rows: data.rows};
+        } else {
+            const cells = [];
+            data.rows.forEach(function(row, i) {
+                row.forEach(function(value, j) {
+                    if (value !== previous.rows[i][j]) {
+                        cells.push([i, j, value]);
+                    }
+                });
+            });
+            diff = {full: false, base: lastDiff.version, version: version,
+                    cells: cells};
+        }
+        const session = sessionId
+            || Date.now().toString(36) + Math.random().toString(36).slice(2);
+        return [data, diff, session];
+    }
+    """,
+    [
+        Output("fit-data", "data"),
+        Output("table-diff", "data"),
+        Output("session-id", "data"),
+    ],
+    [
+        Input("adding-rows-table", "data"),
+        Input("adding-rows-table", "columns"),
+        Input("table-resync", "data"),
+    ],
+    [
+        State("fit-data", "data"),
+        State("table-diff", "data"),
+        State("session-id", "data"),
+    ],
+)
+
+
+def replace_table(
+    matrix: NDArray,
+    names: List[str],
+    last_diff: Optional[Dict[str, Any]],
+    session_id: str,
+) -> Tuple[Any, Any, Any, Any]:
+    """Swap in server-parsed data as the session's table and the browser's.
+
+    The matrix goes straight into the session and the browser gets an empty
+    diff against it, so the data is not sent back just to be fitted.
+
+    Args:
+        matrix (NDArray): X column then replicate Y columns, NaN for blanks
+        names (List[str]): column names
+        last_diff (Optional[Dict[str, Any]]): last table diff sent
+        session_id (str): browser session id
+
+    Returns:
+        Tuple[Any, Any, Any, Any]: table data and columns, fit data and diff
+    """
+    ids = ["X"] + [f"Y{j}" for j in range(1, len(names))]
+    columns: List[Dict[str, Union[str, bool]]] = [
+        {"id": key, "name": name, "deletable": j > 1}
+        for j, (key, name) in enumerate(zip(ids, names))
+    ]
+    cells = [
+        ["" if value != value else value for value in row]  # NaN as blank
+        for row in matrix.tolist()
+    ]
+    rows = [dict(zip(ids, row)) for row in cells]
+
+    version = (last_diff["version"] if last_diff else 0) + 1
+    session = SESSIONS.get(session_id) or {}
+    SESSIONS.put(
+        session_id,
+        {**session, "version": version, "columns": ids, "matrix": matrix},
+    )
+
+    # fit-data matches what the diff callback computes from these rows, so it
+    # sees no change; the empty diff makes update_graph fit the stored matrix
+    fit_data = {"columns": ids, "rows": cells}
+    diff: Dict[str, Any] = {
+        "full": False,
+        "base": version,
+        "version": version,
+        "cells": [],
+    }
+    return (rows, columns, fit_data, diff)
+
+
+@app.callback(
+    [
+        Output("adding-rows-table", "data", allow_duplicate=True),
+        Output("adding-rows-table", "columns", allow_duplicate=True),
+        Output("fit-data", "data", allow_duplicate=True),
+        Output("table-diff", "data", allow_duplicate=True),
+        Output("upload-status", "children"),
+        Output("upload-status", "color"),
+        Output("upload-status", "is_open"),
+    ],
+    [Input("upload-data", "contents")],
+    [
+        State("upload-data", "filename"),
+        State("table-diff", "data"),
+        State("session-id", "data"),
+    ],
+    prevent_initial_call=True,
 )  # type: ignore[misc]
-def add_row(
-    n_clicks: int,
-    rows: List[Dict[str, float]],
-    columns: List[Dict[str, Union[str, bool]]],
-) -> List[Dict[str, float]]:
-    """Add additional data entry row.
+@metrics.instrument("michaelis")
+@admission.admit(
+    "fit", busy=lambda message: (no_update,) * 4 + (message, "warning", True)
+)
+def load_upload(
+    contents: Optional[str],
+    filename: Optional[str],
+    last_diff: Optional[Dict[str, Any]],
+    session_id: Optional[str],
+) -> Tuple[Any, ...]:
+    """Replace the table with an uploaded file's data, parsed on the server.
 
     Args:
-        n_clicks (int): number of times function has been clicked
-        rows (List[Dict[str, float]]): existing rows
-        columns (List[Dict[str, Union[str, bool]]]): existing columns
+        contents (Optional[str]): uploaded file as a data URL
+        filename (Optional[str]): uploaded file name
+        last_diff (Optional[Dict[str, Any]]): last table diff sent
+        session_id (Optional[str]): browser session id
 
     Returns:
-        List[Dict[str, float]]: rows with an additional row
+        Tuple[Any, ...]: table data and columns, fit data, table diff, and
+            the status message, color and visibility
     """
-    if n_clicks > 0:
-        rows.append({c["id"]: 0.0 for c in columns})  # type: ignore[misc]
-    return rows
+    if contents is None or session_id is None:
+        raise PreventUpdate
+
+    try:
+        upload = uploads.parse_upload(contents, filename)
+    except uploads.UploadError as err:
+        return (no_update,) * 4 + (str(err), "danger", True)
+
+    message = f"Loaded {len(upload.matrix)} points from {filename}"
+    table = replace_table(upload.matrix, upload.names, last_diff, session_id)
+    return table + (message, "success", True)
 
 
 @app.callback(
-    Output("adding-rows-table", "columns"),
-    [Input("adding-rows-button", "n_clicks")],
-    [State("adding-rows-table", "columns")],
+    [
+        Output("adding-rows-table", "data", allow_duplicate=True),
+        Output("adding-rows-table", "columns", allow_duplicate=True),
+        Output("fit-data", "data", allow_duplicate=True),
+        Output("table-diff", "data", allow_duplicate=True),
+        Output("upload-status", "children", allow_duplicate=True),
+        Output("upload-status", "color", allow_duplicate=True),
+        Output("upload-status", "is_open", allow_duplicate=True),
+        Output("adding-rows-graph", "figure", allow_duplicate=True),
+    ],
+    [Input("kinetic-upload", "contents")],
+    [
+        State("kinetic-upload", "filename"),
+        State("kinetic-concentrations", "value"),
+        State("kinetic-window", "value"),
+        State("kinetic-mode", "value"),
+        State("y-axis", "value"),
+        State("table-diff", "data"),
+        State("session-id", "data"),
+    ],
+    prevent_initial_call=True,
 )  # type: ignore[misc]
-def update_columns(
-    n_clicks: int, existing_columns: List[Dict[str, Union[str, bool]]]
-) -> List[Dict[str, Union[str, bool]]]:
-    """Add additional data entry column.
+@metrics.instrument("michaelis")
+@sampling_profiler.sampled("michaelis")
+@admission.admit(
+    "fit", busy=lambda message: (no_update,) * 4 + (message, "warning", True, no_update)
+)
+def load_kinetic_upload(
+    contents: Optional[str],
+    filename: Optional[str],
+    concentrations: Optional[str],
+    window: Optional[int],
+    mode: str,
+    y_title: str,
+    last_diff: Optional[Dict[str, Any]],
+    session_id: Optional[str],
+) -> Tuple[Any, ...]:
+    """Use a kinetic run: initial rates into the table, or a progress-curve fit.
 
     Args:
-        n_clicks (int): number of times function has been clicked
-        existing_columns (List[Dict[str, Union[str, bool]]]): existing columns
+        contents (Optional[str]): uploaded time course as a data URL
+        filename (Optional[str]): uploaded file name
+        concentrations (Optional[str]): substrate concentration of each well
+        window (Optional[int]): time points per rate regression window
+        mode (str): "rates" or "progress"
+        y_title (str): y axis title
+        last_diff (Optional[Dict[str, Any]]): last table diff sent
+        session_id (Optional[str]): browser session id
 
     Returns:
-        List[Dict[str, Union[str, bool]]]: existing columns with new column appended
+        Tuple[Any, ...]: table data and columns, fit data, table diff, the
+            status message, color and visibility, and the progress-curve figure
     """
-    if n_clicks > 0:
-        count: int = 2 + n_clicks
-        counter: str = f"Y{count}"
-        existing_columns.append(
-            {"id": counter, "name": counter, "editable": True, "deletable": True}
+    if contents is None or session_id is None:
+        raise PreventUpdate
+
+    try:
+        if mode == "progress":
+            times, signals, s0 = kinetics.read_kinetic_upload(
+                contents, filename, concentrations
+            )
+        else:
+            matrix, names = kinetics.parse_kinetic_upload(
+                contents, filename, concentrations, window
+            )
+    except uploads.UploadError as err:
+        return (no_update,) * 4 + (str(err), "danger", True, no_update)
+
+    if mode == "progress":
+        variables, var_errors, r_squared = kinetics.fit_progress_curves(
+            times, signals, s0
         )
-    return existing_columns
+        layout = generate_graph_layout(
+            r_squared,
+            ("Vmax", "Km"),
+            variables,
+            var_errors,
+            "Time",
+            y_title,
+            "Progress Curve Fit",
+        )
+        figure = {"data": generate_progress_plots(times, signals, s0, variables)}
+        figure["layout"] = layout
+        message = f"Fitted {len(s0)} progress curves from {filename}"
+        return (no_update,) * 4 + (message, "success", True, figure)
+
+    wells = int(np.sum(~np.isnan(matrix[:, 1:])))
+    message = f"Extracted initial rates for {wells} wells from {filename}"
+    table = replace_table(matrix, names, last_diff, session_id)
+    return table + (message, "success", True, no_update)
 
 
 @app.callback(
-    Output("adding-rows-graph", "figure"),
     [
-        Input("adding-rows-table", "data"),
-        Input("adding-rows-table", "columns"),
+        Output("adding-rows-graph", "figure"),
+        Output("table-resync", "data"),
+        Output("model-comparison", "data"),
+    ],
+    [
+        Input("table-diff", "data"),
         Input("x-axis", "value"),
         Input("y-axis", "value"),
+        Input("fit-loss", "value"),
     ],
+    [State("session-id", "data")],
 )  # type: ignore[misc]
+@metrics.instrument("michaelis")
+@sampling_profiler.sampled("michaelis")
+@admission.admit(
+    "fit", busy=lambda message: (busy_figure(message), no_update, no_update)
+)
 def update_graph(
-    rows: List[Dict[str, float]],
-    columns: List[Dict[str, Union[str, bool]]],
+    table_diff: Optional[Dict[str, Any]],
     x_title: str,
     y_title: str,
-) -> Dict[str, Any]:
-    """Take user data and perform nonlinear regression to Michaelis-Menten model.
+    loss: Optional[str],
+    session_id: Optional[str],
+) -> Tuple[Any, Any, Any]:
+    """Fit the candidate Michaelis-Menten models and plot the best one.
 
     Args:
-        rows (List[Dict[str, float]]): data entry rows
-        columns (List[Dict[str, Union[str, bool]]]): data entry columns
+        table_diff (Optional[Dict[str, Any]]): change to the filled-in table
         x_title (str): x axis title
         y_title (str): y axis title
+        loss (Optional[str]): "linear" for least squares, or a robust loss
+        session_id (Optional[str]): browser session id
 
     Returns:
-        Dict(str, Any): plot data and layout to update displayed graph
+        Tuple[Any, Any, Any]: full figure or figure patch, a resync request,
+            and the model comparison rows
     """
+    if table_diff is None or session_id is None:  # not yet filled in
+        raise PreventUpdate
+
+    triggered = ctx.triggered_prop_ids
+    refit = not triggered or "table-diff.data" in triggered
+    if not refit and "fit-loss.value" not in triggered:  # only labels changed
+        titles = Patch()
+        titles["layout"]["xaxis"]["title"]["text"] = x_title
+        titles["layout"]["yaxis"]["title"]["text"] = y_title
+        return (titles, no_update, no_update)
+
+    stored = SESSIONS.get(session_id)
+    # A new loss refits the stored table as it is
+    session = apply_table_diff(stored, table_diff) if refit else stored
+    if session is None:  # evicted or out of step; ask for the whole table
+        return (no_update, time.time(), no_update)
+
+    matrix: NDArray = session["matrix"]
+
+    x: NDArray = matrix[:, 0]
+    y, y_std = clean_up_y_data(matrix[:, 1:])  # all but X column
+
+    usable = ~(np.isnan(x) | np.isnan(y))  # skip rows that are still blank
+    x, y, y_std = x[usable], y[usable], y_std[usable]
+
+    previous = stored.get("fits") if stored is not None else None
+    try:
+        fits = models.fit_models(
+            list(models.MICHAELIS_MODELS.values()),
+            x,
+            y,
+            y_std,
+            previous,
+            "michaelis",
+            loss or "linear",
+        )
+    except RuntimeError as err:  # too few rows yet, or no model converged
+        SESSIONS.put(session_id, session)  # keep the stored table in step
+        return (busy_figure(str(err)), no_update, no_update)
+    best = fits[0]
+
+    plot_data, layout = generate_figure(x, y, y_std, best, x_title, y_title)
+
+    session["fits"] = {fit.model.name: fit.variables for fit in fits}
+    session["figure_data"] = [plot.to_plotly_json() for plot in plot_data]
+    SESSIONS.put(session_id, session)
+
+    if table_diff["full"]:
+        return (
+            {"data": plot_data, "layout": layout},
+            no_update,
+            models.comparison_rows(fits),
+        )
 
-    df = pandas.DataFrame(rows, columns=[c["name"] for c in columns])
+    # The browser already has the layout; send only what the fit changed
+    figure = Patch()
+    figure["data"] = plot_data
+    figure["layout"]["annotations"] = layout.annotations
+    figure["layout"]["title"]["text"] = layout.title.text
+    return (figure, no_update, models.comparison_rows(fits))
 
-    x: NDArray = df["X"].astype(float).values
 
-    ys: pandas.DataFrame = df.iloc[:, 1:]  # all but X column
+@app.callback(
+    [
+        Output("figure-download", "data"),
+        Output("upload-status", "children", allow_duplicate=True),
+        Output("upload-status", "color", allow_duplicate=True),
+        Output("upload-status", "is_open", allow_duplicate=True),
+    ],
+    [
+        Input("export-png", "n_clicks"),
+        Input("export-svg", "n_clicks"),
+        Input("export-pdf", "n_clicks"),
+    ],
+    [State("adding-rows-graph", "figure")],
+    prevent_initial_call=True,
+)  # type: ignore[misc]
+@metrics.instrument("michaelis")
+@admission.admit("fit", busy=lambda message: (no_update, message, "warning", True))
+def export_figure(
+    png: Optional[int],
+    svg: Optional[int],
+    pdf: Optional[int],
+    figure: Optional[Dict[str, Any]],
+) -> Tuple[Any, ...]:
+    """Render the figure as shown for download, as PNG, SVG or PDF.
+
+    Args:
+        png (Optional[int]): PNG button clicks
+        svg (Optional[int]): SVG button clicks
+        pdf (Optional[int]): PDF button clicks
+        figure (Optional[Dict[str, Any]]): current figure
+
+    Returns:
+        Tuple[Any, ...]: the download, and the status message, color and
+            visibility if rendering failed
+    """
+    if not figure or not figure.get("data"):
+        raise PreventUpdate
+    image_format = str(ctx.triggered_id).rsplit("-", 1)[-1]
+    try:
+        image = figure_export.render(figure, image_format, app_name="michaelis")
+    except figure_export.ExportError as err:
+        return (no_update, str(err), "danger", True)
+    download = figure_export.download(image, f"michaelis-fit.{image_format}")
+    return (download, no_update, no_update, no_update)
+
+
+def usable_points(x: NDArray, ys: NDArray) -> Tuple[NDArray, NDArray, NDArray]:
+    """Average replicate rates, keeping the points that can be fitted.
+
+    Args:
+        x (NDArray): substrate concentrations, NaN for blanks
+        ys (NDArray): replicate rates, one column per replicate
+
+    Raises:
+        ValueError: if fewer than 3 points are usable
+
+    Returns:
+        Tuple[NDArray, NDArray, NDArray]: the usable x, average y and y std dev
+    """
     y, y_std = clean_up_y_data(ys)
+    usable = ~(np.isnan(x) | np.isnan(y))
+    if usable.sum() < 3:
+        raise ValueError("At least 3 points with X and Y values are needed")
+    return (x[usable], y[usable], y_std[usable])
 
-    variables, var_errors = fit_data(x, y, y_std)
 
-    r_squared: float = find_r_squared(x, y, variables)
+def fit_replicates(
+    x: NDArray, ys: NDArray, candidates: List[models.Model], loss: str = "linear"
+) -> Tuple[NDArray, NDArray, NDArray, List[models.ModelFit]]:
+    """Average replicate rates and fit the candidate models, for headless use.
 
-    # Calculate useful range for plotting
-    DEFAULT_INCREMENTS: int = 100
-    x_range: NDArray = np.arange(
-        np.min(x), np.max(x), abs(np.max(x) / DEFAULT_INCREMENTS)
-    )
+    Args:
+        x (NDArray): substrate concentrations, NaN for blanks
+        ys (NDArray): replicate rates, one column per replicate
+        candidates (List[models.Model]): models to try
+        loss (str): "linear" for least squares, or a robust loss
 
-    # Return plots and a graph data layout
-    plot1: go.Scatter = generate_plot1(x, y, y_std)
-    plot2: go.Scatter = generate_plot2(x_range, variables)
-    plot_data: List[go.Scatter] = [plot1, plot2]
+    Raises:
+        ValueError: if fewer than 3 points are usable, or the loss is unknown
+        RuntimeError: if no model could be fitted
 
-    layout: go.Layout = generate_graph_layout(
-        r_squared, variables, var_errors, x_title, y_title
+    Returns:
+        Tuple[NDArray, NDArray, NDArray, List[models.ModelFit]]: the usable
+            x, average y and y std dev, and the fits, best first
+    """
+    x, y, y_std = usable_points(x, ys)
+    fits = models.fit_models(candidates, x, y, y_std, app_name="michaelis", loss=loss)
+    return (x, y, y_std, fits)
+
+
+def fit_dataset(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit the candidate models to one batch API dataset.
+
+    Args:
+        dataset (Dict[str, Any]): ``x`` substrate concentrations, ``y`` rates
+            or lists of replicate rates, and optionally ``models``, the names
+            of the models to try, and ``loss``, a robust loss
+
+    Raises:
+        ValueError: if the dataset cannot be fitted
+
+    Returns:
+        Dict[str, Any]: best model name, points used and the ranked fits
+    """
+    x, ys = batch_api.xy_arrays(dataset)
+    candidates = models.select(models.MICHAELIS_MODELS, dataset.get("models"))
+    loss = str(dataset.get("loss") or "linear")
+    x, _, _, fits = fit_replicates(x, ys, candidates, loss)
+    return {
+        "best": fits[0].model.name,
+        "points": len(x),
+        "models": models.fit_summary(fits),
+    }
+
+
+def dataset_figure(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit one batch API dataset and plot its best model, for reports.
+
+    Args:
+        dataset (Dict[str, Any]): as for ``fit_dataset``, and optionally
+            ``x_title`` and ``y_title``, the axis titles
+
+    Raises:
+        ValueError: if the dataset cannot be fitted
+
+    Returns:
+        Dict[str, Any]: plotly figure
+    """
+    x, ys = batch_api.xy_arrays(dataset)
+    candidates = models.select(models.MICHAELIS_MODELS, dataset.get("models"))
+    loss = str(dataset.get("loss") or "linear")
+    x, y, y_std, fits = fit_replicates(x, ys, candidates, loss)
+    data, layout = generate_figure(
+        x,
+        y,
+        y_std,
+        fits[0],
+        str(dataset.get("x_title") or "Concentration"),
+        str(dataset.get("y_title") or "Enzyme Activity"),
     )
+    return {"data": data, "layout": layout}
+
 
-    return {"data": plot_data, "layout": layout}
+batch_api.register(server, "michaelis", fit_dataset)
+figure_export.register(server, "michaelis", dataset_figure)
+http_cache.enable(app)
 
 
 # Main magic
@@ -1,12 +1,19 @@
-from typing import Tuple
+from typing import Any, Dict, Tuple
 
 import dash_bootstrap_components as dbc
 from dash import Dash, Input, Output, State, html
 
+import admission
+import batch_api
+import http_cache
+import metrics
+
 # Set up dash server
 app = Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 app.title = "Buffer Adjustment Calculator"
 server = app.server  # Export server for use by Passenger framework
+metrics.register(server)
+admission.register(server)
 
 # Components for Layout
 init_buffer_input = dbc.Row(
@@ -189,64 +196,64 @@ app.layout = dbc.Container(
 )
 
 
-# Display recipe on submit, hide initially
-@app.callback(
-    Output(component_id="output-div", component_property="children"),
-    Output(component_id="recipe", component_property="is_open"),
-    Output(component_id="recipe", component_property="color"),
-    [Input("submit-button", "n_clicks")],
-    [
-        State("buff_init_conc", "value"),
-        State("buff_final_conc", "value"),
-        State("buff_pka", "value"),
-        State("final_volume", "value"),
-        State("hcl_conc", "value"),
-        State("naoh_conc", "value"),
-        State("init_ph", "value"),
-        State("final_ph", "value"),
-    ],
-)  # type: ignore[misc]
-def Buffer_Solver(
-    n_clicks: int,
-    _buffer_conc_initial: str,
-    _buffer_conc_final: str,
-    _buffer_pKa: str,
-    _total_volume: str,
-    _HCl_stock_conc: str,
-    _NaOH_stock_conc: str,
-    _initial_pH: str,
-    _final_pH: str,
-) -> Tuple[str, bool, str]:
-    # Sanitize input and catch unusable input
-    try:
-        buffer_conc_initial = float(_buffer_conc_initial)
-        buffer_conc_final = float(_buffer_conc_final)
-        buffer_pKa = float(_buffer_pKa)
-        total_volume = float(_total_volume)
-        HCl_stock_conc = float(_HCl_stock_conc)
-        NaOH_stock_conc = float(_NaOH_stock_conc)
-        initial_pH = float(_initial_pH)
-        final_pH = float(_final_pH)
-    except ValueError:
-        return "Invalid input values, try again", True, "warning"
+BUFFER_FIELDS: Tuple[str, ...] = (
+    "buffer_conc_initial",
+    "buffer_conc_final",
+    "buffer_pKa",
+    "total_volume",
+    "HCl_stock_conc",
+    "NaOH_stock_conc",
+    "initial_pH",
+    "final_pH",
+)
+
+
+def buffer_recipe(
+    buffer_conc_initial: float,
+    buffer_conc_final: float,
+    buffer_pKa: float,
+    total_volume: float,
+    HCl_stock_conc: float,
+    NaOH_stock_conc: float,
+    initial_pH: float,
+    final_pH: float,
+) -> Dict[str, Any]:
+    """Work out the stock buffer, titrant and water volumes for a buffer.
 
+    Args:
+        buffer_conc_initial (float): stock buffer concentration (M)
+        buffer_conc_final (float): final buffer concentration (M)
+        buffer_pKa (float): buffer pKa
+        total_volume (float): final solution volume (L)
+        HCl_stock_conc (float): stock strong acid concentration (M)
+        NaOH_stock_conc (float): stock strong base concentration (M)
+        initial_pH (float): pH of the stock buffer
+        final_pH (float): target pH
+
+    Raises:
+        ValueError: with a user-facing message for nonsense conditions
+
+    Returns:
+        Dict[str, Any]: buffer_volume, titrant ("HCl" or "NaOH"),
+            titrant_volume and water_volume, volumes in liters
+    """
     # Remove common nonsense conditions
     if not (0.0 < buffer_conc_initial <= 100.0):
-        return "Invalid initial buffer concentration", True, "warning"
+        raise ValueError("Invalid initial buffer concentration")
     if not (0.0 < buffer_conc_final <= 100.0):
-        return "Invalid final buffer concentration", True, "warning"
+        raise ValueError("Invalid final buffer concentration")
     if not (0.0 < HCl_stock_conc <= 100.0):
-        return "Invalid HCl concentration", True, "warning"
+        raise ValueError("Invalid HCl concentration")
     if not (0.0 < NaOH_stock_conc <= 100.0):
-        return "Invalid NaOH concentration", True, "warning"
+        raise ValueError("Invalid NaOH concentration")
     if buffer_conc_final > buffer_conc_initial:
-        return "Can't increase concentration through dilution", True, "warning"
+        raise ValueError("Can't increase concentration through dilution")
     if not (0.0 < buffer_pKa <= 100.0):
-        return "Invalid pKa value", True, "warning"
+        raise ValueError("Invalid pKa value")
     if not (0.0 < initial_pH <= 20.0):
-        return "Invalid initial pH", True, "warning"
+        raise ValueError("Invalid initial pH")
     if not (0.0 < final_pH <= 20.0):
-        return "Invalid final pH", True, "warning"
+        raise ValueError("Invalid final pH")
 
     # First find moles of buffer and volume of buffer:
     buffer_volume = (buffer_conc_final * total_volume) / buffer_conc_initial
@@ -275,23 +282,86 @@ def Buffer_Solver(
     # Solve for volume of water
     volume_water = total_volume - (volume_titrant + buffer_volume)
 
+    return {
+        "buffer_volume": buffer_volume,
+        "titrant": titrant,
+        "titrant_volume": volume_titrant,
+        "water_volume": volume_water,
+    }
+
+
+# Display recipe on submit; the alert starts closed in the layout
+@app.callback(
+    Output(component_id="output-div", component_property="children"),
+    Output(component_id="recipe", component_property="is_open"),
+    Output(component_id="recipe", component_property="color"),
+    [Input("submit-button", "n_clicks")],
+    [
+        State("buff_init_conc", "value"),
+        State("buff_final_conc", "value"),
+        State("buff_pka", "value"),
+        State("final_volume", "value"),
+        State("hcl_conc", "value"),
+        State("naoh_conc", "value"),
+        State("init_ph", "value"),
+        State("final_ph", "value"),
+    ],
+    prevent_initial_call=True,  # page loads must not spend admissions
+)  # type: ignore[misc]
+@metrics.instrument("buffer")
+@admission.admit("light", busy=lambda message: (message, True, "warning"))
+def Buffer_Solver(n_clicks: int, *values: str) -> Tuple[str, bool, str]:
+    # Sanitize input and catch unusable input
+    try:
+        conditions = [float(value) for value in values]
+    except ValueError:
+        return "Invalid input values, try again", True, "warning"
+
+    try:
+        recipe = buffer_recipe(*conditions)
+    except ValueError as err:
+        return str(err), True, "warning"
+
     # Return functional recipe
-    if n_clicks == 0:  # Initial non-clicked state
-        return ("", False, "warning")
-    else:
-        return (
-            (
-                "Buffer recipe: add {} liters stock buffer, "
-                "{} liters of stock {}, and {} liters of water."
-            ).format(
-                round(buffer_volume, 4),
-                round(volume_titrant, 4),
-                titrant,
-                round(volume_water, 4),
-            ),
-            True,
-            "success",
-        )
+    return (
+        (
+            "Buffer recipe: add {} liters stock buffer, "
+            "{} liters of stock {}, and {} liters of water."
+        ).format(
+            round(recipe["buffer_volume"], 4),
+            round(recipe["titrant_volume"], 4),
+            recipe["titrant"],
+            round(recipe["water_volume"], 4),
+        ),
+        True,
+        "success",
+    )
+
+
+def solve_dataset(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """Work out the recipe for one batch API dataset.
+
+    Args:
+        dataset (Dict[str, Any]): a number for each of ``BUFFER_FIELDS``
+
+    Raises:
+        ValueError: for missing, non-numeric or nonsense conditions
+
+    Returns:
+        Dict[str, Any]: the recipe, as from ``buffer_recipe``
+    """
+    missing = [name for name in BUFFER_FIELDS if name not in dataset]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    try:
+        conditions = [float(dataset[name]) for name in BUFFER_FIELDS]
+    except (TypeError, ValueError):
+        raise ValueError("Invalid input values, try again")
+    return buffer_recipe(*conditions)
+
+
+batch_api.register(server, "buffer", solve_dataset)
+http_cache.enable(app)
 
 
 # Main magic
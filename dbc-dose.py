@@ -4,15 +4,28 @@
 Dash web app for fitting dose-response data.
 """
 
-from typing import Any, Dict, List
+import warnings
+from typing import Any, Dict, List, Optional, Tuple
 
 # Imports
 import dash
 import dash_bootstrap_components as dbc
 import numpy as np
 import plotly.graph_objs as go
-from dash import Input, Output, State, dcc, html
-from scipy.optimize import leastsq
+from dash import Input, Output, State, ctx, dash_table, dcc, html, no_update
+from dash.exceptions import PreventUpdate
+
+import admission
+import batch_api
+import downsample
+import figure_export
+import http_cache
+import metrics
+import models
+import robust
+import sampling_profiler
+import session_store
+import uploads
 
 NDArray = np.ndarray[Any, np.dtype[np.float64]]
 
@@ -20,11 +33,16 @@ NDArray = np.ndarray[Any, np.dtype[np.float64]]
 app = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 
 server = app.server  # server initialization for passenger wsgi
+metrics.register(server)
+admission.register(server)
+sampling_profiler.register(server)
+
+SESSIONS = session_store.SessionStore("dose")  # last fit, for warm starts
 
 xaxis_label = html.Div(
     children=[
         dbc.Label("X values:", className="mr-2"),
-        dbc.Input(type="input-1-state", id="input-1-state", value="0,1,2,3,4"),
+        dbc.Textarea(id="input-1-state", value="0,1,2,3,4", rows=1),
     ],
     className="mr-3",
 )
@@ -32,7 +50,7 @@ xaxis_label = html.Div(
 yaxis_label = html.Div(
     children=[
         dbc.Label("Y values:", className="mr-2"),
-        dbc.Input(type="input-2-state", id="input-2-state", value="1,2,5,8,9"),
+        dbc.Textarea(id="input-2-state", value="1,2,5,8,9", rows=1),
     ],
     className="mr-3",
 )
@@ -43,6 +61,20 @@ input_form = dbc.Col(
             children=[
                 xaxis_label,
                 yaxis_label,
+                html.Div(
+                    children=[
+                        dbc.Label("Outlier handling:", className="mr-2"),
+                        dbc.Select(
+                            id="fit-loss",
+                            options=[
+                                {"label": label, "value": name}
+                                for name, label in robust.LOSS_LABELS.items()
+                            ],
+                            value="linear",
+                        ),
+                    ],
+                    className="mr-3 mb-2",
+                ),
                 dbc.Button(
                     "Submit",
                     id="submit-button",
@@ -50,6 +82,21 @@ input_form = dbc.Col(
                     color="primary",
                     className="mr-1",
                 ),
+                dcc.Upload(
+                    id="upload-data",
+                    children=html.Div(["Or drop or ", html.A("select"), " a file"]),
+                    accept=".csv,.tsv,.tab,.txt,.xlsx,.xlsm",
+                    max_size=uploads.MAX_UPLOAD_BYTES,
+                    className="mt-2 p-2 text-center",
+                    style={"border": "1px dashed", "border-radius": "5px"},
+                ),
+                dbc.Alert(
+                    id="upload-status",
+                    is_open=False,
+                    dismissable=True,
+                    className="mt-2",
+                ),
+                dcc.Store(id="session-id", storage_type="session"),
             ],
         ),
     ],
@@ -79,6 +126,26 @@ graph_output = dbc.Col(
             ],
             className="mt-3 border-primary p-1",
         ),
+        dbc.ButtonGroup(
+            children=[
+                dbc.Button("PNG", id="export-png", outline=True, color="primary"),
+                dbc.Button("SVG", id="export-svg", outline=True, color="primary"),
+                dbc.Button("PDF", id="export-pdf", outline=True, color="primary"),
+            ],
+            size="sm",
+            className="mt-2",
+        ),
+        dcc.Download(id="figure-download"),
+        dash_table.DataTable(
+            id="model-comparison",
+            columns=models.COMPARISON_COLUMNS,
+            style_table={"padding-top": "10px"},
+            style_cell={"font-family": "lato", "text-align": "left"},
+            style_header={"font-weight": "bold"},
+            style_data_conditional=[
+                {"if": {"filter_query": "{rank} = 1"}, "font-weight": "bold"}
+            ],
+        ),
     ]
 )
 
@@ -162,50 +229,46 @@ old_layout = html.Div(
 )
 
 
-# Functions
-def residuals(y: NDArray, fitinfo: Dict[str, Any]) -> float:
-    fit_error = 0
-    fit_variance = 0
-
-    for i in range(len(fitinfo["fvec"])):
-        fit_error += (fitinfo["fvec"][i]) ** 2
-        fit_variance += (y[i] - np.mean(y)) ** 2
-    r_squared = 1 - (fit_error / fit_variance)
-    return r_squared
-
+def dose_figure(x: NDArray, y: NDArray, fits: List[models.ModelFit]) -> Dict[str, Any]:
+    """Plot the data and the best model's curve, annotated with its fit.
 
-@app.callback(
-    Output("indicator-graphic", "figure"),
-    [Input("submit-button", "n_clicks")],
-    [State("input-1-state", "value"), State("input-2-state", "value")],
-)  # type: ignore[misc]
-def update_graph2(click: int, xs: str, ys: str) -> Dict[str, Any]:
-    if click == -1:
-        x = np.zeros(5)
-        y = np.zeros(5)
-    else:
-        x = np.array(xs.split(","), dtype=float)
-        y = np.array(ys.split(","), dtype=float)
+    Args:
+        x (NDArray): log concentrations
+        y (NDArray): responses
+        fits (List[models.ModelFit]): fits, best first
 
-    def equation(variables: List[float], x: NDArray) -> NDArray:
-        return variables[0] + (
-            (variables[1] - variables[0]) / (1 + 10 ** (variables[2] - x))
-        )
-
-    def error(variables: List[float], x: NDArray, y: NDArray) -> NDArray:
-        return equation(variables, x) - y
-
-    variable_guesses = [np.min(y), np.max(y), np.mean(x)]
-    output = leastsq(error, variable_guesses, args=(x, y), full_output=1)
-    variables = output[0]
-    fitinfo = output[2]
-    r_squared = residuals(y, fitinfo)
+    Returns:
+        Dict[str, Any]: plotly figure
+    """
+    best = fits[0]
+    variables = best.variables
     x_range = np.arange(np.min(x), np.max(x), abs(np.max(x) / 100))
-    plot1 = go.Scatter(x=x, y=y, mode="markers", showlegend=False)
+    keep = downsample.display_indices(x, y)  # fits use every point
+    plot1 = downsample.scatter(x=x[keep], y=y[keep], mode="markers", showlegend=False)
     plot2 = go.Scatter(
-        x=x_range, y=equation(variables, x_range), mode="lines", showlegend=False
+        x=x_range,
+        y=best.model.equation(x_range, *variables),
+        mode="lines",
+        showlegend=False,
     )
     plot_data = [plot1, plot2]
+    notes = []
+    if best.loss != "linear":
+        flagged = best.downweighted
+        notes.append(
+            f"{robust.LOSS_LABELS[best.loss]} loss: {int(flagged.sum())} downweighted"
+        )
+        if flagged.any():
+            plot_data.append(
+                downsample.scatter(
+                    x=x[flagged],
+                    y=y[flagged],
+                    mode="markers",
+                    marker={"symbol": "x-open", "size": 14, "color": "#d62728"},
+                    hovertext="Downweighted",
+                    showlegend=False,
+                )
+            )
     layout = go.Layout(
         title="Dose Response",
         # width=600,
@@ -216,7 +279,7 @@ def update_graph2(click: int, xs: str, ys: str) -> Dict[str, Any]:
                 "y": 0.9,
                 "xref": "paper",
                 "yref": "paper",
-                "text": f"R squared = {round(r_squared, 3)}",
+                "text": f"R squared = {round(best.r_squared, 3)}",
                 "showarrow": False,
             },
             {
@@ -227,6 +290,25 @@ def update_graph2(click: int, xs: str, ys: str) -> Dict[str, Any]:
                 "text": f"Kd = {round(variables[2], 3)}",
                 "showarrow": False,
             },
+            {
+                "x": 0.5,
+                "y": 0.8,
+                "xref": "paper",
+                "yref": "paper",
+                "text": f"Best model: {best.model.label}",
+                "showarrow": False,
+            },
+        ]
+        + [
+            {
+                "x": 0.5,
+                "y": 0.75 - 0.05 * i,
+                "xref": "paper",
+                "yref": "paper",
+                "text": note,
+                "showarrow": False,
+            }
+            for i, note in enumerate(notes)
         ],
         xaxis={"title": "Concentration"},
         yaxis={"title": "Response"},
@@ -234,6 +316,230 @@ def update_graph2(click: int, xs: str, ys: str) -> Dict[str, Any]:
     return {"data": plot_data, "layout": layout}
 
 
+def usable_points(x: NDArray, ys: NDArray) -> Tuple[NDArray, NDArray]:
+    """Average replicate responses, keeping the points that can be fitted.
+
+    Args:
+        x (NDArray): log concentrations, NaN for blanks
+        ys (NDArray): replicate responses, one column per replicate
+
+    Raises:
+        ValueError: if fewer than 3 points are usable
+
+    Returns:
+        Tuple[NDArray, NDArray]: the usable x and average y
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # blank rows
+        y = np.nanmean(ys, axis=1)
+    usable = ~(np.isnan(x) | np.isnan(y))
+    if usable.sum() < 3:
+        raise ValueError("At least 3 points with X and Y values are needed")
+    return (x[usable], y[usable])
+
+
+def fit_replicates(
+    x: NDArray, ys: NDArray, candidates: List[models.Model], loss: str = "linear"
+) -> Tuple[NDArray, NDArray, List[models.ModelFit]]:
+    """Average replicate responses and fit the candidate models, headless.
+
+    Args:
+        x (NDArray): log concentrations, NaN for blanks
+        ys (NDArray): replicate responses, one column per replicate
+        candidates (List[models.Model]): models to try
+        loss (str): "linear" for least squares, or a robust loss
+
+    Raises:
+        ValueError: if fewer than 3 points are usable, or the loss is unknown
+        RuntimeError: if no model could be fitted
+
+    Returns:
+        Tuple[NDArray, NDArray, List[models.ModelFit]]: the usable x and
+            average y, and the fits, best first
+    """
+    x, y = usable_points(x, ys)
+    fits = models.fit_models(candidates, x, y, app_name="dose", loss=loss)
+    return (x, y, fits)
+
+
+app.clientside_callback(
+    """
+    function(_, sessionId) {
+        if (sessionId) {
+            return window.dash_clientside.no_update;
+        }
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+    """,
+    Output("session-id", "data"),
+    [Input("session-id", "modified_timestamp")],
+    [State("session-id", "data")],
+)
+
+
+@app.callback(
+    [
+        Output("indicator-graphic", "figure"),
+        Output("upload-status", "children"),
+        Output("upload-status", "color"),
+        Output("upload-status", "is_open"),
+        Output("model-comparison", "data"),
+    ],
+    [
+        Input("submit-button", "n_clicks"),
+        Input("upload-data", "contents"),
+        Input("fit-loss", "value"),
+    ],
+    [
+        State("input-1-state", "value"),
+        State("input-2-state", "value"),
+        State("upload-data", "filename"),
+        State("session-id", "data"),
+    ],
+)  # type: ignore[misc]
+@metrics.instrument("dose")
+@sampling_profiler.sampled("dose")
+@admission.admit(
+    "fit", busy=lambda message: (no_update, message, "warning", True, no_update)
+)
+def update_graph2(
+    click: int,
+    contents: Optional[str],
+    loss: Optional[str],
+    xs: str,
+    ys: str,
+    filename: Optional[str],
+    session_id: Optional[str],
+) -> Tuple[Any, ...]:
+    status: Tuple[Any, ...] = (no_update, no_update, no_update)
+    session = SESSIONS.get(session_id) if session_id else None
+    triggered = ctx.triggered_prop_ids
+    if "upload-data.contents" in triggered and contents is not None:
+        try:
+            upload = uploads.parse_upload(contents, filename, min_points=3)
+        except uploads.UploadError as err:
+            return (no_update, str(err), "danger", True, no_update)
+        x = upload.matrix[:, 0]
+        y = np.nanmean(upload.matrix[:, 1:], axis=1)  # average any replicates
+        status = (f"Loaded {len(x)} points from {filename}", "success", True)
+    elif "fit-loss.value" in triggered and session and "x" in session:
+        x, y = session["x"], session["y"]  # refit the last data with the new loss
+    elif click == -1:
+        x = np.zeros(5)
+        y = np.zeros(5)
+    else:
+        try:
+            x, y = uploads.parse_pasted(xs, ys, min_points=3)
+        except uploads.UploadError as err:
+            return (no_update, str(err), "danger", True, no_update)
+        status = (None, "danger", False)  # clear any earlier error
+
+    previous = session.get("fits") if session is not None else None
+    try:
+        fits = models.fit_models(
+            list(models.DOSE_MODELS.values()),
+            x,
+            y,
+            None,
+            previous,
+            "dose",
+            loss or "linear",
+        )
+    except RuntimeError as err:
+        return (no_update, str(err), "danger", True, no_update)
+    if session_id:
+        SESSIONS.put(
+            session_id,
+            {"fits": {fit.model.name: fit.variables for fit in fits}, "x": x, "y": y},
+        )
+    return (dose_figure(x, y, fits),) + status + (models.comparison_rows(fits),)
+
+
+@app.callback(
+    [
+        Output("figure-download", "data"),
+        Output("upload-status", "children", allow_duplicate=True),
+        Output("upload-status", "color", allow_duplicate=True),
+        Output("upload-status", "is_open", allow_duplicate=True),
+    ],
+    [
+        Input("export-png", "n_clicks"),
+        Input("export-svg", "n_clicks"),
+        Input("export-pdf", "n_clicks"),
+    ],
+    [State("indicator-graphic", "figure")],
+    prevent_initial_call=True,
+)  # type: ignore[misc]
+@metrics.instrument("dose")
+@admission.admit("fit", busy=lambda message: (no_update, message, "warning", True))
+def export_figure(
+    png: Optional[int],
+    svg: Optional[int],
+    pdf: Optional[int],
+    figure: Optional[Dict[str, Any]],
+) -> Tuple[Any, ...]:
+    if not figure or not figure.get("data"):
+        raise PreventUpdate
+    image_format = str(ctx.triggered_id).rsplit("-", 1)[-1]
+    try:
+        image = figure_export.render(figure, image_format, app_name="dose")
+    except figure_export.ExportError as err:
+        return (no_update, str(err), "danger", True)
+    download = figure_export.download(image, f"dose-response.{image_format}")
+    return (download, no_update, no_update, no_update)
+
+
+def fit_dataset(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit the candidate models to one batch API dataset.
+
+    Args:
+        dataset (Dict[str, Any]): ``x`` log concentrations, ``y`` responses or
+            lists of replicate responses, which are averaged, and optionally
+            ``models``, the names of the models to try, and ``loss``, a
+            robust loss
+
+    Raises:
+        ValueError: if the dataset cannot be fitted
+
+    Returns:
+        Dict[str, Any]: best model name, Kd, points used and the ranked fits
+    """
+    x, ys = batch_api.xy_arrays(dataset)
+    candidates = models.select(models.DOSE_MODELS, dataset.get("models"))
+    loss = str(dataset.get("loss") or "linear")
+    x, _, fits = fit_replicates(x, ys, candidates, loss)
+    return {
+        "best": fits[0].model.name,
+        "kd": float(fits[0].variables[2]),
+        "points": len(x),
+        "models": models.fit_summary(fits),
+    }
+
+
+def dataset_figure(dataset: Dict[str, Any]) -> Dict[str, Any]:
+    """Fit one batch API dataset and plot its best model, for reports.
+
+    Args:
+        dataset (Dict[str, Any]): as for ``fit_dataset``
+
+    Raises:
+        ValueError: if the dataset cannot be fitted
+
+    Returns:
+        Dict[str, Any]: plotly figure
+    """
+    x, ys = batch_api.xy_arrays(dataset)
+    candidates = models.select(models.DOSE_MODELS, dataset.get("models"))
+    loss = str(dataset.get("loss") or "linear")
+    x, y, fits = fit_replicates(x, ys, candidates, loss)
+    return dose_figure(x, y, fits)
+
+
+batch_api.register(server, "dose", fit_dataset)
+figure_export.register(server, "dose", dataset_figure)
+http_cache.enable(app)
+
+
 # Main magic
 if __name__ == "__main__":
     app.run_server(debug=True)
@@ -0,0 +1,114 @@
+"""
+Bounded-size traces for large datasets: LTTB downsampling and WebGL switching.
+
+Fits always use every point; only what is sent to the browser is reduced.
+``display_indices`` picks at most ``MAX_DISPLAY_POINTS`` points of a series
+with Largest-Triangle-Three-Buckets, which keeps peaks, dips and the overall
+shape where plain striding would alias them away. ``lttb_columns`` does the
+same for many series sharing one x axis, such as the wells of a kinetic run,
+in a single pass over the buckets. ``scatter`` returns a WebGL ``Scattergl``
+instead of an SVG ``Scatter`` once a trace has more than ``WEBGL_POINTS``
+points, so browsers stay responsive even at the cap.
+"""
+
+import os
+from typing import Any, Union
+
+import numpy as np
+import plotly.graph_objs as go
+
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+IndexArray = np.ndarray[Any, np.dtype[np.intp]]
+Trace = Union[go.Scatter, go.Scattergl]
+
+MAX_DISPLAY_POINTS: int = int(os.environ.get("BONHAM_MAX_DISPLAY_POINTS", "2000"))
+WEBGL_POINTS: int = int(os.environ.get("BONHAM_WEBGL_POINTS", "1000"))
+
+
+def lttb_columns(x: NDArray, ys: NDArray, n_out: int) -> IndexArray:
+    """Downsample many series sharing sorted x values with LTTB.
+
+    The first and last points are always kept. Between them, the points are
+    split into ``n_out - 2`` buckets and from each bucket the point forming
+    the largest triangle with the previously kept point and the average of
+    the next bucket is kept. NaN readings are never chosen unless a bucket
+    has nothing else.
+
+    Args:
+        x (NDArray): ascending x values, shape (N,)
+        ys (NDArray): y values, shape (N, C)
+        n_out (int): points to keep per series, at least 2
+
+    Returns:
+        IndexArray: kept row indices per series, ascending, shape
+            (min(n_out, N), C)
+    """
+    n, n_columns = ys.shape
+    n_out = max(n_out, 2)
+    if n_out >= n:
+        return np.repeat(np.arange(n)[:, np.newaxis], n_columns, axis=1)
+
+    # Bucket averages come from running sums, ignoring NaN readings
+    valid = ~np.isnan(ys)
+    y_sums = np.concatenate(
+        (np.zeros((1, n_columns)), np.cumsum(np.where(valid, ys, 0.0), axis=0))
+    )
+    y_counts = np.concatenate((np.zeros((1, n_columns)), np.cumsum(valid, axis=0)))
+    x_sums = np.concatenate(([0.0], np.cumsum(x)))
+    edges = np.append(np.linspace(1, n - 1, n_out - 1).astype(np.intp), n)
+
+    columns = np.arange(n_columns)
+    kept: IndexArray = np.empty((n_out, n_columns), dtype=np.intp)
+    kept[0] = 0
+    kept[-1] = n - 1
+    for i in range(n_out - 2):
+        start, stop, after = edges[i], edges[i + 1], edges[i + 2]
+        x_next = (x_sums[after] - x_sums[stop]) / (after - stop)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            y_next = (y_sums[after] - y_sums[stop]) / (y_counts[after] - y_counts[stop])
+        x_prev = x[kept[i]]
+        y_prev = ys[kept[i], columns]
+        areas = np.abs(
+            (x_prev - x_next) * (ys[start:stop] - y_prev)
+            - (x_prev - x[start:stop, np.newaxis]) * (y_next - y_prev)
+        )
+        areas[np.isnan(areas)] = -1.0
+        kept[i + 1] = start + np.argmax(areas, axis=0)
+    return kept
+
+
+def display_indices(
+    x: NDArray, y: NDArray, n_out: int = MAX_DISPLAY_POINTS
+) -> IndexArray:
+    """Choose which points of one series to plot, in x order.
+
+    Args:
+        x (NDArray): x values, in any order
+        y (NDArray): y values
+        n_out (int): most points to keep
+
+    Returns:
+        IndexArray: indices into ``x`` and ``y``; all of them, sorted by x,
+            if there are no more than ``n_out``
+    """
+    order: IndexArray = np.argsort(x, kind="stable")
+    if len(x) <= n_out:
+        return order
+    kept = lttb_columns(x[order], y[order, np.newaxis], n_out)[:, 0]
+    chosen: IndexArray = order[kept]
+    return chosen
+
+
+def scatter(**kwargs: Any) -> Trace:
+    """Make a scatter trace, using WebGL when it has many points.
+
+    Args:
+        **kwargs: ``go.Scatter`` properties, including ``x``
+
+    Returns:
+        Trace: ``go.Scattergl`` above ``WEBGL_POINTS`` points, else
+            ``go.Scatter``
+    """
+    if len(kwargs.get("x", ())) > WEBGL_POINTS:
+        return go.Scattergl(**kwargs)
+    return go.Scatter(**kwargs)
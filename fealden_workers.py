@@ -0,0 +1,371 @@
+"""
+Warm, supervised worker processes for Fealden searches.
+
+Importing Fealden and its folding backend costs more than many searches, so
+the Fealden app does not run searches itself. ``POOL`` keeps
+``BONHAM_FEALDEN_WORKERS`` long-lived processes, each of which imports
+Fealden once and then takes runs over a socket, one at a time. A worker
+retires itself after ``BONHAM_FEALDEN_MAX_RUNS`` runs, or once its peak memory
+passes ``BONHAM_FEALDEN_MAX_RSS_BYTES``, and one that crashes or overruns
+``BONHAM_FEALDEN_TIMEOUT`` is killed. Either way a replacement is started at
+once, so it has finished importing by the time the next run needs it.
+
+Workers are fresh interpreters running this module (``python -m
+fealden_workers``), not ``multiprocessing`` children: forking the threaded web
+worker is unsafe, and ``spawn`` would re-run the web server's main script in
+every worker. A worker exits when its socket closes, so workers do not outlive
+the web worker even if it is killed. The pool starts on the first run, or,
+under ``gunicorn.conf.py``, as each web worker boots, never in the preloading
+master. A process forked after its pool has started starts a pool of its own
+rather than sharing the parent's sockets.
+Passing the socket needs POSIX; elsewhere,
+or with ``BONHAM_FEALDEN_WORKERS=0``, searches run in the web worker as before.
+"""
+
+import atexit
+import os
+import pickle
+import queue
+import socket
+import subprocess
+import sys
+import threading
+import time
+from importlib import import_module
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Sequence, Tuple
+
+try:
+    import resource
+except ImportError:  # not on Windows, where memory recycling is off
+    resource = None  # type: ignore[assignment]
+
+import fold_cache
+import metrics
+
+ROOT = Path(__file__).resolve().parent
+FEALDEN_MODULE = "fealden.fealden.fealden"
+FEALDEN_WORKERS: int = int(
+    os.environ.get("BONHAM_FEALDEN_WORKERS", "2" if os.name == "posix" else "0")
+)
+FEALDEN_MAX_RUNS: int = int(os.environ.get("BONHAM_FEALDEN_MAX_RUNS", "50"))
+FEALDEN_MAX_RSS_BYTES: int = int(
+    os.environ.get("BONHAM_FEALDEN_MAX_RSS_BYTES", str(1024 * 1024 * 1024))
+)
+FEALDEN_TIMEOUT: float = float(os.environ.get("BONHAM_FEALDEN_TIMEOUT", "120"))
+STOP_GRACE = 5.0  # seconds a retiring worker gets to exit before it is killed
+
+Reply = Tuple[str, Any, bool]  # status, result or message, retiring
+
+
+class WorkerError(RuntimeError):
+    """A run failed: the target raised, or its worker crashed or timed out."""
+
+
+def _load(target: str) -> Callable[..., Any]:
+    module_name, _, name = target.partition(":")
+    function: Callable[..., Any] = getattr(import_module(module_name), name)
+    return function
+
+
+def _peak_rss() -> int:
+    """Peak resident memory of this process in bytes, 0 if unknown."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return int(peak if sys.platform == "darwin" else peak * 1024)  # KiB on Linux
+
+
+def _serve(
+    connection: Connection,
+    target: str,
+    preload: Sequence[str],
+    max_runs: int,
+    max_rss_bytes: int,
+) -> None:
+    """Worker process main loop: import everything once, then run requests.
+
+    Args:
+        connection (Connection): socket to the pool
+        target (str): ``module:function`` to call for each run
+        preload (Sequence[str]): modules to import before the first run
+        max_runs (int): runs after which to retire
+        max_rss_bytes (int): peak memory after which to retire, 0 for no limit
+    """
+    try:
+        for module in preload:
+            import_module(module)
+        function = _load(target)
+    except Exception as err:  # report why, rather than dying silently
+        connection.send(("failed", f"Could not load {target}: {err}", True))
+        return
+    connection.send(("ready", None, False))
+    for runs in range(1, max_runs + 1):
+        try:
+            args, kwargs = connection.recv()
+        except EOFError:  # the pool closed, or its process died
+            return
+        try:
+            status, value = "ok", function(*args, **kwargs)
+        except Exception as err:
+            status, value = "error", f"{type(err).__name__}: {err}"
+        retiring = runs == max_runs or 0 < max_rss_bytes < _peak_rss()
+        try:
+            connection.send((status, value, retiring))
+        except (pickle.PicklingError, TypeError, AttributeError) as err:
+            connection.send(("error", f"Unpicklable result: {err}", retiring))
+        if retiring:
+            return
+
+
+class _Worker:
+    """One worker process and the pool's end of its socket."""
+
+    def __init__(self, pool: "WorkerPool") -> None:
+        ours, theirs = socket.socketpair()
+        path = [str(ROOT)] + [p for p in [os.environ.get("PYTHONPATH")] if p]
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                __name__,
+                str(theirs.fileno()),
+                pool.target,
+                str(pool.max_runs),
+                str(pool.max_rss_bytes),
+                *pool.preload,
+            ],
+            pass_fds=(theirs.fileno(),),
+            env={**os.environ, "PYTHONPATH": os.pathsep.join(path)},
+        )
+        theirs.close()
+        self.connection = Connection(ours.detach())
+        self.ready = False
+
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def request(self, call: Tuple[Any, ...], timeout: float) -> Reply:
+        """Send one run and wait for its reply, after the worker's import.
+
+        Raises:
+            WorkerError: if the worker could not import its target
+            TimeoutError: if the worker did not finish within ``timeout``
+            EOFError: if the worker exited without replying
+        """
+        deadline = time.monotonic() + timeout
+        if not self.ready:
+            status, message, _ = self._receive(deadline)
+            if status == "failed":
+                raise WorkerError(message)
+            self.ready = True
+        self.connection.send(call)
+        return self._receive(deadline)
+
+    def _receive(self, deadline: float) -> Reply:
+        if not self.connection.poll(max(0.0, deadline - time.monotonic())):
+            raise TimeoutError
+        reply: Reply = self.connection.recv()
+        return reply
+
+    def stop(self, kill: bool = False) -> None:
+        """Close the socket, which ends the worker, killing it if it lingers."""
+        if kill:
+            self.process.kill()
+        self.connection.close()
+        try:
+            self.process.wait(STOP_GRACE)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+class WorkerPool:
+    """A fixed number of warm worker processes, replaced as they retire or fail.
+
+    Args:
+        target (str): ``module:function`` each worker imports and calls
+        name (str): label for metrics and messages
+        size (int): worker processes; 0 to call the target in this process
+        max_runs (int): runs after which a worker is replaced
+        max_rss_bytes (int): peak memory after which a worker is replaced, 0
+            for no limit
+        timeout (float): seconds to wait for a free worker, and for a run
+        preload (Sequence[str]): modules each worker imports before its first
+            run
+    """
+
+    def __init__(
+        self,
+        target: str,
+        name: str,
+        size: int,
+        max_runs: int,
+        max_rss_bytes: int,
+        timeout: float,
+        preload: Sequence[str] = (),
+    ) -> None:
+        self.target = target
+        self.name = name
+        self.size = max(0, size)
+        self.max_runs = max(1, max_runs)
+        self.max_rss_bytes = max_rss_bytes
+        self.timeout = timeout
+        self.preload = tuple(preload)
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        self._local: Optional[Callable[..., Any]] = None
+        if hasattr(os, "register_at_fork"):
+            os.register_at_fork(after_in_child=self._after_fork)
+
+    def start(self) -> None:
+        """Start the workers, once, so they import before the first run."""
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+            for _ in range(self.size):
+                self._idle.put(_Worker(self))
+        atexit.register(self.close)
+
+    def _after_fork(self) -> None:
+        """In a forked child, leave the parent's workers to it and start anew."""
+        started = self._started
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+        if started:
+            self.start()
+
+    def call(self, *args: Any, **kwargs: Any) -> Any:
+        """Run the target in a warm worker, waiting for one to be free.
+
+        Raises:
+            WorkerError: if no worker was free within the timeout, the target
+                raised, or the worker crashed or timed out
+
+        Returns:
+            Any: the target's return value
+        """
+        if self.size == 0:
+            return self._call_here(args, kwargs)
+        self.start()
+        try:
+            worker = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            metrics.record_worker_run(self.name, "busy")
+            raise WorkerError(f"All {self.name} workers are busy; try again later")
+        if not worker.alive():  # died while idle
+            self._replace(worker, "crash")
+            worker = self._idle.get()
+
+        outcome = "crash"
+        try:
+            status, value, retiring = worker.request((args, kwargs), self.timeout)
+            outcome = "retired" if retiring else "ok"
+        except TimeoutError:
+            outcome = "timeout"
+            raise WorkerError(
+                f"{self.name} run timed out after {self.timeout:g} s"
+            ) from None
+        except (EOFError, OSError):
+            raise WorkerError(f"{self.name} worker exited unexpectedly") from None
+        finally:
+            metrics.record_worker_run(self.name, outcome)
+            if outcome == "ok":
+                self._idle.put(worker)
+            else:
+                self._replace(worker, outcome)
+
+        if status == "error":
+            raise WorkerError(value)
+        return value
+
+    def _call_here(self, args: Tuple[Any, ...], kwargs: Any) -> Any:
+        try:
+            if self._local is None:
+                self._local = _load(self.target)
+            return self._local(*args, **kwargs)
+        except Exception as err:
+            raise WorkerError(f"{type(err).__name__}: {err}") from err
+
+    def _replace(self, worker: _Worker, reason: str) -> None:
+        """Start a successor at once, and reap the old worker in the background."""
+        self._idle.put(_Worker(self))
+        if reason != "retired":
+            metrics.record_worker_restart(self.name, reason)
+        kill = reason == "timeout"
+        threading.Thread(target=worker.stop, args=(kill,), daemon=True).start()
+
+    def close(self) -> None:
+        """Stop the idle workers; busy ones exit once their run ends."""
+        workers: List[_Worker] = []
+        while True:
+            try:
+                workers.append(self._idle.get_nowait())
+            except queue.Empty:
+                break
+        for worker in workers:
+            worker.stop()
+
+
+def search(
+    sequence: str, max_length: int, fixed: bool, output_file: str
+) -> fold_cache.CacheStats:
+    """Run one Fealden search in this process; what each worker calls.
+
+    The ``Fealden`` object itself stays in the worker: the results go to
+    ``output_file``, and only the search's folding cache counts go back over
+    the socket.
+    """
+    fealden = import_module(FEALDEN_MODULE)
+    fold_cache.install()
+    fold_cache.reset()
+    try:
+        fealden.Fealden(sequence, 1, max_length, 500, False, output_file, fixed)
+    finally:
+        fold_cache.CACHE.flush()  # share this search's folds with other workers
+    return fold_cache.CACHE.stats
+
+
+POOL = WorkerPool(
+    "fealden_workers:search",
+    "fealden",
+    FEALDEN_WORKERS,
+    FEALDEN_MAX_RUNS,
+    FEALDEN_MAX_RSS_BYTES,
+    FEALDEN_TIMEOUT,
+    preload=(FEALDEN_MODULE,),
+)
+
+
+def run(
+    sequence: str, max_length: int, fixed: bool, output_file: str
+) -> fold_cache.CacheStats:
+    """Run one Fealden search on a warm worker, writing its results CSV.
+
+    Args:
+        sequence (str): aptamer or recognition element sequence
+        max_length (int): maximum sensor length
+        fixed (bool): whether the 3' end carries a fixed methylene blue
+        output_file (str): results CSV path, relative to the working directory
+
+    Raises:
+        WorkerError: if the search failed, crashed or timed out
+
+    Returns:
+        fold_cache.CacheStats: the search's folding cache hits and misses
+    """
+    stats: fold_cache.CacheStats = POOL.call(sequence, max_length, fixed, output_file)
+    metrics.record_fold_cache(stats.hits, stats.misses)
+    return stats
+
+
+if __name__ == "__main__":  # a worker process, started by WorkerPool
+    fd, target, max_runs, max_rss_bytes, *preload = sys.argv[1:]
+    try:
+        _serve(Connection(int(fd)), target, preload, int(max_runs), int(max_rss_bytes))
+    except ConnectionError:  # the pool's end closed, e.g. its web worker exited
+        pass
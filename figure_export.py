@@ -0,0 +1,588 @@
+"""
+Static PNG, SVG and PDF export of the apps' figures, rendered server-side.
+
+Rendering goes through Kaleido, which drives a headless Chromium. Starting
+that browser costs about a second, so images are rendered by a small pool of
+long-lived renderer processes (``BONHAM_RENDER_PROCESSES``): each renderer
+thread starts its own browser process on its first image and keeps it for
+every later one, restarting it only if it dies. Workers that never export
+never start a browser.
+
+Rendered images are cached by a hash of the figure JSON and the output
+format and size: in memory, and in a directory (``BONHAM_EXPORT_CACHE``, on by
+default) that the Passenger workers of an app share, so a figure downloaded
+again, or included in a report after being downloaded, is rendered only once.
+Concurrent requests for an image still being rendered wait for
+that render instead of starting another.
+
+``register`` adds ``POST /api/report``, which takes datasets in the batch API
+format (see ``batch_api``), fits and plots each, and streams a multi-figure
+report back page by page as the figures render: an HTML document with one
+figure per printed page (``format=html``, the default; print it to PDF for a
+multi-page PDF), or a ZIP of image files (``format=zip``). Reports are
+admitted like batch requests, holding a ``fit`` slot while they stream.
+"""
+
+import base64
+import hashlib
+import html
+import json
+import os
+import threading
+import zipfile
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from pathlib import Path
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import flask
+import plotly
+import plotly.io as pio
+
+try:
+    from kaleido.scopes.plotly import PlotlyScope
+except ImportError:  # kaleido is optional, needed only for image export
+    PlotlyScope = None
+
+import batch_api
+import metrics
+
+RENDER_PROCESSES: int = int(os.environ.get("BONHAM_RENDER_PROCESSES", "2"))
+RENDER_TIMEOUT: float = float(os.environ.get("BONHAM_RENDER_TIMEOUT", "60"))
+EXPORT_CACHE: str = os.environ.get("BONHAM_EXPORT_CACHE", "export-cache")
+EXPORT_MEMORY_BYTES: int = int(
+    os.environ.get("BONHAM_EXPORT_MEMORY_BYTES", str(32 * 1024 * 1024))
+)
+EXPORT_DISK_BYTES: int = int(
+    os.environ.get("BONHAM_EXPORT_DISK_BYTES", str(256 * 1024 * 1024))
+)
+
+# Publication defaults: 6 x 4 in at 300 dpi for PNG; SVG and PDF are vector
+WIDTH = 900
+HEIGHT = 600
+SCALE = 2.0
+MIME_TYPES = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+MAX_IN_FLIGHT: int = 2 * RENDER_PROCESSES  # per report
+PRUNE_EVERY = 64  # disk writes between size checks
+PLOTLY_JS = str(Path(plotly.__file__).parent / "package_data" / "plotly.min.js")
+
+Figure = Dict[str, Any]
+FigureMaker = Callable[[batch_api.Dataset], Figure]
+
+REPORT_STYLE = (
+    "body{font-family:lato,sans-serif;margin:2em}"
+    "section{page-break-after:always;break-after:page}"
+    "section img,section svg{max-width:100%;height:auto}"
+    ".error{color:#b00}"
+)
+
+
+class ExportError(Exception):
+    """Raised when a figure cannot be rendered; the message is user-facing."""
+
+
+class ImageCache:
+    """Rendered images by key: an in-memory LRU over an optional directory."""
+
+    def __init__(
+        self,
+        directory: Optional[str] = EXPORT_CACHE,
+        memory_bytes: int = EXPORT_MEMORY_BYTES,
+        disk_bytes: int = EXPORT_DISK_BYTES,
+    ) -> None:
+        self.directory = Path(directory) if directory else None
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_total = 0
+        self._writes = 0
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return a cached image, promoting a disk hit into memory.
+
+        Args:
+            key (str): image key from ``image_key``
+
+        Returns:
+            Optional[bytes]: image bytes, None if not cached
+        """
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                return data
+        if self.directory is None:
+            return None
+        path = self.directory / key
+        try:
+            data = path.read_bytes()
+            os.utime(path)  # pruning removes the least recently used first
+        except OSError:
+            return None
+        self._remember(key, data)
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Cache an image in memory and, if configured, on disk.
+
+        Args:
+            key (str): image key from ``image_key``
+            data (bytes): image bytes
+        """
+        self._remember(key, data)
+        if self.directory is None:
+            return
+        path = self.directory / key
+        partial = path.with_name(f".{key}.{os.getpid()}.{threading.get_ident()}")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            partial.write_bytes(data)
+            os.replace(partial, path)  # readers never see a partial file
+        except OSError:
+            return  # the disk copy is only an optimization
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def _remember(self, key: str, data: bytes) -> None:
+        if len(data) > self.memory_bytes // 4:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = data
+            self._memory_total += len(data)
+            while self._memory_total > self.memory_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_total -= len(evicted)
+
+    def prune(self) -> None:
+        """Delete the least recently used files beyond the disk byte cap."""
+        if self.directory is None:
+            return
+        files: List[Tuple[float, int, Path]] = []
+        for path in self.directory.iterdir():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # removed by another worker
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files, key=lambda item: item[0]):
+            if total <= self.disk_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+
+CACHE = ImageCache()
+
+# Each renderer thread drives its own Kaleido scope, which keeps one Chromium
+# process running for as long as the thread lives
+_POOL = ThreadPoolExecutor(max_workers=RENDER_PROCESSES, thread_name_prefix="render")
+_renderer = threading.local()
+_rendering: Dict[str, "Future[bytes]"] = {}  # image key -> render in progress
+_waiters: Dict["Future[bytes]", int] = {}  # requests waiting on each render
+_rendering_lock = threading.Lock()
+
+
+def _render(
+    figure_text: str, image_format: str, width: int, height: int, scale: float
+) -> bytes:
+    """Render one figure on this renderer thread's browser."""
+    if PlotlyScope is None:
+        raise ExportError("Image export needs the optional kaleido package")
+    scope = getattr(_renderer, "scope", None)
+    if scope is None:
+        # Offline: plotly.js from the plotly package, and no MathJax download
+        scope = PlotlyScope(plotlyjs=PLOTLY_JS, mathjax=False)
+        _renderer.scope = scope
+    data: bytes = scope.transform(
+        json.loads(figure_text),
+        format=image_format,
+        width=width,
+        height=height,
+        scale=scale,
+    )
+    return data
+
+
+def figure_json(figure: Any) -> str:
+    """Serialize a figure compactly, as rendered and as hashed.
+
+    Args:
+        figure (Any): plotly figure, or a dict of ``data`` and ``layout``
+            holding graph objects or plain dicts
+
+    Returns:
+        str: figure JSON
+    """
+    text: str = pio.to_json(figure, validate=False)
+    return text
+
+
+def image_key(
+    figure_text: str, image_format: str, width: int, height: int, scale: float
+) -> str:
+    """Cache key of a rendered figure.
+
+    Args:
+        figure_text (str): figure JSON from ``figure_json``
+        image_format (str): "png", "svg" or "pdf"
+        width (int): image width in CSS pixels
+        height (int): image height in CSS pixels
+        scale (float): pixel density multiplier (PNG only)
+
+    Returns:
+        str: hex digest with the format as extension
+    """
+    digest = hashlib.sha256(f"{width}x{height}@{scale}\n".encode())
+    digest.update(figure_text.encode())
+    return f"{digest.hexdigest()[:40]}.{image_format}"
+
+
+def render_async(
+    figure: Any,
+    image_format: str = "png",
+    width: int = WIDTH,
+    height: int = HEIGHT,
+    scale: float = SCALE,
+    app_name: str = "export",
+) -> "Future[bytes]":
+    """Start rendering a figure, or return the cached or in-progress image.
+
+    Renders are shared between requests; a caller that stops waiting should
+    ``abandon`` the future rather than cancel it.
+
+    Args:
+        figure (Any): plotly figure, or a dict of ``data`` and ``layout``
+        image_format (str): "png", "svg" or "pdf"
+        width (int): image width in CSS pixels
+        height (int): image height in CSS pixels
+        scale (float): pixel density multiplier (PNG only)
+        app_name (str): app label for metrics
+
+    Raises:
+        ExportError: if the format is not supported
+
+    Returns:
+        Future[bytes]: the image
+    """
+    if image_format not in MIME_TYPES:
+        raise ExportError(f"Unsupported image format {image_format!r}")
+    if image_format != "png":
+        scale = 1.0  # vector output; scaling would only change the nominal size
+    text = figure_json(figure)
+    key = image_key(text, image_format, width, height, scale)
+    data = CACHE.get(key)
+    metrics.record_export(app_name, image_format, data is not None)
+    if data is not None:
+        done: "Future[bytes]" = Future()
+        done.set_result(data)
+        return done
+
+    with _rendering_lock:
+        future = _rendering.get(key)
+        started = future is None
+        if future is None:
+            future = _POOL.submit(_render, text, image_format, width, height, scale)
+            _rendering[key] = future
+        _waiters[future] = _waiters.get(future, 0) + 1
+    if not started:
+        return future
+
+    def finished(result: "Future[bytes]") -> None:
+        with _rendering_lock:
+            _rendering.pop(key, None)
+            _waiters.pop(result, None)
+        if not result.cancelled() and result.exception() is None:
+            CACHE.put(key, result.result())
+
+    future.add_done_callback(finished)
+    return future
+
+
+def abandon(future: "Future[bytes]") -> None:
+    """Stop waiting for a render, cancelling it if no one else is waiting.
+
+    A render other requests still wait for, or one already running, goes on
+    and its image is cached.
+
+    Args:
+        future (Future[bytes]): from ``render_async``
+    """
+    with _rendering_lock:
+        waiting = _waiters.get(future, 0) - 1
+        if waiting > 0:
+            _waiters[future] = waiting
+            return
+        _waiters.pop(future, None)
+    future.cancel()  # outside the lock: it runs ``finished`` synchronously
+
+
+def wait_for(future: "Future[bytes]") -> bytes:
+    """Wait for a render, turning its failures into ExportError.
+
+    Args:
+        future (Future[bytes]): from ``render_async``
+
+    Raises:
+        ExportError: if rendering failed, timed out or was cancelled
+
+    Returns:
+        bytes: the image
+    """
+    try:
+        return future.result(timeout=RENDER_TIMEOUT)
+    except FutureTimeout:
+        raise ExportError(f"Rendering took longer than {RENDER_TIMEOUT:g} s")
+    except CancelledError:
+        raise ExportError("Rendering was cancelled")
+    except (ValueError, RuntimeError) as err:
+        raise ExportError(f"Could not render figure: {err}")
+
+
+def render(
+    figure: Any,
+    image_format: str = "png",
+    width: int = WIDTH,
+    height: int = HEIGHT,
+    scale: float = SCALE,
+    app_name: str = "export",
+) -> bytes:
+    """Render a figure to image bytes, from the cache when possible.
+
+    Args:
+        figure (Any): plotly figure, or a dict of ``data`` and ``layout``
+        image_format (str): "png", "svg" or "pdf"
+        width (int): image width in CSS pixels
+        height (int): image height in CSS pixels
+        scale (float): pixel density multiplier (PNG only)
+        app_name (str): app label for metrics
+
+    Raises:
+        ExportError: if the figure cannot be rendered
+
+    Returns:
+        bytes: the image
+    """
+    return wait_for(render_async(figure, image_format, width, height, scale, app_name))
+
+
+def download(data: bytes, filename: str) -> Dict[str, Any]:
+    """Wrap an image for a ``dcc.Download`` component.
+
+    Args:
+        data (bytes): image bytes
+        filename (str): name to save as; its extension gives the type
+
+    Returns:
+        Dict[str, Any]: ``dcc.Download`` data
+    """
+    return {
+        "content": base64.b64encode(data).decode("ascii"),
+        "filename": filename,
+        "type": MIME_TYPES.get(filename.rsplit(".", 1)[-1]),
+        "base64": True,
+    }
+
+
+Page = Tuple[int, str, "Optional[Future[bytes]]", Optional[str]]
+
+
+def _pages(
+    make_figure: FigureMaker,
+    app_name: str,
+    image_format: str,
+    datasets: Iterable[Tuple[Any, Optional[str]]],
+) -> Iterator[Page]:
+    """Fit and plot each dataset, start its render, and yield pages in order.
+
+    Up to ``MAX_IN_FLIGHT`` renders run ahead of the page being yielded, so
+    fitting the next datasets overlaps with rendering the current ones.
+    """
+    pending: Deque[Page] = deque()
+    try:
+        for index, (dataset, error) in enumerate(datasets):
+            if index >= batch_api.MAX_DATASETS:
+                limit = f"Reports are limited to {batch_api.MAX_DATASETS} datasets"
+                pending.append((index, "Truncated", None, limit))
+                break
+            dataset_id = dataset.get("id") if isinstance(dataset, dict) else None
+            title = f"Dataset {index + 1}" if dataset_id is None else str(dataset_id)
+            future = None
+            if error is None and not isinstance(dataset, dict):
+                error = "Each dataset must be a JSON object"
+            if error is None:
+                try:
+                    figure = make_figure(dataset)
+                    future = render_async(figure, image_format, app_name=app_name)
+                except KeyError as err:
+                    error = f"Missing field {err}"
+                except (ValueError, TypeError, RuntimeError, ExportError) as err:
+                    error = str(err)
+            metrics.record_batch_item(app_name, error is None)
+            pending.append((index, title, future, error))
+            while len(pending) > MAX_IN_FLIGHT:
+                yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+    finally:
+        for _, _, future, _ in pending:  # client went away
+            if future is not None:
+                abandon(future)
+
+
+def _resolve(page: Page) -> Tuple[Optional[bytes], Optional[str]]:
+    _, _, future, error = page
+    if future is None:
+        return (None, error)
+    try:
+        return (wait_for(future), None)
+    except ExportError as err:
+        return (None, str(err))
+
+
+def html_report(pages: Iterator[Page], image_format: str) -> Iterator[str]:
+    """Stream an HTML report, one figure per printed page.
+
+    Args:
+        pages (Iterator[Page]): from ``_pages``
+        image_format (str): "svg", inlined, or "png", as data URIs
+
+    Yields:
+        str: document chunks
+    """
+    yield (
+        "<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+        f"<title>Fit report</title><style>{REPORT_STYLE}</style></head><body>\n"
+    )
+    for page in pages:
+        data, error = _resolve(page)
+        yield f"<section><h2>{html.escape(page[1])}</h2>"
+        if data is None:
+            yield f"<p class='error'>{html.escape(error or '')}</p></section>\n"
+        elif image_format == "svg":
+            yield data.decode("utf-8") + "</section>\n"
+        else:
+            encoded = base64.b64encode(data).decode("ascii")
+            yield f"<img src='data:image/png;base64,{encoded}'></section>\n"
+    yield "</body></html>\n"
+
+
+class _ChunkWriter:
+    """Write-only file object whose contents are collected and handed out."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def zip_report(pages: Iterator[Page], image_format: str) -> Iterator[bytes]:
+    """Stream a ZIP of one image per dataset, and a text file per failure.
+
+    Images are already compressed, so entries are stored, not deflated.
+
+    Args:
+        pages (Iterator[Page]): from ``_pages``
+        image_format (str): "png", "svg" or "pdf"
+
+    Yields:
+        bytes: archive chunks
+    """
+    writer = _ChunkWriter()
+    # A non-seekable target makes zipfile write each entry in a single pass
+    with zipfile.ZipFile(writer, "w", zipfile.ZIP_STORED) as archive:
+        for page in pages:
+            data, error = _resolve(page)
+            stem = "".join(c if c.isalnum() or c in "-_." else "_" for c in page[1])
+            stem = f"{page[0] + 1:04d}-{stem}"
+            if data is None:
+                archive.writestr(f"{stem}.txt", error or "")
+            else:
+                archive.writestr(f"{stem}.{image_format}", data)
+            yield writer.take()
+    yield writer.take()
+
+
+def register(server: flask.Flask, app_name: str, make_figure: FigureMaker) -> None:
+    """Add the ``/api/report`` route to a server.
+
+    Args:
+        server (flask.Flask): the app's Flask server
+        app_name (str): app label for metrics
+        make_figure (FigureMaker): fits and plots one batch API dataset,
+            raising ValueError (or TypeError, KeyError, RuntimeError) with a
+            message for datasets it cannot use
+    """
+
+    def report() -> flask.Response:
+        report_format = flask.request.args.get("format", "html")
+        image_format = flask.request.args.get(
+            "image", "svg" if report_format == "html" else "png"
+        )
+        if report_format not in ("html", "zip"):
+            return batch_api.error_response("format must be html or zip", 400)
+        allowed = ("svg", "png") if report_format == "html" else tuple(MIME_TYPES)
+        if image_format not in allowed:
+            formats = ", ".join(allowed)
+            return batch_api.error_response(
+                f"image must be one of {formats} for {report_format}", 400
+            )
+        try:
+            datasets = batch_api.read_datasets()
+        except batch_api.BodyTooLarge as err:
+            return batch_api.error_response(str(err), 413)
+        except ValueError as err:
+            return batch_api.error_response(str(err), 400)
+
+        def respond() -> flask.Response:
+            pages = _pages(make_figure, app_name, image_format, datasets)
+            if report_format == "html":
+                return flask.Response(
+                    flask.stream_with_context(html_report(pages, image_format)),
+                    mimetype="text/html",
+                )
+            return flask.Response(
+                flask.stream_with_context(zip_report(pages, image_format)),
+                mimetype="application/zip",
+                headers={
+                    "Content-Disposition": (
+                        f"attachment; filename={app_name}-report.zip"
+                    )
+                },
+            )
+
+        return batch_api.admit(respond, batch_api.admission_cost(datasets))
+
+    server.add_url_rule(
+        "/api/report", f"bonham_report_{app_name}", report, methods=["POST"]
+    )
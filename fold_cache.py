@@ -0,0 +1,316 @@
+"""
+Memoized folding-energy evaluations, shared by every Fealden worker and run.
+
+Fealden's search folds the same candidate sequences over and over, within a
+run and across runs for related aptamers. ``install`` wraps the folding
+functions named in ``BONHAM_FOLD_TARGETS`` (``module:function``, comma
+separated) so each result is computed once: it is looked up by a hash of the
+function, its package's version and its arguments, first in this process's
+memory, then in a SQLite
+file (``BONHAM_FOLD_CACHE``) that all workers of all apps on the host share.
+New results are written in batches, at most ``FLUSH_EVERY`` at a time and at
+the end of each search, and the file is pruned to ``BONHAM_FOLD_CACHE_BYTES``,
+least recently used first. The file outlives deployments, so the package
+version (its installed distribution's, or a hash of the target module's source)
+is part of every key, as is ``BONHAM_FOLD_CACHE_EPOCH``: change that after
+upgrading a folding backend outside the package to start afresh.
+
+Wrapped functions must be deterministic in their arguments, which must
+pickle; calls that do not pickle pass straight through. ``CACHE.stats``
+counts hits and misses; ``reset`` and ``CACHE.flush`` bracket one search so it
+can report its own.
+"""
+
+import functools
+import hashlib
+import importlib.metadata
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from importlib import import_module
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+FOLD_TARGETS: List[str] = [
+    target.strip()
+    for target in os.environ.get(
+        "BONHAM_FOLD_TARGETS", "fealden.fealden.fold:fold"
+    ).split(",")
+    if target.strip()
+]
+FOLD_CACHE: str = os.environ.get("BONHAM_FOLD_CACHE", "fold-cache.sqlite3")
+FOLD_CACHE_BYTES: int = int(
+    os.environ.get("BONHAM_FOLD_CACHE_BYTES", str(256 * 1024 * 1024))
+)
+FOLD_MEMORY_BYTES: int = int(
+    os.environ.get("BONHAM_FOLD_MEMORY_BYTES", str(64 * 1024 * 1024))
+)
+FOLD_CACHE_EPOCH: str = os.environ.get("BONHAM_FOLD_CACHE_EPOCH", "")
+FLUSH_EVERY = 256  # pending results written to SQLite in one transaction
+TOUCH_AFTER = 3600.0  # seconds before a hit refreshes an entry's LRU time
+PRUNE_EVERY = 16  # flushes between size checks
+
+
+@dataclass
+class CacheStats:
+    """Folding evaluations answered from the cache, and computed afresh."""
+
+    hits: int = 0
+    misses: int = 0
+    unhashable: int = 0
+
+    @property
+    def lookups(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.lookups if self.lookups else 0.0
+
+
+class FoldCache:
+    """Two-level memo of pickled results: per-process LRU over shared SQLite."""
+
+    def __init__(
+        self,
+        db_path: Optional[str] = FOLD_CACHE,
+        disk_bytes: int = FOLD_CACHE_BYTES,
+        memory_bytes: int = FOLD_MEMORY_BYTES,
+    ) -> None:
+        self.db_path = db_path or None
+        self.disk_bytes = disk_bytes
+        self.memory_bytes = memory_bytes
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._memory_total = 0
+        self._pending: Dict[bytes, bytes] = {}
+        self._local = threading.local()
+        self._flushes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        """This thread's connection, opening the file on first use."""
+        db: Optional[sqlite3.Connection] = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.db_path), timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS folds ("
+                    " key BLOB PRIMARY KEY, used REAL, size INTEGER, value BLOB)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS folds_used ON folds (used)")
+            self._local.db = db
+        return db
+
+    def lookup(self, key: bytes) -> Optional[bytes]:
+        """Return a cached pickled result, counting the hit or miss.
+
+        Args:
+            key (bytes): call hash, from ``call_key``
+
+        Returns:
+            Optional[bytes]: the pickled result, or None if never computed
+        """
+        with self._lock:
+            blob = self._memory.get(key)
+            if blob is not None:
+                self._memory.move_to_end(key)
+            else:
+                blob = self._pending.get(key)  # evicted from memory, not yet written
+            if blob is not None:
+                self.stats.hits += 1
+                return blob
+        if self.db_path is not None:
+            db = self._connect()
+            row = db.execute(
+                "SELECT used, value FROM folds WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                now = time.time()
+                if now - row[0] > TOUCH_AFTER:
+                    with db:
+                        db.execute(
+                            "UPDATE folds SET used = ? WHERE key = ?", (now, key)
+                        )
+                with self._lock:
+                    self._remember(key, row[1])
+                    self.stats.hits += 1
+                return bytes(row[1])
+        with self._lock:
+            self.stats.misses += 1
+        return None
+
+    def store(self, key: bytes, blob: bytes) -> None:
+        """Keep a newly computed pickled result, writing it out in batches.
+
+        Args:
+            key (bytes): call hash
+            blob (bytes): pickled result
+        """
+        with self._lock:
+            self._remember(key, blob)
+            self._pending[key] = blob
+            full = len(self._pending) >= FLUSH_EVERY
+        if full:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write pending results to SQLite, pruning it now and then."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if self.db_path is None or not pending:
+            return
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO folds VALUES (?, ?, ?, ?)",
+                [(key, now, len(blob), blob) for key, blob in pending.items()],
+            )
+        self._flushes += 1
+        if self._flushes % PRUNE_EVERY == 1:
+            self._prune()
+
+    def _remember(self, key: bytes, blob: bytes) -> None:
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_total -= len(previous)
+        self._memory[key] = blob
+        self._memory_total += len(blob)
+        while self._memory_total > self.memory_bytes and len(self._memory) > 1:
+            _, dropped = self._memory.popitem(last=False)
+            self._memory_total -= len(dropped)
+
+    def _prune(self) -> None:
+        with self._connect() as db:
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM folds").fetchone()
+            excess = total[0] - self.disk_bytes
+            if excess <= 0:
+                return
+            doomed: List[Tuple[bytes]] = []
+            for key, size in db.execute("SELECT key, size FROM folds ORDER BY used"):
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+            db.executemany("DELETE FROM folds WHERE key = ?", doomed)
+
+
+CACHE = FoldCache()
+_installed: Dict[str, Callable[..., Any]] = {}  # target -> original function
+
+
+def call_key(target: str, args: Tuple[Any, ...], kwargs: Dict[str, Any]) -> bytes:
+    """Hash a call, for use as a cache key.
+
+    Raises:
+        pickle.PicklingError, TypeError, AttributeError: if an argument does
+            not pickle
+    """
+    payload = pickle.dumps(
+        (FOLD_CACHE_EPOCH, target, args, sorted(kwargs.items())), protocol=4
+    )
+    return hashlib.blake2b(payload, digest_size=20).digest()
+
+
+def code_version(module_name: str) -> str:
+    """Version of the code behind a target, so upgrades do not reuse old results.
+
+    Args:
+        module_name (str): imported module holding the target
+
+    Returns:
+        str: the installed distribution's version of the module's top-level
+            package, else a hash of the module's source, else "unknown"
+    """
+    package = module_name.split(".")[0]
+    try:
+        return importlib.metadata.version(package)
+    except importlib.metadata.PackageNotFoundError:
+        pass
+    path = getattr(sys.modules.get(module_name), "__file__", None)
+    if path:
+        try:
+            with open(path, "rb") as source:
+                return hashlib.blake2b(source.read(), digest_size=8).hexdigest()
+        except OSError:
+            pass
+    return "unknown"
+
+
+def memoize(target: str, function: Callable[..., Any]) -> Callable[..., Any]:
+    """Wrap a folding function so each distinct call is computed once.
+
+    Args:
+        target (str): stable name and version of the function, part of
+            every key
+        function (Callable[..., Any]): deterministic function to wrap
+
+    Returns:
+        Callable[..., Any]: the wrapper, with ``__wrapped__`` set
+    """
+
+    @functools.wraps(function)
+    def cached(*args: Any, **kwargs: Any) -> Any:
+        try:
+            key = call_key(target, args, kwargs)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            CACHE.stats.unhashable += 1
+            return function(*args, **kwargs)
+        blob = CACHE.lookup(key)
+        if blob is not None:
+            return pickle.loads(blob)
+        result = function(*args, **kwargs)
+        try:
+            CACHE.store(key, pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL))
+        except (pickle.PicklingError, TypeError, AttributeError):
+            pass  # still correct, just not reusable
+        return result
+
+    return cached
+
+
+def install(targets: Optional[List[str]] = None) -> List[str]:
+    """Wrap each folding function, wherever its package has imported it.
+
+    Modules that did ``from .fold import fold`` hold their own reference, so
+    every loaded module of the target's top-level package that refers to the
+    original function gets the wrapper too. Safe to call repeatedly.
+
+    Args:
+        targets (Optional[List[str]]): ``module:function`` names, by default
+            ``FOLD_TARGETS``
+
+    Returns:
+        List[str]: the targets that are wrapped; missing ones are skipped
+    """
+    for target in FOLD_TARGETS if targets is None else targets:
+        if target in _installed:
+            continue
+        module_name, _, name = target.partition(":")
+        try:
+            original = getattr(import_module(module_name), name)
+        except (ImportError, AttributeError):
+            continue
+        if not callable(original):
+            continue
+        wrapper = memoize(f"{target}@{code_version(module_name)}", original)
+        package = module_name.split(".")[0]
+        for loaded_name, module in list(sys.modules.items()):
+            if module is None or loaded_name.split(".")[0] != package:
+                continue
+            for attribute, value in list(vars(module).items()):
+                if value is original:
+                    setattr(module, attribute, wrapper)
+        _installed[target] = original
+    return list(_installed)
+
+
+def reset() -> None:
+    """Start counting hits and misses afresh, e.g. for a new search."""
+    CACHE.stats = CacheStats()
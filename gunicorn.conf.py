@@ -0,0 +1,45 @@
+"""
+Production serving settings: a few preloaded, threaded gunicorn workers per app.
+
+    BONHAM_APP=dbc-dose.py gunicorn -c gunicorn.conf.py wsgi:application
+
+The app is imported once in the master and forked, so the workers share
+NumPy, SciPy, Dash and the compiled kernels instead of each loading its own
+copy: a second worker costs about a quarter of the first. Each worker serves
+``BONHAM_WEB_THREADS`` requests at once. Idle keep-alive connections wait in
+the worker's event loop, not in a thread, and a request waiting on a Fealden
+worker process or an admission slot holds only its thread. Fealden searches
+run in ``fealden_workers``' processes, which each worker starts as it boots;
+the master never starts any. CPU-bound fits run in the threads of all workers;
+add workers, not threads, for more CPUs.
+"""
+
+import os
+import sys
+from typing import Any
+
+bind = os.environ.get("BONHAM_BIND", "127.0.0.1:8050")
+# Fits hold the GIL for much of their time, so one process per core does the
+# CPU work; more than two mostly adds Fealden worker processes (two per worker)
+workers = int(os.environ.get("BONHAM_WEB_WORKERS", str(min(2, os.cpu_count() or 1))))
+worker_class = "gthread"
+threads = int(os.environ.get("BONHAM_WEB_THREADS", "8"))
+preload_app = True
+keepalive = 5
+# The gthread main loop keeps heartbeating while requests run, so this only
+# catches a worker that has stopped responding, not a long Fealden search
+timeout = 60
+graceful_timeout = 30
+max_requests = int(os.environ.get("BONHAM_WEB_MAX_REQUESTS", "5000"))
+max_requests_jitter = max_requests // 10  # so workers do not recycle together
+
+
+def post_fork(server: Any, worker: Any) -> None:
+    """Start the Fealden app's workers in each web worker, not in the master.
+
+    Then Fealden is imported before the worker's first search, and the master
+    never holds workers that it would only have to stop.
+    """
+    fealden_workers = sys.modules.get("fealden_workers")
+    if fealden_workers is not None:
+        fealden_workers.POOL.start()
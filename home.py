@@ -2,11 +2,17 @@ import dash
 import dash_bootstrap_components as dbc
 from dash import Input, Output, State, html
 
+import http_cache
+import metrics
+import prerender
+
 MyApp = dash.Dash(__name__, external_stylesheets=[dbc.themes.FLATLY])
 
 MyApp.title = "Bonham Code"
 
 server = MyApp.server
+metrics.register(server)
+prerender.serve_prerendered(server)
 
 layout_title = html.H4("Bonham Code")
 
@@ -202,11 +208,15 @@ old_layout = dbc.Container(
     [Input("navbar-toggler", "n_clicks")],
     [State("navbar-collapse", "is_open")],
 )  # type: ignore[misc]
+@metrics.instrument("home")
 def toggle_navbar_collapse(n: int, is_open: bool) -> bool:
     if n:
         return not is_open
     return is_open
 
 
+http_cache.enable(MyApp)
+
+
 if __name__ == "__main__":
     MyApp.run_server(debug=True)
@@ -0,0 +1,146 @@
+"""
+Serialize-once, ETag-validated responses for the parts of an app that never change.
+
+The layouts and callback graphs of these apps are module-level constants, yet
+Dash re-serializes them on every page load. ``enable`` captures the
+``_dash-layout`` and ``_dash-dependencies`` responses once at startup, along
+with the component JS bundles and ``assets/`` files on first request, keeps
+gzip (and brotli, if installed) copies, and answers later requests from memory
+with ETags so browsers revalidate with a 304.
+"""
+
+import gzip
+import hashlib
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import flask
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+MAX_CACHED_BYTES = 8 * 1024 * 1024  # per response; larger bodies pass through
+MIN_COMPRESS_BYTES = 512
+
+
+@dataclass
+class Entry:
+    """A captured response body with its precompressed variants."""
+
+    mimetype: str
+    cache_control: str
+    encodings: Dict[str, bytes] = field(default_factory=dict)
+    etags: Dict[str, str] = field(default_factory=dict)
+
+
+def make_entry(body: bytes, mimetype: str, cache_control: str) -> Entry:
+    """Precompute the encoded bodies and their ETags.
+
+    Args:
+        body (bytes): uncompressed response body
+        mimetype (str): response mimetype
+        cache_control (str): Cache-Control header value to serve
+
+    Returns:
+        Entry: cache entry
+    """
+    entry = Entry(mimetype, cache_control)
+    entry.encodings["identity"] = body
+    if len(body) >= MIN_COMPRESS_BYTES:
+        candidates = {"gzip": gzip.compress(body, 9)}
+        if brotli is not None:
+            candidates["br"] = brotli.compress(body, quality=11)
+        for encoding, data in candidates.items():
+            if len(data) < len(body):  # skip already-compressed files like PNGs
+                entry.encodings[encoding] = data
+    digest = hashlib.sha1(body).hexdigest()[:20]
+    for encoding in entry.encodings:
+        suffix = "" if encoding == "identity" else f"-{encoding}"
+        entry.etags[encoding] = f'"{digest}{suffix}"'
+    return entry
+
+
+def respond(entry: Entry) -> flask.Response:
+    """Answer a request from a cache entry, honoring If-None-Match.
+
+    Args:
+        entry (Entry): cache entry
+
+    Returns:
+        flask.Response: 304, or 200 with the best encoding the client accepts
+    """
+    accepted = flask.request.accept_encodings
+    encoding = "identity"
+    for candidate in ("br", "gzip"):
+        if candidate in entry.encodings and accepted[candidate]:
+            encoding = candidate
+            break
+
+    etag = entry.etags[encoding]
+    if flask.request.if_none_match.contains_raw(etag):
+        response = flask.Response(status=304)
+    else:
+        response = flask.Response(entry.encodings[encoding], mimetype=entry.mimetype)
+        if encoding != "identity":
+            response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = entry.cache_control
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def enable(app: Any) -> None:
+    """Cache an app's static Dash responses; call after all callbacks exist.
+
+    Args:
+        app (dash.Dash): the app, with a constant layout
+    """
+    server: flask.Flask = app.server
+    prefix: str = app.config.routes_pathname_prefix
+    startup_paths = {prefix + "_dash-layout", prefix + "_dash-dependencies"}
+    lazy_prefixes = (
+        prefix + "_dash-component-suites/",
+        prefix + app.config.assets_url_path.strip("/") + "/",
+    )
+    cache: Dict[str, Entry] = {}
+
+    def cacheable(path: str) -> bool:
+        return path in startup_paths or path.startswith(lazy_prefixes)
+
+    def serve_cached() -> Optional[flask.Response]:
+        if flask.request.method != "GET":
+            return None
+        entry = cache.get(flask.request.path)
+        return respond(entry) if entry is not None else None
+
+    def capture(response: flask.Response) -> flask.Response:
+        path = flask.request.path
+        if (
+            flask.request.method != "GET"
+            or response.status_code != 200
+            or path in cache
+            or not cacheable(path)
+            or "Content-Encoding" in response.headers
+        ):
+            return response
+        response.direct_passthrough = False
+        body = response.get_data()
+        if len(body) > MAX_CACHED_BYTES:
+            return response
+        if path in startup_paths:
+            cache_control = "no-cache"  # always revalidate, answered with a 304
+        else:
+            cache_control = response.headers.get(
+                "Cache-Control", "public, max-age=3600"
+            )
+        cache[path] = make_entry(body, response.mimetype or "", cache_control)
+        return respond(cache[path])
+
+    server.before_request(serve_cached)
+    server.after_request(capture)
+
+    client = server.test_client()
+    for path in sorted(startup_paths):
+        client.get(path)
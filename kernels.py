@@ -0,0 +1,229 @@
+"""
+Model, Jacobian and goodness-of-fit kernels shared by the fitting apps.
+
+When Numba is installed each kernel is compiled to machine code on first use.
+The compiled code is cached on disk (``__pycache__`` beside this file, or
+``NUMBA_CACHE_DIR``), so after the first worker has compiled them the others
+just load them. Without Numba, or with ``BONHAM_JIT=0``, the same functions run
+as plain NumPy. Both paths give the same numbers. The compiled one fuses each
+expression into a single loop and releases the GIL, which makes it several
+times faster on the tens to hundreds of points of a typical fit, where NumPy's
+per-call overhead dominates. On large arrays NumPy's vectorized power and
+exponential win instead, so inputs longer than ``JIT_MAX_POINTS`` still go to
+NumPy; ``benchmarks/bench_kernels.py`` shows where the two cross.
+
+Jacobians return one column per parameter, in the order the model takes
+them, as ``curve_fit`` expects from ``jac``.
+"""
+
+import functools
+import os
+from typing import Any, Callable, Tuple, TypeVar, cast
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:  # numba is optional; the kernels run as NumPy without it
+    numba = None  # type: ignore[assignment]
+
+F = TypeVar("F", bound=Callable[..., Any])
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+
+JIT_ENABLED: bool = numba is not None and os.environ.get("BONHAM_JIT", "1") != "0"
+JIT_MAX_POINTS: int = int(os.environ.get("BONHAM_JIT_MAX_POINTS", "1024"))
+
+LN10 = float(np.log(10.0))
+
+
+def jit(func: F) -> F:
+    """Compile a kernel with Numba if available, else run it as NumPy.
+
+    The compiled kernel is used for inputs of up to ``JIT_MAX_POINTS``
+    points, the NumPy one for longer inputs. Compiled code does not warn on
+    overflow or invalid values, so the NumPy path silences those warnings too.
+
+    Args:
+        func (F): kernel written with NumPy array expressions, taking the
+            data array first
+
+    Returns:
+        F: kernel choosing its implementation by input size
+    """
+    compiled = numba.njit(cache=True, nogil=True)(func) if JIT_ENABLED else None
+
+    @functools.wraps(func)
+    def dispatch(data: NDArray, *args: Any) -> Any:
+        if compiled is not None and len(data) <= JIT_MAX_POINTS:
+            return compiled(data, *args)
+        with np.errstate(all="ignore"):
+            return func(data, *args)
+
+    return cast(F, dispatch)
+
+
+# Michaelis-Menten family; x is substrate concentration
+@jit
+def michaelis_menten(x: NDArray, vmax: float, km: float) -> NDArray:
+    return (vmax * x) / (km + x)
+
+
+@jit
+def michaelis_menten_jac(x: NDArray, vmax: float, km: float) -> NDArray:
+    denominator = km + x
+    jacobian = np.empty((x.shape[0], 2))
+    jacobian[:, 0] = x / denominator
+    jacobian[:, 1] = -vmax * x / denominator**2
+    return jacobian
+
+
+@jit
+def substrate_inhibition(x: NDArray, vmax: float, km: float, ki: float) -> NDArray:
+    return (vmax * x) / (km + x * (1 + x / ki))
+
+
+@jit
+def substrate_inhibition_jac(x: NDArray, vmax: float, km: float, ki: float) -> NDArray:
+    denominator = km + x * (1 + x / ki)
+    rate = vmax * x / denominator**2
+    jacobian = np.empty((x.shape[0], 3))
+    jacobian[:, 0] = x / denominator
+    jacobian[:, 1] = -rate
+    jacobian[:, 2] = rate * (x / ki) ** 2
+    return jacobian
+
+
+@jit
+def hill(x: NDArray, vmax: float, k_half: float, n: float) -> NDArray:
+    x_n = np.abs(x) ** n
+    rate: NDArray = (vmax * x_n) / (np.abs(k_half) ** n + x_n)
+    return rate
+
+
+@jit
+def hill_jac(x: NDArray, vmax: float, k_half: float, n: float) -> NDArray:
+    abs_x = np.abs(x)
+    x_n = abs_x**n
+    k_n = np.abs(k_half) ** n
+    bound = x_n / (k_n + x_n)
+    free = k_n / (k_n + x_n)
+    log_x = np.log(np.where(abs_x > 0, abs_x, 1.0))  # x_n is 0 there anyway
+    jacobian = np.empty((x.shape[0], 3))
+    jacobian[:, 0] = bound
+    jacobian[:, 1] = -vmax * bound * free * n / k_half
+    jacobian[:, 2] = vmax * bound * free * (log_x - np.log(np.abs(k_half)))
+    return jacobian
+
+
+# Logistic dose-response family; x is log10 concentration
+@jit
+def logistic_3pl(x: NDArray, bottom: float, top: float, log_ec50: float) -> NDArray:
+    return bottom + (top - bottom) / (1 + 10 ** (log_ec50 - x))
+
+
+@jit
+def logistic_3pl_jac(x: NDArray, bottom: float, top: float, log_ec50: float) -> NDArray:
+    upper = 1 / (1 + 10 ** (log_ec50 - x))
+    jacobian = np.empty((x.shape[0], 3))
+    jacobian[:, 0] = 1 - upper
+    jacobian[:, 1] = upper
+    jacobian[:, 2] = -(top - bottom) * LN10 * upper * (1 - upper)
+    return jacobian
+
+
+@jit
+def logistic_4pl(
+    x: NDArray, bottom: float, top: float, log_ec50: float, slope: float
+) -> NDArray:
+    return bottom + (top - bottom) / (1 + 10 ** ((log_ec50 - x) * slope))
+
+
+@jit
+def logistic_4pl_jac(
+    x: NDArray, bottom: float, top: float, log_ec50: float, slope: float
+) -> NDArray:
+    upper = 1 / (1 + 10 ** ((log_ec50 - x) * slope))
+    shift = -(top - bottom) * LN10 * upper * (1 - upper)
+    jacobian = np.empty((x.shape[0], 4))
+    jacobian[:, 0] = 1 - upper
+    jacobian[:, 1] = upper
+    jacobian[:, 2] = shift * slope
+    jacobian[:, 3] = shift * (log_ec50 - x)
+    return jacobian
+
+
+@jit
+def logistic_5pl(
+    x: NDArray,
+    bottom: float,
+    top: float,
+    log_ec50: float,
+    slope: float,
+    asymmetry: float,
+) -> NDArray:
+    return bottom + (top - bottom) / ((1 + 10 ** ((log_ec50 - x) * slope)) ** asymmetry)
+
+
+@jit
+def logistic_5pl_jac(
+    x: NDArray,
+    bottom: float,
+    top: float,
+    log_ec50: float,
+    slope: float,
+    asymmetry: float,
+) -> NDArray:
+    base = 1 + 10 ** ((log_ec50 - x) * slope)
+    upper = base**-asymmetry
+    shift = -(top - bottom) * LN10 * asymmetry * upper * (1 - 1 / base)
+    jacobian = np.empty((x.shape[0], 5))
+    jacobian[:, 0] = 1 - upper
+    jacobian[:, 1] = upper
+    jacobian[:, 2] = shift * slope
+    jacobian[:, 3] = shift * (log_ec50 - x)
+    jacobian[:, 4] = -(top - bottom) * upper * np.log(base)
+    return jacobian
+
+
+@jit
+def fit_statistics(
+    y: NDArray, fitted: NDArray, weights: NDArray
+) -> Tuple[float, float]:
+    """Weighted residual sum of squares and r squared of a fit.
+
+    Args:
+        y (NDArray): observed values
+        fitted (NDArray): model values
+        weights (NDArray): residual weights, 1 / sigma
+
+    Returns:
+        Tuple[float, float]: weighted residual sum of squares, r squared
+    """
+    residuals = y - fitted
+    rss = np.sum((residuals * weights) ** 2)
+    ss_res = np.sum(residuals**2)
+    ss_tot = np.sum((y - np.mean(y)) ** 2)
+    r_squared = 1 - ss_res / ss_tot if ss_tot > 0 else 0.0
+    return (rss, r_squared)
+
+
+def warm_up() -> None:
+    """Compile, or load from the disk cache, every kernel for float64 data.
+
+    Each kernel is compiled twice: with scalar parameters, for single fits,
+    and with one parameter value per point, for batches of curves fitted
+    together. Run at import so no request pays for compilation.
+    """
+    x = np.linspace(0.5, 2.0, 4)
+    for kernel, jacobian, scalars in (
+        (michaelis_menten, michaelis_menten_jac, (1.0, 1.0)),
+        (substrate_inhibition, substrate_inhibition_jac, (1.0, 1.0, 1.0)),
+        (hill, hill_jac, (1.0, 1.0, 1.0)),
+        (logistic_3pl, logistic_3pl_jac, (0.0, 1.0, 1.0)),
+        (logistic_4pl, logistic_4pl_jac, (0.0, 1.0, 1.0, 1.0)),
+        (logistic_5pl, logistic_5pl_jac, (0.0, 1.0, 1.0, 1.0, 1.0)),
+    ):
+        for parameters in (scalars, tuple(np.full_like(x, value) for value in scalars)):
+            fitted = kernel(x, *parameters)
+            jacobian(x, *parameters)
+    fit_statistics(x, fitted, np.ones_like(x))
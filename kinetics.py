@@ -0,0 +1,291 @@
+"""
+Reduce kinetic plate-reader runs to initial rates for Michaelis-Menten fitting.
+
+A kinetic run is a table with time in the first column and one signal column
+per well. ``initial_rates`` fits a straight line to every window of
+consecutive time points in every well at once, using running sums so the cost
+is one pass over the data, and takes each well's steepest well-fitting window
+as its initial velocity, the way plate-reader software reports a kinetic
+"Vmax". That skips lag phases at the start of a read as well as the
+flattening caused by substrate depletion. ``rates_by_concentration`` then
+groups wells with the same substrate concentration as replicates, giving the
+X-and-replicates matrix the Michaelis fit takes.
+
+Whole progress curves can be fitted instead with ``fit_progress_curves``. The
+integrated Michaelis-Menten equation has a closed form through the Lambert W
+function, S(t) = Km W((S0 / Km) exp((S0 - Vmax t) / Km)), evaluated here as
+the Wright omega function of the exponent so large arguments do not overflow.
+All curves share Vmax and Km and are evaluated, with analytic derivatives for
+the solver, as one array, so no ODE is ever integrated.
+"""
+
+import re
+from typing import Any, List, Optional, Tuple
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.special import wrightomega
+
+import metrics
+import uploads
+
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+
+DEFAULT_WINDOW = 10  # time points per regression window
+MIN_R_SQUARED = 0.9  # windows fitting worse are used only if none fit better
+NOT_A_WELL = re.compile(r"^(t\s*°|temp)", re.IGNORECASE)  # reader temperature
+
+
+def _running_sums(values: NDArray, window: int) -> NDArray:
+    """Sum ``values`` over every run of ``window`` consecutive rows."""
+    totals = np.cumsum(values, axis=0)
+    sums: NDArray = totals[window - 1 :].copy()
+    sums[1:] -= totals[:-window]
+    return sums
+
+
+def window_fits(
+    times: NDArray, signals: NDArray, window: int
+) -> Tuple[NDArray, NDArray]:
+    """Fit a line to every window of consecutive time points in every well.
+
+    Args:
+        times (NDArray): time points, shape (T,)
+        signals (NDArray): signal per time point and well, shape (T, W)
+        window (int): time points per window, at least 2
+
+    Returns:
+        Tuple[NDArray, NDArray]: slope and r squared per window start and
+            well, each of shape (T - window + 1, W)
+    """
+    # Centring keeps the running sums well conditioned
+    t = times - np.mean(times)
+    y = signals - signals[:1]
+    sum_t = _running_sums(t, window)[:, np.newaxis]
+    sum_tt = _running_sums(t * t, window)[:, np.newaxis]
+    sum_y = _running_sums(y, window)
+    sum_ty = _running_sums(t[:, np.newaxis] * y, window)
+    sum_yy = _running_sums(y * y, window)
+
+    covariance = window * sum_ty - sum_t * sum_y
+    t_variance = window * sum_tt - sum_t**2
+    y_variance = window * sum_yy - sum_y**2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        slopes: NDArray = covariance / t_variance
+        r_squared: NDArray = covariance**2 / (t_variance * y_variance)
+    r_squared[y_variance <= 0] = 0.0  # flat windows
+    return (slopes, r_squared)
+
+
+def initial_rates(
+    times: NDArray,
+    signals: NDArray,
+    window: int = DEFAULT_WINDOW,
+    min_r_squared: float = MIN_R_SQUARED,
+) -> Tuple[NDArray, NDArray]:
+    """Extract each well's initial velocity from its time course.
+
+    Args:
+        times (NDArray): time points, shape (T,)
+        signals (NDArray): signal per time point and well, shape (T, W)
+        window (int): time points per regression window
+        min_r_squared (float): windows fitting worse are used only for wells
+            where no window fits this well
+
+    Returns:
+        Tuple[NDArray, NDArray]: rate and its window's r squared per well,
+            NaN for wells with blank readings
+    """
+    window = max(2, min(window, len(times)))
+    slopes, r_squared = window_fits(times, signals, window)
+
+    steepness = np.abs(slopes)
+    good = r_squared >= min_r_squared
+    candidates = np.where(good | ~good.any(axis=0), steepness, -np.inf)
+    candidates[np.isnan(candidates)] = -np.inf
+    best = np.argmax(candidates, axis=0)
+
+    wells = np.arange(signals.shape[1])
+    rates: NDArray = slopes[best, wells]
+    fits: NDArray = r_squared[best, wells]
+    return (rates, fits)
+
+
+def rates_by_concentration(concentrations: NDArray, rates: NDArray) -> NDArray:
+    """Group wells by substrate concentration, replicates side by side.
+
+    Args:
+        concentrations (NDArray): substrate concentration per well
+        rates (NDArray): initial rate per well
+
+    Returns:
+        NDArray: one row per concentration, ascending: the concentration,
+            then its replicate rates, NaN padded
+    """
+    levels, group, counts = np.unique(
+        concentrations, return_inverse=True, return_counts=True
+    )
+    order = np.argsort(group, kind="stable")
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    replicate = np.arange(len(order)) - starts[group[order]]
+
+    matrix = np.full((len(levels), 1 + counts.max()), np.nan)
+    matrix[:, 0] = levels
+    matrix[group[order], 1 + replicate] = rates[order]
+    return matrix
+
+
+def read_kinetic_upload(
+    contents: str, filename: Optional[str], concentrations_text: Optional[str]
+) -> Tuple[NDArray, NDArray, NDArray]:
+    """Read an uploaded kinetic run and the pasted concentration of each well.
+
+    Args:
+        contents (str): data URL from ``dcc.Upload``, time in the first
+            column and [h:]mm:ss or numeric
+        filename (Optional[str]): uploaded file name
+        concentrations_text (Optional[str]): pasted substrate concentration of
+            each well, in the file's column order
+
+    Raises:
+        UploadError: with a user-facing message if the run cannot be used
+
+    Returns:
+        Tuple[NDArray, NDArray, NDArray]: times (T,), signals (T, W) and
+            concentrations (W,)
+    """
+    upload = uploads.parse_upload(contents, filename, min_points=2)
+    if upload.layout != "table":
+        raise uploads.UploadError(
+            "Kinetic runs need a time column followed by one column per well"
+        )
+    keep = [0] + [
+        j for j, name in enumerate(upload.names) if j and not NOT_A_WELL.match(name)
+    ]
+    if len(keep) < 2:
+        raise uploads.UploadError("No well columns were found")
+    times = upload.matrix[:, 0]
+    signals = upload.matrix[:, keep[1:]]
+
+    concentrations = uploads.parse_values(concentrations_text, "concentration")
+    if len(concentrations) != signals.shape[1]:
+        raise uploads.UploadError(
+            f"{signals.shape[1]} wells but {len(concentrations)} concentrations "
+            "were entered"
+        )
+    return (times, signals, concentrations)
+
+
+def parse_kinetic_upload(
+    contents: str,
+    filename: Optional[str],
+    concentrations_text: Optional[str],
+    window: Optional[int] = None,
+) -> Tuple[NDArray, List[str]]:
+    """Turn an uploaded kinetic run into initial rates by concentration.
+
+    Args:
+        contents (str): data URL from ``dcc.Upload``
+        filename (Optional[str]): uploaded file name
+        concentrations_text (Optional[str]): substrate concentration per well
+        window (Optional[int]): time points per regression window
+
+    Raises:
+        UploadError: with a user-facing message if the run cannot be used
+
+    Returns:
+        Tuple[NDArray, List[str]]: rates matrix as from
+            ``rates_by_concentration`` and its column names
+    """
+    times, signals, concentrations = read_kinetic_upload(
+        contents, filename, concentrations_text
+    )
+    rates, _ = initial_rates(times, signals, window or DEFAULT_WINDOW)
+    # Assays read substrate or product, so signals may fall or rise
+    matrix = rates_by_concentration(concentrations, np.abs(rates))
+    names = ["Substrate"] + [f"Rate {j}" for j in range(1, matrix.shape[1])]
+    return (matrix, names)
+
+
+def progress_curves(
+    times: NDArray, s0: NDArray, vmax: float, km: float
+) -> Tuple[NDArray, NDArray, NDArray]:
+    """Product formed over time by the integrated Michaelis-Menten equation.
+
+    Args:
+        times (NDArray): time points, shape (T,)
+        s0 (NDArray): initial substrate concentration per curve, shape (C,)
+        vmax (float): maximum rate, in concentration per time unit
+        km (float): Michaelis constant
+
+    Returns:
+        Tuple[NDArray, NDArray, NDArray]: product concentration, and its
+            derivatives with respect to Vmax and Km, each of shape (T, C)
+    """
+    remaining = (s0 - vmax * times[:, np.newaxis]) / km
+    omega: NDArray = wrightomega(np.log(s0 / km) + remaining)
+    product: NDArray = s0 - km * omega
+    slope = omega / (1 + omega)  # d omega / dz
+    d_vmax: NDArray = times[:, np.newaxis] * slope
+    d_km: NDArray = -slope * (omega - remaining)
+    return (product, d_vmax, d_km)
+
+
+def fit_progress_curves(
+    times: NDArray, signals: NDArray, s0: NDArray
+) -> Tuple[NDArray, NDArray, float]:
+    """Fit shared Vmax and Km to many progress curves at once.
+
+    Each curve's first reading is taken as its baseline, and the signal per
+    unit of product (e.g. extinction coefficient times path length) is fitted
+    along with Vmax and Km.
+
+    Args:
+        times (NDArray): time points, shape (T,)
+        signals (NDArray): readings per time point and curve, shape (T, C),
+            NaN for missing readings
+        s0 (NDArray): initial substrate concentration per curve, shape (C,)
+
+    Returns:
+        Tuple[NDArray, NDArray, float]: Vmax, Km and signal scale, their
+            standard errors, and r squared
+    """
+    t = times - times[0]
+    observed = signals - signals[:1]
+    valid = ~np.isnan(observed)
+    target = observed[valid]
+
+    # Initial guesses: plateau height for the scale, steepest slopes for Vmax
+    spans = np.nanmax(np.abs(observed), axis=0)
+    direction = 1.0 if np.nanmean(observed) >= 0 else -1.0  # product or substrate
+    scale = direction * float(np.nanmedian(spans / s0)) or 1.0
+    rates, _ = initial_rates(t, observed)
+    vmax = float(np.nanmax(np.abs(rates))) / abs(scale) or 1.0
+    guesses = [vmax, float(np.median(s0)), scale]
+
+    def residuals(variables: NDArray) -> NDArray:
+        product, _, _ = progress_curves(t, s0, variables[0], variables[1])
+        error: NDArray = variables[2] * product[valid] - target
+        return error
+
+    def jacobian(variables: NDArray) -> NDArray:
+        product, d_vmax, d_km = progress_curves(t, s0, variables[0], variables[1])
+        columns = [variables[2] * d_vmax, variables[2] * d_km, product]
+        return np.column_stack([column[valid] for column in columns])
+
+    result = least_squares(
+        residuals,
+        guesses,
+        jac=jacobian,
+        bounds=([1e-12, 1e-12, -np.inf], np.inf),
+        x_scale="jac",
+    )
+    metrics.record_fit("michaelis", "progress_curve", result.nfev, result.success)
+
+    dof = max(1, len(target) - len(guesses))
+    ss_res = float(np.sum(result.fun**2))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cov = np.linalg.pinv(result.jac.T @ result.jac) * ss_res / dof
+    var_errors: NDArray = np.sqrt(np.diag(cov))
+    ss_tot = float(np.sum((target - np.mean(target)) ** 2))
+    return (result.x, var_errors, 1 - ss_res / ss_tot)
@@ -0,0 +1,766 @@
+#!/usr/bin/env python3
+
+"""
+Local load-test harness that simulates classroom traffic against the Dash apps.
+
+Each simulated student replays realistic callback payloads (table edits, axis
+label typing, submits) against the real ``/_dash-update-component`` endpoint of
+a locally started app, and per-callback throughput and latency percentiles are
+reported at the end of the run, with how many calls admission control turned
+away. Each student claims its own client address, so per-client limits apply
+to it alone.
+
+Usage:
+    python loadtest.py run dashmichaelis.py dbc-dose.py --students 60
+    python loadtest.py run dbc-dose.py --server gunicorn --students 60
+    python loadtest.py run --url http://127.0.0.1:8050 --app dashmichaelis.py
+    python loadtest.py serve dashmichaelis.py --port 8050
+"""
+
+import argparse
+import http.client
+import importlib.util
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+from dataclasses import dataclass, field
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+HERE = Path(__file__).resolve().parent
+UPDATE_PATH = "/_dash-update-component"
+SERVERS = ("dev", "gunicorn")
+
+Payload = Dict[str, Any]
+
+
+@dataclass
+class Sample:
+    """One timed callback request."""
+
+    callback: str
+    latency: float
+    ok: bool
+    busy: bool = False  # turned away by admission control
+
+
+@dataclass
+class Report:
+    """Collected samples for one app run."""
+
+    app: str
+    duration: float = 0.0
+    samples: List[Sample] = field(default_factory=list)
+    memory: float = float("nan")  # server PSS in bytes, if started locally
+
+
+# Payload construction
+def _prop(component: str, prop: str, value: Any = None) -> Dict[str, Any]:
+    return {"id": component, "property": prop, "value": value}
+
+
+def _payload(
+    outputs: List[Tuple[str, str]],
+    inputs: List[Dict[str, Any]],
+    state: Optional[List[Dict[str, Any]]] = None,
+    changed: Optional[List[str]] = None,
+) -> Payload:
+    """Build a request body the way the Dash renderer does.
+
+    Args:
+        outputs (List[Tuple[str, str]]): (component id, property) outputs
+        inputs (List[Dict[str, Any]]): input props with values
+        state (Optional[List[Dict[str, Any]]]): state props with values
+        changed (Optional[List[str]]): changed prop ids, defaults to first input
+
+    Returns:
+        Payload: JSON-serializable request body
+    """
+    out_specs = [{"id": i, "property": p} for i, p in outputs]
+    if len(outputs) == 1:
+        output: str = f"{outputs[0][0]}.{outputs[0][1]}"
+        outputs_field: Any = out_specs[0]
+    else:
+        output = ".." + "...".join(f"{i}.{p}" for i, p in outputs) + ".."
+        outputs_field = out_specs
+    first = inputs[0]
+    return {
+        "output": output,
+        "outputs": outputs_field,
+        "inputs": inputs,
+        "state": state or [],
+        "changedPropIds": changed or [f"{first['id']}.{first['property']}"],
+    }
+
+
+MICHAELIS_COLUMNS: List[str] = ["X", "Y1", "Y2"]
+# Most students keep least squares; some switch to a robust loss
+FIT_LOSSES = ("linear", "linear", "linear", "huber")
+
+
+def _michaelis_rows(rng: random.Random, n_rows: int) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(n_rows):
+        x = float(i)
+        v = 12.0 * x / (1.5 + x)
+        rows.append(
+            {
+                "X": x,
+                "Y1": round(v + rng.gauss(0, 0.4), 2),
+                "Y2": round(v + rng.gauss(0, 0.4), 2),
+            }
+        )
+    return rows
+
+
+def michaelis_traffic(rng: random.Random) -> List[Tuple[str, Payload]]:
+    """One student's session on the Michaelis-Menten app.
+
+    Adding rows and columns happens in the browser, and the server keeps the
+    table per session, so requests carry the whole table once and then only
+    the edited cells, as the browser would send them.
+
+    Args:
+        rng (random.Random): per-student random source
+
+    Returns:
+        List[Tuple[str, Payload]]: ordered (callback name, payload) pairs
+    """
+    rows = _michaelis_rows(rng, rng.randint(6, 12))
+    traffic: List[Tuple[str, Payload]] = []
+    session = f"loadtest-{rng.getrandbits(64):x}"
+    x_label, y_label = "Concentration", "Enzyme Activity"
+    loss = rng.choice(FIT_LOSSES)
+    diff: Dict[str, Any] = {}
+
+    def as_lists() -> List[List[Any]]:
+        return [[row[key] for key in MICHAELIS_COLUMNS] for row in rows]
+
+    def graph(changed: str) -> Payload:
+        return _payload(
+            [
+                ("adding-rows-graph", "figure"),
+                ("table-resync", "data"),
+                ("model-comparison", "data"),
+            ],
+            [
+                _prop("table-diff", "data", diff),
+                _prop("x-axis", "value", x_label),
+                _prop("y-axis", "value", y_label),
+                _prop("fit-loss", "value", loss),
+            ],
+            [_prop("session-id", "data", session)],
+            changed=[changed],
+        )
+
+    def full_table() -> None:
+        nonlocal diff
+        version = diff.get("version", 0) + 1
+        diff = {
+            "full": True,
+            "version": version,
+            "columns": MICHAELIS_COLUMNS,
+            "rows": as_lists(),
+        }
+        traffic.append(("update_graph", graph("table-diff.data")))
+
+    def edit(row: int, key: str, value: Any) -> None:
+        nonlocal diff
+        rows[row][key] = value
+        version = diff["version"] + 1
+        cells = [[row, MICHAELIS_COLUMNS.index(key), value]]
+        diff = {"full": False, "base": diff["version"], "version": version}
+        diff["cells"] = cells
+        traffic.append(("update_graph", graph("table-diff.data")))
+
+    full_table()
+
+    # Typing a new axis label, one keystroke per request
+    for i in range(1, len("Substrate (mM)") + 1):
+        x_label = "Substrate (mM)"[:i]
+        traffic.append(("update_graph", graph("x-axis.value")))
+
+    # Filling in a newly added row: the first value adds a row, then an edit
+    x = float(len(rows))
+    rows.append({"X": x, "Y1": round(12.0 * x / (1.5 + x), 2), "Y2": ""})
+    full_table()
+    edit(len(rows) - 1, "Y2", round(12.0 * x / (1.5 + x) + rng.gauss(0, 0.4), 2))
+
+    # Correcting a handful of existing cells
+    for _ in range(rng.randint(3, 8)):
+        cell = rng.randrange(1, len(rows))
+        edit(cell, "Y1", round(float(rows[cell]["Y1"]) * rng.uniform(0.9, 1.1), 2))
+
+    return traffic
+
+
+def dose_traffic(rng: random.Random) -> List[Tuple[str, Payload]]:
+    """One student's session on the dose-response app.
+
+    Args:
+        rng (random.Random): per-student random source
+
+    Returns:
+        List[Tuple[str, Payload]]: ordered (callback name, payload) pairs
+    """
+    traffic: List[Tuple[str, Payload]] = []
+    session = f"loadtest-{rng.getrandbits(64):x}"
+    loss = rng.choice(FIT_LOSSES)
+    for click in range(1, rng.randint(4, 10)):
+        n = rng.randint(5, 20)
+        xs = [round(i * 0.5, 2) for i in range(n)]
+        mid = rng.uniform(1.0, n * 0.4)
+        ys = [round(1 + 9 / (1 + 10 ** (mid - x)) + rng.gauss(0, 0.2), 3) for x in xs]
+        traffic.append(
+            (
+                "update_graph2",
+                _payload(
+                    [
+                        ("indicator-graphic", "figure"),
+                        ("upload-status", "children"),
+                        ("upload-status", "color"),
+                        ("upload-status", "is_open"),
+                        ("model-comparison", "data"),
+                    ],
+                    [
+                        _prop("submit-button", "n_clicks", click),
+                        _prop("upload-data", "contents"),
+                        _prop("fit-loss", "value", loss),
+                    ],
+                    [
+                        _prop("input-1-state", "value", ",".join(map(str, xs))),
+                        _prop("input-2-state", "value", ",".join(map(str, ys))),
+                        _prop("upload-data", "filename"),
+                        _prop("session-id", "data", session),
+                    ],
+                ),
+            )
+        )
+    return traffic
+
+
+def buffer_traffic(rng: random.Random) -> List[Tuple[str, Payload]]:
+    """One student's session on the buffer calculator.
+
+    Args:
+        rng (random.Random): per-student random source
+
+    Returns:
+        List[Tuple[str, Payload]]: ordered (callback name, payload) pairs
+    """
+    traffic: List[Tuple[str, Payload]] = []
+    for click in range(1, rng.randint(3, 6)):
+        values = {
+            "buff_init_conc": "1.0",
+            "buff_final_conc": str(round(rng.uniform(0.05, 0.5), 2)),
+            "buff_pka": str(round(rng.uniform(6.5, 9.5), 1)),
+            "final_volume": "1.5",
+            "hcl_conc": "12.0",
+            "naoh_conc": "10.0",
+            "init_ph": str(round(rng.uniform(6.0, 9.0), 1)),
+            "final_ph": str(round(rng.uniform(6.0, 9.0), 1)),
+        }
+        traffic.append(
+            (
+                "Buffer_Solver",
+                _payload(
+                    [
+                        ("output-div", "children"),
+                        ("recipe", "is_open"),
+                        ("recipe", "color"),
+                    ],
+                    [_prop("submit-button", "n_clicks", click)],
+                    [_prop(k, "value", v) for k, v in values.items()],
+                ),
+            )
+        )
+    return traffic
+
+
+def fealden_traffic(rng: random.Random) -> List[Tuple[str, Payload]]:
+    """One student's session on the Fealden app.
+
+    Args:
+        rng (random.Random): per-student random source
+
+    Returns:
+        List[Tuple[str, Payload]]: ordered (callback name, payload) pairs
+    """
+    sequence = "".join(rng.choice("ACGT") for _ in range(rng.randint(6, 12)))
+    return [
+        (
+            "run_Fealden",
+            _payload(
+                [
+                    ("output-div", "children"),
+                    ("recipe", "is_open"),
+                    ("recipe", "color"),
+                    ("history-version", "data"),
+                ],
+                [_prop("submit-button", "n_clicks", 1)],
+                [
+                    _prop("sequence", "value", sequence),
+                    _prop("max_length", "value", 50),
+                    _prop("fixed", "value", None),
+                ],
+            ),
+        ),
+        (
+            "show_history",
+            _payload(
+                [
+                    ("history-table", "data"),
+                    ("history-table", "page_count"),
+                    ("history-table", "page_current"),
+                ],
+                [
+                    _prop("history-query", "value", sequence[:4]),
+                    _prop("history-match", "value", "prefix"),
+                    _prop("history-table", "page_current", 0),
+                    _prop("history-version", "data", None),
+                ],
+            ),
+        ),
+    ]
+
+
+SCENARIOS: Dict[str, Callable[[random.Random], List[Tuple[str, Payload]]]] = {
+    "dashmichaelis.py": michaelis_traffic,
+    "dbc-dose.py": dose_traffic,
+    "dbc-buffer.py": buffer_traffic,
+    "dash-fealden.py": fealden_traffic,
+}
+
+
+def load_recorded(path: Path) -> Callable[[random.Random], List[Tuple[str, Payload]]]:
+    """Build a scenario from payloads captured in the browser.
+
+    The file is a JSON list of ``{"callback": name, "body": payload}`` entries,
+    e.g. copied from the network tab of the browser developer tools.
+
+    Args:
+        path (Path): recorded payload file
+
+    Returns:
+        Callable[[random.Random], List[Tuple[str, Payload]]]: scenario function
+    """
+    entries = json.loads(path.read_text())
+    traffic = [(entry["callback"], entry["body"]) for entry in entries]
+    return lambda rng: list(traffic)
+
+
+# Serving
+def load_app_module(app_path: Path) -> ModuleType:
+    """Import an app file by path (the app files are not valid module names).
+
+    Args:
+        app_path (Path): path to app file
+
+    Returns:
+        ModuleType: imported module
+    """
+    spec = importlib.util.spec_from_file_location(
+        app_path.stem.replace("-", "_"), app_path
+    )
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load {app_path}")
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, str(app_path.resolve().parent))
+    spec.loader.exec_module(module)
+    return module
+
+
+def serve(app_path: Path, port: int) -> None:
+    """Run an app's Flask server in the foreground (threaded, no debug).
+
+    Args:
+        app_path (Path): path to app file
+        port (int): port to listen on
+    """
+    module = load_app_module(app_path)
+    module.server.run(host="127.0.0.1", port=port, threaded=True)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def start_server(
+    app_path: Path, timeout: float = 60.0, server: str = "dev"
+) -> Tuple["subprocess.Popen[bytes]", str]:
+    """Start an app in a subprocess and wait until it answers requests.
+
+    Args:
+        app_path (Path): path to app file
+        timeout (float): seconds to wait for the server to come up
+        server (str): "dev" for Flask's threaded server, or "gunicorn" for
+            the production settings in ``gunicorn.conf.py``
+
+    Returns:
+        Tuple[subprocess.Popen[bytes], str]: server process and base url
+    """
+    port = _free_port()
+    if server == "gunicorn":
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            "--config",
+            str(HERE / "gunicorn.conf.py"),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--pythonpath",
+            str(HERE),
+            "wsgi:application",
+        ]
+    else:
+        command = [
+            sys.executable,
+            __file__,
+            "serve",
+            str(app_path),
+            "--port",
+            str(port),
+        ]
+    proc = subprocess.Popen(
+        command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        # Each student sends its own X-Forwarded-For, to be rate limited alone
+        env={
+            **os.environ,
+            "BONHAM_ADMISSION_FORWARDED": "1",
+            "BONHAM_APP": str(app_path.resolve()),
+        },
+    )
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"{app_path} exited with code {proc.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+            conn.request("GET", "/_dash-layout")
+            conn.getresponse().read()
+            conn.close()
+            return proc, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{app_path} did not start within {timeout} s")
+
+
+def server_memory(pid: int) -> float:
+    """Proportional set size of a process and its descendants, in bytes.
+
+    Pages shared between processes, like a preloading server's, are split
+    among them, so the sum is what the server really costs. Needs Linux.
+
+    Args:
+        pid (int): server process id
+
+    Returns:
+        float: total PSS in bytes, nan if it cannot be read
+    """
+    total, pending = 0, [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            for task in Path(f"/proc/{current}/task").iterdir():
+                pending.extend(int(c) for c in (task / "children").read_text().split())
+            for line in Path(f"/proc/{current}/smaps_rollup").read_text().splitlines():
+                if line.startswith("Pss:"):
+                    total += int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        return float("nan")
+    return float(total)
+
+
+# Load generation
+def student(
+    base_url: str,
+    traffic: List[Tuple[str, Payload]],
+    think_time: float,
+    rng: random.Random,
+    deadline: float,
+    samples: List[Sample],
+    lock: threading.Lock,
+    address: str = "",
+) -> None:
+    """Replay one student's traffic over a keep-alive connection until deadline.
+
+    Args:
+        base_url (str): server base url
+        traffic (List[Tuple[str, Payload]]): callback requests to replay in order
+        think_time (float): mean pause between requests in seconds
+        rng (random.Random): per-student random source
+        deadline (float): monotonic time to stop at
+        samples (List[Sample]): shared sample sink
+        lock (threading.Lock): guards the sample sink
+        address (str): client address to claim in X-Forwarded-For, if any
+    """
+    url = urllib.parse.urlsplit(base_url)
+    prefix = url.path.rstrip("/")
+    headers = {"Content-Type": "application/json"}
+    if address:
+        headers["X-Forwarded-For"] = address
+    bodies = [(name, json.dumps(body).encode()) for name, body in traffic]
+    conn = http.client.HTTPConnection(
+        url.hostname or "127.0.0.1", url.port, timeout=120
+    )
+    local: List[Sample] = []
+
+    while time.monotonic() < deadline:
+        for name, body in bodies:
+            if time.monotonic() >= deadline:
+                break
+            start = time.perf_counter()
+            for _ in range(2):
+                try:
+                    conn.request("POST", prefix + UPDATE_PATH, body, headers)
+                    response = conn.getresponse()
+                    response.read()
+                    ok = response.status in (200, 204)
+                    busy = response.getheader("X-Bonham-Admission") == "rejected"
+                    break
+                except (OSError, http.client.HTTPException) as err:
+                    conn.close()
+                    conn = http.client.HTTPConnection(
+                        url.hostname or "127.0.0.1", url.port, timeout=120
+                    )
+                    ok = busy = False
+                    # The server closed an idle keep-alive connection before
+                    # this request reached it; browsers resend these too
+                    stale = isinstance(
+                        err,
+                        (
+                            http.client.RemoteDisconnected,
+                            BrokenPipeError,
+                            ConnectionResetError,
+                        ),
+                    )
+                    if not stale:
+                        break
+            local.append(Sample(name, time.perf_counter() - start, ok, busy))
+            if think_time > 0:
+                time.sleep(rng.expovariate(1 / think_time))
+    conn.close()
+
+    with lock:
+        samples.extend(local)
+
+
+def run_load(
+    app_name: str,
+    base_url: str,
+    scenario: Callable[[random.Random], List[Tuple[str, Payload]]],
+    students: int,
+    duration: float,
+    think_time: float,
+    seed: int,
+) -> Report:
+    """Drive one app with concurrent simulated students.
+
+    Args:
+        app_name (str): app label for the report
+        base_url (str): server base url
+        scenario (Callable[[random.Random], List[Tuple[str, Payload]]]): traffic
+        students (int): number of concurrent simulated students
+        duration (float): seconds to run for
+        think_time (float): mean pause between requests in seconds
+        seed (int): random seed, for reproducible traffic
+
+    Returns:
+        Report: collected samples
+    """
+    report = Report(app_name)
+    lock = threading.Lock()
+    start = time.monotonic()
+    deadline = start + duration
+    threads = []
+    for i in range(students):
+        rng = random.Random(seed * 1000 + i)
+        thread = threading.Thread(
+            target=student,
+            args=(
+                base_url,
+                scenario(rng),
+                think_time,
+                rng,
+                deadline,
+                report.samples,
+                lock,
+                f"10.{i // 65536 % 256}.{i // 256 % 256}.{i % 256}",
+            ),
+            daemon=True,
+        )
+        threads.append(thread)
+        thread.start()
+    for thread in threads:
+        thread.join()
+    report.duration = time.monotonic() - start
+    return report
+
+
+# Reporting
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of already sorted values.
+
+    Args:
+        sorted_values (List[float]): ascending values
+        pct (float): percentile in [0, 100]
+
+    Returns:
+        float: percentile value, or nan when there are no values
+    """
+    if not sorted_values:
+        return float("nan")
+    rank = max(
+        0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1)
+    )
+    return sorted_values[rank]
+
+
+def summarize(report: Report) -> List[Dict[str, Any]]:
+    """Per-callback throughput and latency summary.
+
+    Args:
+        report (Report): collected samples
+
+    Returns:
+        List[Dict[str, Any]]: one row per callback plus an overall row, which
+            also has the server's memory and served requests a second per GiB
+    """
+    groups: Dict[str, List[Sample]] = {}
+    for sample in report.samples:
+        groups.setdefault(sample.callback, []).append(sample)
+    groups["(all)"] = report.samples
+
+    rows: List[Dict[str, Any]] = []
+    for name, samples in groups.items():
+        latencies = sorted(s.latency for s in samples)
+        rows.append(
+            {
+                "app": report.app,
+                "callback": name,
+                "requests": len(samples),
+                "errors": sum(not s.ok for s in samples),
+                "busy": sum(s.busy for s in samples),
+                "rps": len(samples) / report.duration if report.duration else 0.0,
+                "p50_ms": percentile(latencies, 50) * 1000,
+                "p95_ms": percentile(latencies, 95) * 1000,
+                "p99_ms": percentile(latencies, 99) * 1000,
+            }
+        )
+    # Memory efficiency counts only the calls actually served
+    served = sum(s.ok and not s.busy for s in report.samples)
+    served_rps = served / report.duration if report.duration else 0.0
+    rows[-1]["memory_mib"] = report.memory / 2**20
+    rows[-1]["rps_per_gib"] = served_rps / (report.memory / 2**30)
+    return rows
+
+
+def print_table(rows: List[Dict[str, Any]]) -> None:
+    """Print summary rows as an aligned text table.
+
+    Args:
+        rows (List[Dict[str, Any]]): summary rows
+    """
+    header = f"{'app':<18}{'callback':<18}{'reqs':>7}{'errs':>6}{'busy':>6}"
+    header += f"{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(
+            f"{row['app']:<18}{row['callback']:<18}{row['requests']:>7}"
+            f"{row['errors']:>6}{row['busy']:>6}{row['rps']:>9.1f}"
+            f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}"
+        )
+    for row in rows:
+        if not math.isnan(row.get("memory_mib", math.nan)):
+            print(
+                f"{row['app']}: server used {row['memory_mib']:.0f} MiB (PSS), "
+                f"{row['rps_per_gib']:.1f} served req/s per GiB"
+            )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="drive one or more apps with load")
+    run.add_argument("apps", nargs="*", default=["dashmichaelis.py", "dbc-dose.py"])
+    run.add_argument("--url", help="target an already running server instead")
+    run.add_argument("--app", help="scenario to use with --url")
+    run.add_argument("--payloads", type=Path, help="recorded payload JSON to replay")
+    run.add_argument(
+        "--server", choices=SERVERS, default="dev", help="how to serve local apps"
+    )
+    run.add_argument("--students", type=int, default=60)
+    run.add_argument("--duration", type=float, default=30.0, help="seconds per app")
+    run.add_argument("--think-time", type=float, default=1.0, help="mean pause (s)")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--json", type=Path, help="also write results as JSON")
+
+    serve_cmd = commands.add_parser("serve", help="serve one app (used internally)")
+    serve_cmd.add_argument("app", type=Path)
+    serve_cmd.add_argument("--port", type=int, default=8050)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.app, args.port)
+        return 0
+
+    targets: List[Tuple[str, Optional[str]]]
+    if args.url:
+        targets = [(args.app or "dashmichaelis.py", args.url)]
+    else:
+        targets = [(app, None) for app in args.apps]
+
+    results: List[Dict[str, Any]] = []
+    for app_name, url in targets:
+        if args.payloads:
+            scenario = load_recorded(args.payloads)
+        else:
+            scenario = SCENARIOS[Path(app_name).name]
+        proc = None
+        if url is None:
+            proc, url = start_server(Path(app_name), server=args.server)
+        try:
+            report = run_load(
+                Path(app_name).name,
+                url,
+                scenario,
+                args.students,
+                args.duration,
+                args.think_time,
+                args.seed,
+            )
+            if proc is not None:
+                report.memory = server_memory(proc.pid)
+        finally:
+            if proc is not None:
+                proc.terminate()
+                proc.wait()
+        results.extend(summarize(report))
+
+    print_table(results)
+    if args.json:
+        args.json.write_text(json.dumps(results, indent=2))
+    return 0
+
+
+# Main magic
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""
+Low-overhead callback and fit instrumentation, exposed as Prometheus text.
+
+Every app wraps its callbacks with ``instrument`` and calls ``register`` on its
+Flask ``server`` to get a ``/metrics`` route. Recording is a dict lookup, a
+bisect and a few additions under a lock, so it is cheap enough to leave on.
+Values are kept per process and nothing aggregates them across workers: with
+several Passenger or gunicorn workers a scrape of ``/metrics`` reaches one
+arbitrary worker, so counters jump between that worker's values and the
+next's. Multi-worker deployments need a scrape target per worker (e.g. one
+port each) or a multiprocess collector in front of these values.
+"""
+
+import functools
+import threading
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar, cast
+
+import flask
+from dash.exceptions import PreventUpdate
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+Labels = Tuple[Tuple[str, str], ...]
+
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+SIZE_BUCKETS: Tuple[float, ...] = tuple(float(4**i * 256) for i in range(9))
+ITERATION_BUCKETS: Tuple[float, ...] = (5, 10, 20, 50, 100, 200, 500, 1000, 5000)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus sense."""
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets: Tuple[float, ...] = tuple(buckets)
+        self.counts: List[int] = [0] * (len(self.buckets) + 1)
+        self.total: float = 0.0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class Registry:
+    """Thread-safe store of counters, gauges and histograms keyed by name and
+    labels."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._buckets: Dict[str, Sequence[float]] = {}
+        self._help: Dict[str, str] = {}
+
+    def describe(self, name: str, text: str, buckets: Sequence[float] = ()) -> None:
+        """Declare a metric's help text (and buckets, for histograms).
+
+        Args:
+            name (str): metric name
+            text (str): help text
+            buckets (Sequence[float]): histogram upper bounds, empty for counters
+        """
+        self._help[name] = text
+        if buckets:
+            self._buckets[name] = buckets
+
+    def inc(self, name: str, labels: Labels, amount: float = 1.0) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0.0) + amount
+
+    def set(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            self._gauges.setdefault(name, {})[labels] = value
+
+    def observe(self, name: str, labels: Labels, value: float) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram(self._buckets[name])
+            histogram.observe(value)
+
+    def render(self) -> str:
+        """Render all series in the Prometheus text exposition format.
+
+        Returns:
+            str: exposition text
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name, counters in sorted(self._counters.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(counters.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, gauges in sorted(self._gauges.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in sorted(gauges.items()):
+                    lines.append(f"{name}{_format_labels(labels)} {value:g}")
+            for name, histograms in sorted(self._histograms.items()):
+                lines.append(f"# HELP {name} {self._help.get(name, name)}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(histograms.items()):
+                    cumulative = 0
+                    for bound, count in zip(hist.buckets, hist.counts):
+                        cumulative += count
+                        bucket_labels = labels + (("le", f"{bound:g}"),)
+                        lines.append(
+                            f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                        )
+                    inf_labels = labels + (("le", "+Inf"),)
+                    lines.append(
+                        f"{name}_bucket{_format_labels(inf_labels)} {hist.count}"
+                    )
+                    lines.append(f"{name}_sum{_format_labels(labels)} {hist.total:g}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(
+        '{}="{}"'.format(k, v.replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in labels
+    )
+    return "{" + inner + "}"
+
+
+REGISTRY = Registry()
+REGISTRY.describe("bonham_callback_calls_total", "Callback invocations")
+REGISTRY.describe("bonham_callback_errors_total", "Callbacks that raised")
+REGISTRY.describe(
+    "bonham_callback_latency_seconds", "Callback wall time", LATENCY_BUCKETS
+)
+REGISTRY.describe(
+    "bonham_callback_request_bytes", "Callback request body size", SIZE_BUCKETS
+)
+REGISTRY.describe(
+    "bonham_callback_response_bytes", "Callback response body size", SIZE_BUCKETS
+)
+REGISTRY.describe("bonham_fits_total", "Curve fits attempted")
+REGISTRY.describe("bonham_fit_failures_total", "Curve fits that did not converge")
+REGISTRY.describe(
+    "bonham_fit_iterations", "Function evaluations per fit", ITERATION_BUCKETS
+)
+REGISTRY.describe("bonham_batch_datasets_total", "Batch API datasets processed")
+REGISTRY.describe("bonham_batch_errors_total", "Batch API datasets rejected")
+REGISTRY.describe("bonham_exports_total", "Figure images requested")
+REGISTRY.describe("bonham_export_cache_hits_total", "Figure images served from cache")
+REGISTRY.describe("bonham_worker_runs_total", "Worker pool runs, by outcome")
+REGISTRY.describe("bonham_worker_restarts_total", "Worker processes replaced early")
+REGISTRY.describe("bonham_fold_cache_hits_total", "Folding evaluations reused")
+REGISTRY.describe("bonham_fold_cache_misses_total", "Folding evaluations computed")
+REGISTRY.describe("bonham_admission_total", "Callback calls admitted or turned away")
+REGISTRY.describe(
+    "bonham_admission_wait_seconds", "Time admitted calls waited", LATENCY_BUCKETS
+)
+REGISTRY.describe("bonham_admission_limit", "Configured admission limits")
+REGISTRY.describe("bonham_admission_running", "Admitted calls running")
+REGISTRY.describe("bonham_admission_waiting", "Calls waiting for a slot")
+
+
+def instrument(app_name: str, callback_name: Optional[str] = None) -> Callable[[F], F]:
+    """Decorate a Dash callback to record calls, errors and latency.
+
+    Place it directly under ``@app.callback(...)`` so Dash registers the
+    instrumented function.
+
+    Args:
+        app_name (str): app label, e.g. "michaelis"
+        callback_name (Optional[str]): callback label, defaults to function name
+
+    Returns:
+        Callable[[F], F]: decorator
+    """
+
+    def decorator(func: F) -> F:
+        labels: Labels = (
+            ("app", app_name),
+            ("callback", callback_name or func.__name__),
+        )
+
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if flask.has_request_context():
+                flask.g.metrics_labels = labels
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except PreventUpdate:
+                raise
+            except Exception:
+                REGISTRY.inc("bonham_callback_errors_total", labels)
+                raise
+            finally:
+                REGISTRY.observe(
+                    "bonham_callback_latency_seconds",
+                    labels,
+                    time.perf_counter() - start,
+                )
+                REGISTRY.inc("bonham_callback_calls_total", labels)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def record_fit(
+    app_name: str,
+    model: str,
+    iterations: Optional[int],
+    converged: bool,
+    start: str = "cold",
+) -> None:
+    """Record the outcome of one curve fit.
+
+    Comparing the iteration histograms for ``start="warm"`` and ``"cold"``
+    shows what warm-starting from the previous fit saves.
+
+    Args:
+        app_name (str): app label
+        model (str): fitted model name
+        iterations (Optional[int]): solver function evaluations, None if unknown
+        converged (bool): whether the solver reported convergence
+        start (str): "cold" for default initial guesses, "warm" when starting
+            from the session's previous parameters
+    """
+    labels: Labels = (("app", app_name), ("model", model), ("start", start))
+    REGISTRY.inc("bonham_fits_total", labels)
+    if not converged:
+        REGISTRY.inc("bonham_fit_failures_total", labels)
+    if iterations is not None:
+        REGISTRY.observe("bonham_fit_iterations", labels, float(iterations))
+
+
+def record_batch_item(app_name: str, succeeded: bool) -> None:
+    """Record one dataset handled by the batch API.
+
+    Args:
+        app_name (str): app label
+        succeeded (bool): whether a result was returned for it
+    """
+    labels: Labels = (("app", app_name),)
+    REGISTRY.inc("bonham_batch_datasets_total", labels)
+    if not succeeded:
+        REGISTRY.inc("bonham_batch_errors_total", labels)
+
+
+def record_export(app_name: str, image_format: str, cached: bool) -> None:
+    """Record one figure image requested for download or a report.
+
+    Args:
+        app_name (str): app label
+        image_format (str): "png", "svg" or "pdf"
+        cached (bool): whether it was served without rendering
+    """
+    labels: Labels = (("app", app_name), ("format", image_format))
+    REGISTRY.inc("bonham_exports_total", labels)
+    if cached:
+        REGISTRY.inc("bonham_export_cache_hits_total", labels)
+
+
+def record_worker_run(pool: str, outcome: str) -> None:
+    """Record one run handed to a worker pool.
+
+    Args:
+        pool (str): pool label
+        outcome (str): "ok", "retired" (ok, and the worker then recycled),
+            "timeout", "crash" or "busy" (no worker was free)
+    """
+    REGISTRY.inc("bonham_worker_runs_total", (("pool", pool), ("outcome", outcome)))
+
+
+def record_worker_restart(pool: str, reason: str) -> None:
+    """Record a worker process replaced before its run limit.
+
+    Args:
+        pool (str): pool label
+        reason (str): "timeout" or "crash"
+    """
+    REGISTRY.inc("bonham_worker_restarts_total", (("pool", pool), ("reason", reason)))
+
+
+def record_fold_cache(hits: int, misses: int) -> None:
+    """Record one Fealden search's folding cache lookups.
+
+    Args:
+        hits (int): evaluations answered from the cache
+        misses (int): evaluations computed
+    """
+    REGISTRY.inc("bonham_fold_cache_hits_total", (), hits)
+    REGISTRY.inc("bonham_fold_cache_misses_total", (), misses)
+
+
+def record_admission(work: str, outcome: str, waited: Optional[float] = None) -> None:
+    """Record one call's admission decision.
+
+    Args:
+        work (str): callback class, e.g. "fealden"
+        outcome (str): "admitted", "rate" (client over its rate), "queue" (too
+            many already waiting) or "timeout" (no slot within the wait)
+        waited (Optional[float]): seconds an admitted call waited for a slot
+    """
+    REGISTRY.inc("bonham_admission_total", (("class", work), ("outcome", outcome)))
+    if waited is not None:
+        REGISTRY.observe("bonham_admission_wait_seconds", (("class", work),), waited)
+
+
+def record_admission_limits(work: str, limits: Dict[str, float]) -> None:
+    """Publish a callback class's configured limits.
+
+    Args:
+        work (str): callback class
+        limits (Dict[str, float]): limit name to value
+    """
+    for limit, value in limits.items():
+        REGISTRY.set(
+            "bonham_admission_limit", (("class", work), ("limit", limit)), value
+        )
+
+
+def record_admission_load(work: str, running: int, waiting: int) -> None:
+    """Publish how many calls of a class are running and waiting now.
+
+    Args:
+        work (str): callback class
+        running (int): admitted calls in progress
+        waiting (int): calls waiting for a slot
+    """
+    REGISTRY.set("bonham_admission_running", (("class", work),), float(running))
+    REGISTRY.set("bonham_admission_waiting", (("class", work),), float(waiting))
+
+
+def _record_payload_sizes(response: flask.Response) -> flask.Response:
+    labels: Optional[Labels] = flask.g.get("metrics_labels")
+    if labels is not None:
+        REGISTRY.observe(
+            "bonham_callback_request_bytes",
+            labels,
+            float(flask.request.content_length or 0),
+        )
+        if not response.direct_passthrough:
+            REGISTRY.observe(
+                "bonham_callback_response_bytes",
+                labels,
+                float(response.calculate_content_length() or 0),
+            )
+    return response
+
+
+def _serve_metrics() -> flask.Response:
+    return flask.Response(
+        REGISTRY.render(), mimetype="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def register(server: flask.Flask) -> None:
+    """Add the ``/metrics`` route and payload-size recording to a server.
+
+    Args:
+        server (flask.Flask): the app's Flask server
+    """
+    server.after_request(_record_payload_sizes)
+    server.add_url_rule("/metrics", "bonham_metrics", _serve_metrics)
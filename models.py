@@ -0,0 +1,454 @@
+"""
+Registry of fittable models, fitted in turn and ranked by information criteria.
+
+Each app picks its candidate models from ``MICHAELIS_MODELS`` or
+``DOSE_MODELS`` and calls ``fit_models``, which fits them one after another
+and ranks them by the small-sample corrected AIC, then BIC. ``curve_fit``
+calls back into Python for every residual and Jacobian evaluation, so the GIL
+would serialize fits on threads anyway, and each fit takes a fraction of a
+millisecond. ``fit_batch`` instead fits each model to many curves at once
+with the vectorized solver in ``robust``, which is also what fits with a
+robust loss use. Model functions and their Jacobians live in ``kernels``.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+from scipy.optimize import curve_fit
+
+import kernels
+import metrics
+import robust
+
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+Guess = Callable[[NDArray, NDArray], List[float]]
+BoolArray = np.ndarray[Any, np.dtype[np.bool_]]
+Curve = Tuple[NDArray, NDArray, Optional[NDArray]]  # x, y, sigma
+
+
+@dataclass(frozen=True)
+class Model:
+    """A named model equation with its parameters and initial guesses."""
+
+    name: str
+    label: str
+    parameters: Sequence[str]
+    equation: Callable[..., NDArray]
+    jacobian: Callable[..., NDArray]
+    guess: Guess
+
+
+@dataclass
+class ModelFit:
+    """Outcome of fitting one model to one data set."""
+
+    model: Model
+    variables: NDArray
+    errors: NDArray
+    rss: float  # weighted residual sum of squares
+    r_squared: float
+    n_points: int
+    aicc: float
+    bic: float
+    start: str  # "warm" or "cold"
+    loss: str = "linear"
+    point_weights: Optional[NDArray] = None  # robust weight of each point
+
+    @property
+    def n_parameters(self) -> int:
+        return len(self.model.parameters)
+
+    @property
+    def downweighted(self) -> BoolArray:
+        """Points the robust loss largely discounted, as outliers."""
+        if self.point_weights is None:
+            return np.zeros(self.n_points, dtype=bool)
+        flagged: BoolArray = self.point_weights < robust.DOWNWEIGHTED
+        return flagged
+
+
+MICHAELIS_MODELS: Dict[str, Model] = {
+    model.name: model
+    for model in (
+        Model(
+            "michaelis_menten",
+            "Michaelis-Menten",
+            ("Vmax", "Km"),
+            kernels.michaelis_menten,
+            kernels.michaelis_menten_jac,
+            lambda x, y: [np.max(y), np.min(y)],  # FIXME: better guesses!
+        ),
+        Model(
+            "substrate_inhibition",
+            "Substrate inhibition",
+            ("Vmax", "Km", "Ki"),
+            kernels.substrate_inhibition,
+            kernels.substrate_inhibition_jac,
+            lambda x, y: [np.max(y), np.median(x), 10 * np.max(x)],
+        ),
+        Model(
+            "hill",
+            "Hill",
+            ("Vmax", "K½", "n"),
+            kernels.hill,
+            kernels.hill_jac,
+            lambda x, y: [np.max(y), np.median(x), 1.0],
+        ),
+    )
+}
+
+DOSE_MODELS: Dict[str, Model] = {
+    model.name: model
+    for model in (
+        Model(
+            "logistic_3pl",
+            "3-parameter logistic",
+            ("Bottom", "Top", "Kd"),
+            kernels.logistic_3pl,
+            kernels.logistic_3pl_jac,
+            lambda x, y: [np.min(y), np.max(y), float(np.mean(x))],
+        ),
+        Model(
+            "logistic_4pl",
+            "4-parameter logistic",
+            ("Bottom", "Top", "Kd", "Hill slope"),
+            kernels.logistic_4pl,
+            kernels.logistic_4pl_jac,
+            lambda x, y: [np.min(y), np.max(y), float(np.mean(x)), 1.0],
+        ),
+        Model(
+            "logistic_5pl",
+            "5-parameter logistic",
+            ("Bottom", "Top", "Kd", "Hill slope", "Asymmetry"),
+            kernels.logistic_5pl,
+            kernels.logistic_5pl_jac,
+            lambda x, y: [np.min(y), np.max(y), float(np.mean(x)), 1.0, 1.0],
+        ),
+    )
+}
+
+
+def select(registry: Dict[str, Model], names: Optional[Sequence[str]]) -> List[Model]:
+    """Pick candidate models by name, or all of a registry's.
+
+    Args:
+        registry (Dict[str, Model]): e.g. ``MICHAELIS_MODELS``
+        names (Optional[Sequence[str]]): model names, None or empty for all
+
+    Raises:
+        ValueError: for names not in the registry
+
+    Returns:
+        List[Model]: the candidates, in registry order
+    """
+    if not names:
+        return list(registry.values())
+    if isinstance(names, str):
+        names = [names]
+    unknown = set(names) - set(registry)
+    if unknown:
+        raise ValueError(
+            f"Unknown models {sorted(unknown)}; choose from {list(registry)}"
+        )
+    return [model for name, model in registry.items() if name in names]
+
+
+COMPARISON_COLUMNS: List[Dict[str, str]] = [
+    {"id": "rank", "name": "Rank"},
+    {"id": "model", "name": "Model"},
+    {"id": "parameters", "name": "Parameters"},
+    {"id": "r_squared", "name": "R squared"},
+    {"id": "aicc", "name": "AICc"},
+    {"id": "bic", "name": "BIC"},
+    {"id": "weight", "name": "Akaike weight"},
+]
+
+if kernels.JIT_ENABLED:
+    kernels.warm_up()  # compiled once per deployment, then loaded from disk
+
+
+def _criteria(rss: float, n: int, k: int) -> Dict[str, float]:
+    """Small-sample corrected AIC and BIC for a least-squares fit."""
+    log_likelihood_term = n * np.log(max(rss, 1e-300) / n)
+    aic = log_likelihood_term + 2 * k
+    # AICc is undefined unless there are at least two more points than parameters
+    aicc = aic + 2 * k * (k + 1) / (n - k - 1) if n - k - 1 > 0 else np.inf
+    return {"aicc": float(aicc), "bic": float(log_likelihood_term + k * np.log(n))}
+
+
+def _solve(
+    model: Model,
+    x: NDArray,
+    y: NDArray,
+    sigma: Optional[NDArray],
+    p0: Union[Sequence[float], NDArray],
+    app_name: str,
+    start: str,
+) -> Optional[ModelFit]:
+    try:
+        variables, cov, infodict, _, _ = curve_fit(
+            model.equation,
+            x,
+            y,
+            p0=p0,
+            sigma=sigma,
+            jac=model.jacobian,
+            full_output=True,
+        )
+    except (RuntimeError, ValueError):
+        metrics.record_fit(app_name, model.name, None, False, start)
+        return None
+    with np.errstate(invalid="ignore"):
+        errors: NDArray = np.sqrt(np.diag(cov))
+    converged = bool(np.all(np.isfinite(variables)) and np.all(np.isfinite(errors)))
+    metrics.record_fit(app_name, model.name, infodict["nfev"], converged, start)
+    if not converged:
+        return None
+
+    weights = 1 / sigma if sigma is not None else np.ones_like(y)
+    rss, r_squared = kernels.fit_statistics(y, model.equation(x, *variables), weights)
+    criteria = _criteria(float(rss), len(x), len(variables))
+    return ModelFit(
+        model,
+        variables,
+        errors,
+        float(rss),
+        float(r_squared),
+        len(x),
+        criteria["aicc"],
+        criteria["bic"],
+        start,
+    )
+
+
+def fit_model(
+    model: Model,
+    x: NDArray,
+    y: NDArray,
+    sigma: Optional[NDArray] = None,
+    initial: Optional[NDArray] = None,
+    app_name: str = "",
+) -> Optional[ModelFit]:
+    """Fit one model, warm-starting from earlier parameters when given.
+
+    A warm start that fails or goes non-finite falls back to the model's
+    usual guesses.
+
+    Args:
+        model (Model): model to fit
+        x (NDArray): x values
+        y (NDArray): y values
+        sigma (Optional[NDArray]): y standard deviations, for weighting
+        initial (Optional[NDArray]): previously converged variables, if any
+        app_name (str): app label for the fit metrics
+
+    Returns:
+        Optional[ModelFit]: the fit, or None if it did not converge
+    """
+    if len(x) <= len(model.parameters):
+        return None
+    if initial is not None and len(initial) == len(model.parameters):
+        fit = _solve(model, x, y, sigma, initial, app_name, "warm")
+        if fit is not None:
+            return fit
+    return _solve(model, x, y, sigma, model.guess(x, y), app_name, "cold")
+
+
+def fit_models(
+    models: Sequence[Model],
+    x: NDArray,
+    y: NDArray,
+    sigma: Optional[NDArray] = None,
+    initial: Optional[Dict[str, NDArray]] = None,
+    app_name: str = "",
+    loss: str = "linear",
+) -> List[ModelFit]:
+    """Fit candidate models and rank them, best first.
+
+    Ranking is by AICc, then BIC; models too large for the data to give an
+    AICc rank after the others, simplest first.
+
+    Args:
+        models (Sequence[Model]): candidates, simplest first
+        x (NDArray): x values
+        y (NDArray): y values
+        sigma (Optional[NDArray]): y standard deviations, for weighting
+        initial (Optional[Dict[str, NDArray]]): previous variables by model
+            name; robust fits always start from the models' guesses
+        app_name (str): app label for the fit metrics
+        loss (str): "linear" for least squares, or a robust loss from
+            ``robust.LOSSES`` to downweight outliers
+
+    Raises:
+        ValueError: for an unknown loss
+        RuntimeError: if no model could be fitted
+
+    Returns:
+        List[ModelFit]: converged fits, best first
+    """
+    if loss != "linear":
+        fits = fit_batch(models, [(x, y, sigma)], loss, app_name)[0]
+    else:
+        initial = initial or {}
+        candidates = (
+            fit_model(model, x, y, sigma, initial.get(model.name), app_name)
+            for model in models
+        )
+        fits = [fit for fit in candidates if fit]
+    if not fits:
+        raise RuntimeError("No model could be fitted to the data")
+    return sorted(fits, key=lambda fit: (fit.aicc, fit.bic))
+
+
+def fit_batch(
+    models: Sequence[Model],
+    curves: Sequence[Curve],
+    loss: str = "linear",
+    app_name: str = "",
+) -> List[List[ModelFit]]:
+    """Fit candidate models to many curves, each model to all curves at once.
+
+    Args:
+        models (Sequence[Model]): candidates, simplest first
+        curves (Sequence[Curve]): x, y and optional y standard deviations of
+            each curve, with no blanks
+        loss (str): "linear" for least squares, or a robust loss from
+            ``robust.LOSSES``
+        app_name (str): app label for the fit metrics
+
+    Raises:
+        ValueError: for an unknown loss
+
+    Returns:
+        List[List[ModelFit]]: for each curve, its converged fits, best first;
+            empty if no model could be fitted
+    """
+    if loss not in robust.LOSSES:
+        raise ValueError(f"Unknown loss {loss!r}; choose from {list(robust.LOSSES)}")
+    results: List[List[ModelFit]] = [[] for _ in curves]
+    if not curves:
+        return results
+    weighted = any(sigma is not None for _, _, sigma in curves)
+    x, y, sigma = robust.pad(
+        [(cx, cy, cs if cs is not None else np.ones_like(cy)) for cx, cy, cs in curves]
+    )
+    for model in models:
+        initial = np.array([model.guess(cx, cy) for cx, cy, _ in curves], dtype=float)
+        batch = robust.fit_curves(
+            model.equation,
+            model.jacobian,
+            x,
+            y,
+            sigma if weighted else None,
+            initial,
+            loss,
+        )
+        for i, (cx, _, _) in enumerate(curves):
+            n_points = len(cx)
+            converged = bool(batch.converged[i]) and n_points > len(model.parameters)
+            metrics.record_fit(
+                app_name, model.name, int(batch.iterations[i]), converged
+            )
+            if not converged:
+                continue
+            rss = float(batch.rss[i])
+            criteria = _criteria(rss, n_points, len(model.parameters))
+            results[i].append(
+                ModelFit(
+                    model,
+                    batch.variables[i],
+                    batch.errors[i],
+                    rss,
+                    float(batch.r_squared[i]),
+                    n_points,
+                    criteria["aicc"],
+                    criteria["bic"],
+                    start="cold",
+                    loss=loss,
+                    point_weights=batch.point_weights[i, :n_points],
+                )
+            )
+    return [sorted(fits, key=lambda fit: (fit.aicc, fit.bic)) for fits in results]
+
+
+def akaike_weights(fits: Sequence[ModelFit]) -> NDArray:
+    """Relative likelihood of each model, from AICc differences.
+
+    Args:
+        fits (Sequence[ModelFit]): fits of competing models to one data set
+
+    Returns:
+        NDArray: weights summing to 1, 0 for models without a finite AICc
+    """
+    aicc = np.array([fit.aicc for fit in fits])
+    finite = np.isfinite(aicc)
+    weights: NDArray = np.zeros(len(fits))
+    if finite.any():
+        relative = np.exp(-(aicc[finite] - aicc[finite].min()) / 2)
+        weights[finite] = relative / relative.sum()
+    return weights
+
+
+def comparison_rows(fits: Sequence[ModelFit]) -> List[Dict[str, Any]]:
+    """Summarize ranked fits as rows for a table with ``COMPARISON_COLUMNS``.
+
+    Args:
+        fits (Sequence[ModelFit]): fits, best first
+
+    Returns:
+        List[Dict[str, Any]]: one row per model with its criteria, Akaike
+            weight and parameters
+    """
+    return [
+        {
+            "rank": rank,
+            "model": fit.model.label,
+            "parameters": ", ".join(
+                f"{name} = {value:0.3g}"
+                for name, value in zip(fit.model.parameters, fit.variables)
+            ),
+            "r_squared": round(fit.r_squared, 4),
+            "aicc": round(fit.aicc, 2) if np.isfinite(fit.aicc) else "n/a",
+            "bic": round(fit.bic, 2),
+            "weight": round(float(weight), 3),
+        }
+        for rank, (fit, weight) in enumerate(zip(fits, akaike_weights(fits)), start=1)
+    ]
+
+
+def _finite(value: float) -> Optional[float]:
+    return float(value) if np.isfinite(value) else None
+
+
+def fit_summary(fits: Sequence[ModelFit]) -> List[Dict[str, Any]]:
+    """Describe ranked fits as JSON-ready records, unrounded.
+
+    Args:
+        fits (Sequence[ModelFit]): fits, best first
+
+    Returns:
+        List[Dict[str, Any]]: one record per model, with non-finite values
+            as None
+    """
+    return [
+        {
+            "model": fit.model.name,
+            "parameters": {
+                name: _finite(value)
+                for name, value in zip(fit.model.parameters, fit.variables)
+            },
+            "errors": {
+                name: _finite(error)
+                for name, error in zip(fit.model.parameters, fit.errors)
+            },
+            "r_squared": _finite(fit.r_squared),
+            "aicc": _finite(fit.aicc),
+            "bic": _finite(fit.bic),
+            "weight": float(weight),
+            "start": fit.start,
+            "loss": fit.loss,
+            "downweighted": np.flatnonzero(fit.downweighted).tolist(),
+        }
+        for fit, weight in zip(fits, akaike_weights(fits))
+    ]
@@ -0,0 +1,386 @@
+#!/usr/bin/env python3
+
+"""
+Build step that pre-renders the static home page to plain HTML.
+
+``home.py`` has a fixed layout and a single navbar-toggle callback, so there
+is no need to ship the Dash renderer to visitors. This walks
+``MyApp.layout``, emits the equivalent Bootstrap markup with the toggle as a
+few lines of inline JS, fingerprints the assets it references, and writes
+everything to ``public/`` together with an ``.htaccess`` that sets ETags and
+cache headers. Under Passenger the web server answers from ``public/``
+directly, so the landing page costs no Python work at all.
+
+Usage:
+    python prerender.py [--out public]
+"""
+
+import argparse
+import hashlib
+import html
+import shutil
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import flask
+
+HERE = Path(__file__).resolve().parent
+DEFAULT_OUT = HERE / "public"
+
+Props = Dict[str, Any]
+Renderer = Callable[[Props, str], str]
+
+TOGGLE_JS = (
+    "document.querySelectorAll('.navbar-toggler').forEach(function(b){"
+    "b.addEventListener('click',function(){"
+    "b.closest('nav').querySelector('.navbar-collapse').classList.toggle('show')"
+    "})});"
+)
+
+HTACCESS = """\
+# Generated by prerender.py
+DirectoryIndex index.html
+FileETag MTime Size
+<IfModule mod_deflate.c>
+  AddOutputFilterByType DEFLATE text/html text/css application/javascript
+</IfModule>
+<IfModule mod_headers.c>
+  <FilesMatch "\\.html$">
+    Header set Cache-Control "public, max-age=300, must-revalidate"
+  </FilesMatch>
+  <FilesMatch "\\.[0-9a-f]{12}\\.(png|css|js)$">
+    Header set Cache-Control "public, max-age=31536000, immutable"
+  </FilesMatch>
+</IfModule>
+"""
+
+
+def _classes(*names: Optional[str]) -> str:
+    return " ".join(name for name in names if name)
+
+
+def _style(style: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not style:
+        return None
+    return ";".join(f"{key}:{value}" for key, value in style.items())
+
+
+def _tag(name: str, attrs: Dict[str, Any], inner: str = "", void: bool = False) -> str:
+    """Render one element, skipping attributes that are None or False.
+
+    Args:
+        name (str): tag name
+        attrs (Dict[str, Any]): attribute values
+        inner (str): rendered children
+        void (bool): whether the element has no closing tag
+
+    Returns:
+        str: html markup
+    """
+    parts = [name]
+    for key, value in attrs.items():
+        if value is None or value is False or value == "":
+            continue
+        if value is True:
+            parts.append(key)
+        else:
+            parts.append(f'{key}="{html.escape(str(value))}"')
+    opening = "<" + " ".join(parts) + ">"
+    return opening if void else f"{opening}{inner}</{name}>"
+
+
+def _common(props: Props, *classes: Optional[str]) -> Dict[str, Any]:
+    return {
+        "id": props.get("id"),
+        "class": _classes(*classes, props.get("className")),
+        "style": _style(props.get("style")),
+    }
+
+
+def _col_classes(props: Props) -> List[str]:
+    classes = []
+    for key in ("width", "xs", "sm", "md", "lg", "xl"):
+        breakpoint = "" if key in ("width", "xs") else key
+        classes += _size_classes(breakpoint, props.get(key))
+    return classes or ["col"]
+
+
+def _size_classes(breakpoint: str, spec: Any) -> List[str]:
+    if spec is None:
+        return []
+    infix = f"-{breakpoint}" if breakpoint else ""
+    if not isinstance(spec, dict):
+        spec = {"size": spec}
+    classes = []
+    if "size" in spec:
+        size = spec["size"]
+        classes.append(f"col{infix}" if size is True else f"col{infix}-{size}")
+    if "offset" in spec:
+        classes.append(f"offset{infix}-{spec['offset']}")
+    return classes
+
+
+def _html_component(tag: str) -> Renderer:
+    void = tag in ("img", "br", "hr")
+
+    def render(props: Props, inner: str) -> str:
+        attrs = _common(props)
+        for key in ("href", "src", "alt", "height", "width", "title"):
+            attrs[key] = props.get(key)
+        return _tag(tag, attrs, inner, void)
+
+    return render
+
+
+def _navbar(props: Props, inner: str, brand: str = "") -> str:
+    color = props.get("color", "light")
+    theme = "navbar-dark" if props.get("dark") else "navbar-light"
+    expand = props.get("expand", "md")
+    sticky = props.get("sticky")
+    nav_classes = _classes(
+        "navbar",
+        f"navbar-expand-{expand}" if expand else None,
+        theme,
+        f"bg-{color}" if color else None,
+        f"sticky-{sticky}" if sticky else None,
+    )
+    container = "container-fluid" if props.get("fluid") else "container"
+    return _tag(
+        "nav",
+        _common(props, nav_classes),
+        _tag("div", {"class": container}, brand + inner),
+    )
+
+
+def _navbar_simple(props: Props, inner: str) -> str:
+    brand = _tag(
+        "a",
+        {"class": "navbar-brand", "href": props.get("brand_href", "/")},
+        html.escape(str(props.get("brand", ""))),
+    )
+    toggler = _tag(
+        "button",
+        {"class": "navbar-toggler", "type": "button"},
+        _tag("span", {"class": "navbar-toggler-icon"}),
+    )
+    menu = _tag(
+        "div",
+        {"class": "collapse navbar-collapse"},
+        _tag("ul", {"class": "navbar-nav ms-auto"}, inner),
+    )
+    return _navbar(props, toggler + menu, brand)
+
+
+def _button(props: Props, inner: str) -> str:
+    classes = _classes("btn", f"btn-{props.get('color', 'primary')}")
+    if props.get("href"):
+        return _tag("a", {**_common(props, classes), "href": props["href"]}, inner)
+    return _tag("button", {**_common(props, classes), "type": "button"}, inner)
+
+
+def _nav_link(props: Props, inner: str) -> str:
+    classes = _classes("nav-link", "disabled" if props.get("disabled") else None)
+    return _tag("a", {**_common(props, classes), "href": props.get("href")}, inner)
+
+
+def _wrapper(tag: str, *classes: str) -> Renderer:
+    return lambda props, inner: _tag(tag, _common(props, *classes), inner)
+
+
+DBC_RENDERERS: Dict[str, Renderer] = {
+    "Container": lambda p, inner: _tag(
+        "div",
+        _common(p, "container-fluid" if p.get("fluid") else "container"),
+        inner,
+    ),
+    "Row": lambda p, inner: _tag(
+        "div",
+        _common(
+            p,
+            "row",
+            f"justify-content-{p['justify']}" if p.get("justify") else None,
+            f"align-items-{p['align']}" if p.get("align") else None,
+        ),
+        inner,
+    ),
+    "Col": lambda p, inner: _tag("div", _common(p, *_col_classes(p)), inner),
+    "Card": lambda p, inner: _tag(
+        "div",
+        _common(
+            p,
+            "card",
+            (
+                (f"border-{p['color']}" if p.get("outline") else f"bg-{p['color']}")
+                if p.get("color")
+                else None
+            ),
+        ),
+        inner,
+    ),
+    "CardHeader": _wrapper("div", "card-header"),
+    "CardBody": _wrapper("div", "card-body"),
+    "CardFooter": _wrapper("div", "card-footer"),
+    "Button": _button,
+    "Nav": lambda p, inner: _tag(
+        "ul",
+        _common(
+            p,
+            "nav",
+            "navbar-nav" if p.get("navbar") else None,
+            "nav-fill" if p.get("fill") else None,
+        ),
+        inner,
+    ),
+    "NavItem": _wrapper("li", "nav-item"),
+    "NavLink": _nav_link,
+    "NavbarBrand": lambda p, inner: _tag(
+        "a" if p.get("href") else "span",
+        {**_common(p, "navbar-brand"), "href": p.get("href")},
+        inner,
+    ),
+    "NavbarToggler": lambda p, inner: _tag(
+        "button",
+        {**_common(p, "navbar-toggler"), "type": "button"},
+        _tag("span", {"class": "navbar-toggler-icon"}),
+    ),
+    "Collapse": lambda p, inner: _tag(
+        "div",
+        _common(
+            p,
+            "collapse",
+            "navbar-collapse" if p.get("navbar") else None,
+            "show" if p.get("is_open") else None,
+        ),
+        inner,
+    ),
+    "Navbar": lambda p, inner: _navbar(p, inner),
+    "NavbarSimple": _navbar_simple,
+}
+
+
+def render(component: Any) -> str:
+    """Render a Dash component tree to static HTML.
+
+    Args:
+        component (Any): component, string, number, list or None
+
+    Raises:
+        ValueError: for component types that have no static rendering
+
+    Returns:
+        str: html markup
+    """
+    if component is None:
+        return ""
+    if isinstance(component, (list, tuple)):
+        return "".join(render(child) for child in component)
+    if isinstance(component, (str, int, float)):
+        return html.escape(str(component))
+
+    props: Props = component.to_plotly_json()["props"]
+    inner = render(props.get("children"))
+    namespace, kind = component._namespace, component._type
+    if namespace == "dash_html_components":
+        return _html_component(kind.lower())(props, inner)
+    if namespace == "dash_bootstrap_components" and kind in DBC_RENDERERS:
+        return DBC_RENDERERS[kind](props, inner)
+    raise ValueError(f"No static rendering for {namespace}.{kind}")
+
+
+def fingerprint(source: Path, out_dir: Path) -> str:
+    """Copy an asset under a content-hashed name so it can be cached forever.
+
+    Args:
+        source (Path): asset file
+        out_dir (Path): output assets directory
+
+    Returns:
+        str: file name of the copy
+    """
+    digest = hashlib.sha256(source.read_bytes()).hexdigest()[:12]
+    name = f"{source.stem}.{digest}{source.suffix}"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    shutil.copyfile(source, out_dir / name)
+    return name
+
+
+def build(out_dir: Path = DEFAULT_OUT) -> Path:
+    """Pre-render home.py's layout into ``out_dir``.
+
+    Args:
+        out_dir (Path): output directory, served as static files
+
+    Returns:
+        Path: the written index.html
+    """
+    import home  # imported here since home.py itself uses serve_prerendered
+
+    body = render(home.MyApp.layout)
+
+    assets_dir = HERE / "assets"
+    for asset in sorted(assets_dir.iterdir()):
+        if asset.is_file():
+            name = fingerprint(asset, out_dir / "assets")
+            body = body.replace(
+                html.escape(home.MyApp.get_asset_url(asset.name)),
+                f"/assets/{name}",
+            )
+
+    stylesheets = "".join(
+        _tag("link", {"rel": "stylesheet", "href": sheet}, void=True)
+        for sheet in home.MyApp.config.external_stylesheets
+    )
+    page = (
+        "<!DOCTYPE html>"
+        '<html lang="en"><head><meta charset="utf-8">'
+        '<meta name="viewport" content="width=device-width, initial-scale=1">'
+        f"<title>{html.escape(home.MyApp.title)}</title>{stylesheets}</head>"
+        f"<body>{body}<script>{TOGGLE_JS}</script></body></html>\n"
+    )
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    index = out_dir / "index.html"
+    index.write_text(page, encoding="utf-8")
+    (out_dir / ".htaccess").write_text(HTACCESS)
+    return index
+
+
+def serve_prerendered(server: flask.Flask, out_dir: Path = DEFAULT_OUT) -> None:
+    """Answer ``/`` from the pre-rendered page when the web server does not.
+
+    Behind Apache the static ``public/`` directory is served before Passenger
+    is involved; this covers running the app directly, answering with an ETag
+    so repeat visits are a 304.
+
+    Args:
+        server (flask.Flask): home.py's Flask server
+        out_dir (Path): directory written by ``build``
+    """
+
+    def index() -> Optional[flask.Response]:
+        if flask.request.path == "/" and (out_dir / "index.html").exists():
+            response = flask.send_from_directory(out_dir, "index.html", max_age=300)
+            response.cache_control.must_revalidate = True
+            return response
+        if flask.request.path.startswith("/assets/"):
+            name = flask.request.path[len("/assets/") :]
+            if (out_dir / "assets" / name).is_file():
+                response = flask.send_from_directory(
+                    out_dir / "assets", name, max_age=31536000
+                )
+                response.cache_control.immutable = True
+                return response
+        return None
+
+    server.before_request(index)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Pre-render the home page")
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT)
+    args = parser.parse_args()
+    print(f"Wrote {build(args.out)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+"""
+Vectorized least-squares and robust-loss fitting of many curves at once.
+
+``fit_curves`` fits one model to a whole batch of curves in lockstep: each
+Levenberg-Marquardt iteration evaluates the model and its Jacobian for every
+curve in one call and solves all the damped normal equations as one stacked
+linear solve, so the Python overhead is paid per iteration rather than per
+curve. Curves of different lengths are padded; padding and blank points carry
+zero weight. Each curve stops as soon as it converges, and later iterations
+only touch the curves still running.
+
+With a robust loss (Huber, soft-L1 or Cauchy) the least-squares fit is the
+starting point for iteratively reweighted least squares. Every iteration
+weights each point by its residual relative to the curve's robust spread
+(the scaled median absolute residual), so a point well off the curve, such
+as an outlier well, pulls on the fit much less than the rest. A point whose
+final weight is below ``DOWNWEIGHTED`` is reported as an outlier. Starting
+from the least-squares optimum, the reweighting usually settles within a
+few iterations, so a robust fit costs a fraction more than a plain one.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+BoolArray = np.ndarray[Any, np.dtype[np.bool_]]
+
+# Tuning constants, in robust standard deviations, giving 95% efficiency for
+# normally distributed errors
+LOSSES: Dict[str, float] = {
+    "linear": np.inf,
+    "huber": 1.345,
+    "soft_l1": 1.345,
+    "cauchy": 2.385,
+}
+LOSS_LABELS: Dict[str, str] = {
+    "linear": "Least squares",
+    "huber": "Huber",
+    "soft_l1": "Soft L1",
+    "cauchy": "Cauchy",
+}
+DOWNWEIGHTED = 0.5  # robust weight below which a point is flagged
+MAX_ITERATIONS = 200  # per parameter plus one, like curve_fit's maxfev
+TOLERANCE = 1.5e-8  # relative change in cost or parameters that ends a fit
+WEIGHT_TOLERANCE = 1e-3  # largest change in robust weights that ends a fit
+REWEIGHT_TOLERANCE = 1e-6  # relative change in cost that ends reweighting
+MAD_TO_SD = 1 / 0.6745  # median absolute deviation to standard deviation
+
+
+@dataclass
+class CurveFits:
+    """Outcome of fitting one model to a batch of C curves of up to N points."""
+
+    variables: NDArray  # (C, P)
+    errors: NDArray  # (C, P) standard errors
+    rss: NDArray  # (C,) residual sum of squares, with all weights applied
+    r_squared: NDArray  # (C,)
+    point_weights: NDArray  # (C, N) robust weights; 1 without a robust loss
+    iterations: NDArray  # (C,) iterations used
+    converged: BoolArray  # (C,)
+
+
+def loss_weights(loss: str, scaled: NDArray) -> NDArray:
+    """IRLS weights for residuals in units of the robust standard deviation.
+
+    Args:
+        loss (str): a key of ``LOSSES``
+        scaled (NDArray): residuals divided by the robust standard deviation
+
+    Returns:
+        NDArray: weights between 0 and 1
+    """
+    z = np.abs(scaled) / LOSSES[loss]
+    if loss == "huber":
+        return np.minimum(1.0, 1.0 / np.maximum(z, 1e-300))
+    if loss == "soft_l1":
+        weights: NDArray = 1.0 / np.sqrt(1.0 + z**2)
+        return weights
+    if loss == "cauchy":
+        weights = 1.0 / (1.0 + z**2)
+        return weights
+    return np.ones_like(z)
+
+
+def robust_scale(residuals: NDArray, mask: BoolArray, n_parameters: int) -> NDArray:
+    """Robust standard deviation of each curve's residuals.
+
+    Args:
+        residuals (NDArray): (C, N) residuals, divided by sigma if weighted
+        mask (BoolArray): (C, N) real points
+        n_parameters (int): fitted parameters, for a degrees-of-freedom
+            correction
+
+    Returns:
+        NDArray: (C,) scaled median absolute residual, or the RMS residual
+            where more than half the points are fitted exactly
+    """
+    absolute = np.where(mask, np.abs(residuals), np.nan)
+    n = mask.sum(axis=1)
+    correction = np.sqrt(n / np.maximum(n - n_parameters, 1))
+    with np.errstate(invalid="ignore"):
+        mad = np.nanmedian(absolute, axis=1) * MAD_TO_SD * correction
+        rms = np.sqrt(np.nanmean(absolute**2, axis=1))
+    scale: NDArray = np.where(mad > 0, mad, np.where(rms > 0, rms, 1.0))
+    return scale
+
+
+def _evaluate(
+    function: Callable[..., NDArray], x: NDArray, variables: NDArray
+) -> NDArray:
+    """Evaluate a kernel for each curve's variables over its own x values."""
+    n_curves, n_points = x.shape
+    columns = [np.repeat(column, n_points) for column in variables.T]
+    values: NDArray = function(x.reshape(-1), *columns)
+    return values.reshape(n_curves, n_points)
+
+
+def _jacobian(
+    function: Callable[..., NDArray], x: NDArray, variables: NDArray
+) -> NDArray:
+    n_curves, n_points = x.shape
+    columns = [np.repeat(column, n_points) for column in variables.T]
+    jacobian: NDArray = function(x.reshape(-1), *columns)
+    return jacobian.reshape(n_curves, n_points, variables.shape[1])
+
+
+def _normal_solve(matrices: NDArray, vectors: NDArray) -> NDArray:
+    """Solve a stack of small linear systems, pseudo-inverting singular ones."""
+    try:
+        solution = np.linalg.solve(matrices, vectors[..., np.newaxis])[..., 0]
+    except np.linalg.LinAlgError:
+        solution = np.einsum("cij,cj->ci", np.linalg.pinv(matrices), vectors)
+    return solution.astype(np.float64, copy=False)
+
+
+def fit_curves(
+    equation: Callable[..., NDArray],
+    jacobian: Callable[..., NDArray],
+    x: NDArray,
+    y: NDArray,
+    sigma: Optional[NDArray],
+    initial: NDArray,
+    loss: str = "linear",
+) -> CurveFits:
+    """Fit one model to a batch of curves, optionally with a robust loss.
+
+    Args:
+        equation (Callable[..., NDArray]): model kernel, taking x and one
+            array per parameter
+        jacobian (Callable[..., NDArray]): its Jacobian kernel, one column
+            per parameter
+        x (NDArray): (C, N) x values, NaN where a curve is shorter
+        y (NDArray): (C, N) y values, NaN for blanks
+        sigma (Optional[NDArray]): (C, N) y standard deviations, for weighting
+        initial (NDArray): (C, P) starting variables
+        loss (str): "linear" for least squares, or "huber", "soft_l1" or
+            "cauchy"
+
+    Raises:
+        ValueError: for an unknown loss
+
+    Returns:
+        CurveFits: variables, errors and statistics for every curve
+    """
+    if loss not in LOSSES:
+        raise ValueError(f"Unknown loss {loss!r}; choose from {list(LOSSES)}")
+    n_curves, n_points = y.shape
+    n_parameters = initial.shape[1]
+    mask: BoolArray = np.isfinite(x) & np.isfinite(y)
+    if sigma is not None:
+        mask &= np.isfinite(sigma) & (sigma > 0)
+    first_x = x[np.arange(n_curves), np.argmax(mask, axis=1)]
+    x = np.where(mask, x, np.nan_to_num(first_x)[:, np.newaxis])  # finite padding
+    y = np.where(mask, y, 0.0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        inverse_sigma = 1.0 / sigma if sigma is not None else 1.0
+    base = np.where(mask, inverse_sigma, 0.0)  # square root of the sigma weights
+
+    variables = initial.astype(np.float64).copy()
+    robust = mask.astype(np.float64)
+    damping = np.full(n_curves, 1e-3)
+    growth = np.full(n_curves, 2.0)
+    scales = np.zeros(n_curves)  # robust spread of the least-squares residuals
+    iterations = np.zeros(n_curves, dtype=np.int64)
+    # 0: least squares, 1: reweighting, 2: converged, 3: failed
+    stage = np.where(mask.sum(axis=1) > n_parameters, 0, 3)
+    diagonal_index = np.arange(n_parameters)
+    with np.errstate(all="ignore"):
+        fitted = np.where(mask, _evaluate(equation, x, variables), 0.0)
+        slopes = np.where(mask[..., np.newaxis], _jacobian(jacobian, x, variables), 0.0)
+
+    for _ in range(MAX_ITERATIONS * (n_parameters + 1)):
+        rows = np.flatnonzero(stage < 2)
+        if rows.size == 0:
+            break
+        iterations[rows] += 1
+        row_mask = mask[rows]
+        residuals = (y[rows] - fitted[rows]) * base[rows]
+        reweight = stage[rows] == 1
+        change = np.zeros(rows.size)
+        if reweight.any():
+            fresh = reweight & ~(scales[rows] > 0)
+            scales[rows[fresh]] = robust_scale(
+                residuals[fresh], row_mask[fresh], n_parameters
+            )
+            with np.errstate(divide="ignore", invalid="ignore"):
+                scaled = residuals / scales[rows, np.newaxis]
+            updated = np.where(
+                row_mask & reweight[:, np.newaxis],
+                loss_weights(loss, scaled),
+                robust[rows],
+            )
+            change = np.max(np.abs(updated - robust[rows]), axis=1)
+            robust[rows] = updated
+
+        root = np.sqrt(robust[rows])
+        weighted = residuals * root
+        cost = np.sum(weighted**2, axis=1)
+        weighted_slopes = slopes[rows] * (base[rows] * root)[..., np.newaxis]
+        normal = np.einsum("cnp,cnq->cpq", weighted_slopes, weighted_slopes)
+        gradient = np.einsum("cnp,cn->cp", weighted_slopes, weighted)
+        diagonal = np.einsum("cpp->cp", normal)
+        floor = 1e-12 * diagonal.max(axis=1, keepdims=True) + 1e-300
+        scaling = damping[rows, np.newaxis] * (diagonal + floor)
+        damped = normal.copy()
+        damped[:, diagonal_index, diagonal_index] += scaling
+        step = _normal_solve(damped, gradient)
+        predicted = np.sum(step * (scaling * step + gradient), axis=1)
+        trial = variables[rows] + step
+
+        with np.errstate(all="ignore"):
+            trial_fitted = np.where(row_mask, _evaluate(equation, x[rows], trial), 0.0)
+            trial_cost = np.sum(
+                ((y[rows] - trial_fitted) * base[rows] * root) ** 2, axis=1
+            )
+        finite = np.isfinite(trial_cost) & np.all(np.isfinite(trial), axis=1)
+        better = finite & (trial_cost <= cost)
+
+        accepted = rows[better]
+        variables[accepted] = trial[better]
+        fitted[accepted] = trial_fitted[better]
+        if accepted.size:
+            with np.errstate(all="ignore"):
+                slopes[accepted] = np.where(
+                    mask[accepted][..., np.newaxis],
+                    _jacobian(jacobian, x[accepted], variables[accepted]),
+                    0.0,
+                )
+        # Nielsen's damping update: shrink by how well the local model
+        # predicted the reduction, grow geometrically after each rejection
+        with np.errstate(all="ignore"):
+            ratio = np.clip(np.nan_to_num((cost - trial_cost) / predicted), 0, 1)
+        shrink = np.maximum(1 / 3, 1 - (2 * ratio - 1) ** 3)
+        damping[rows] *= np.where(better, shrink, growth[rows])
+        growth[rows] = np.where(better, 2.0, growth[rows] * 2)
+
+        tolerance = np.where(reweight, REWEIGHT_TOLERANCE, TOLERANCE)
+        small_cost = better & (cost - trial_cost <= tolerance * cost)
+        small_step = better & np.all(
+            np.abs(step) <= TOLERANCE * (np.abs(trial) + TOLERANCE), axis=1
+        )
+        stalled = damping[rows] > 1e16  # no step improves on this point
+        settled = small_cost | small_step | stalled
+        if loss == "linear":
+            stage[rows[settled]] = 2
+        else:
+            stage[rows[settled & ~reweight]] = 1  # now reweight from the optimum
+            stage[rows[settled & reweight & (change < WEIGHT_TOLERANCE)]] = 2
+            damping[rows[settled & ~reweight]] = 1e-3
+            growth[rows[settled & ~reweight]] = 2.0
+
+    # Standard errors from the final weighted Jacobian, scaled by the
+    # residual variance as curve_fit does without absolute_sigma
+    root = np.sqrt(robust)
+    weighted_slopes = slopes * (base * root)[..., np.newaxis]
+    residuals = (y - fitted) * base
+    rss = np.sum((residuals * root) ** 2, axis=1)
+    dof = mask.sum(axis=1) - n_parameters
+    normal = np.einsum("cnp,cnq->cpq", weighted_slopes, weighted_slopes)
+    singular = ~np.all(np.isfinite(normal), axis=(1, 2))
+    normal[singular] = 0.0
+    with np.errstate(all="ignore"):
+        covariance = (
+            np.linalg.pinv(normal)
+            * np.where(dof > 0, rss / dof, np.inf)[:, np.newaxis, np.newaxis]
+        )
+        errors: NDArray = np.sqrt(np.einsum("cpp->cp", covariance))
+        raw = np.where(mask, y - fitted, 0.0)
+        n = np.maximum(mask.sum(axis=1), 1)
+        mean = np.sum(y, axis=1) / n
+        total = np.sum(np.where(mask, y - mean[:, np.newaxis], 0.0) ** 2, axis=1)
+        r_squared = np.where(total > 0, 1 - np.sum(raw**2, axis=1) / total, 0.0)
+
+    converged: BoolArray = (
+        (stage == 2)
+        & ~singular
+        & np.all(np.isfinite(variables), axis=1)
+        & np.all(np.isfinite(errors), axis=1)
+    )
+    return CurveFits(variables, errors, rss, r_squared, robust, iterations, converged)
+
+
+def pad(curves: Sequence[Tuple[NDArray, ...]]) -> Tuple[NDArray, ...]:
+    """Stack curves of different lengths into NaN-padded (C, N) arrays.
+
+    Args:
+        curves (Sequence[Tuple[NDArray, ...]]): per curve, the same number
+            of equal-length arrays, such as x, y and sigma
+
+    Returns:
+        Tuple[NDArray, ...]: one (C, N) array per position
+    """
+    n_points = max((len(curve[0]) for curve in curves), default=0)
+    stacked = []
+    for position in range(len(curves[0]) if curves else 0):
+        padded = np.full((len(curves), n_points), np.nan)
+        for i, curve in enumerate(curves):
+            padded[i, : len(curve[position])] = curve[position]
+        stacked.append(padded)
+    return tuple(stacked)
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+
+"""
+Searchable index of Fealden runs, so past designs are found instead of rerun.
+
+Every run the Fealden app finishes is recorded in a SQLite file
+(``BONHAM_RUN_HISTORY``): its inputs, when it ran and for how long, whether it
+succeeded, how many designs it returned and the best few. Each run also gets
+a small JSON sidecar next to its results CSV, so ``rebuild`` can recreate the
+index from the results directory alone:
+
+    python run_history.py rebuild [results/]
+
+Result files from before the index have no sidecar; they are indexed by the
+date in their name, with no sequence.
+
+``search`` finds runs by exact sequence, prefix (a range scan of the sequence
+index) or substring (an FTS5 trigram index where SQLite has one, else a
+scan), newest first, one page at a time. ``register`` adds
+``GET /api/history`` and ``GET /api/history/<run id>.csv`` to download a run's
+results.
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import flask
+
+RUN_HISTORY: str = os.environ.get("BONHAM_RUN_HISTORY", "run-history.sqlite3")
+RESULTS_DIR = Path("results")
+PAGE_SIZE = 25
+MAX_PAGE_SIZE = 500
+TOP_RESULTS = 5  # designs kept per run, best first as Fealden writes them
+MATCHES = ("substring", "prefix", "exact")
+MIN_TRIGRAM = 3  # FTS5 trigram queries need at least this many characters
+
+Run = Dict[str, Any]
+
+_FILE_NAME = re.compile(r"^(\d{8}-\d{6})(?:-[0-9a-f]+)?$")
+_COLUMNS = (
+    "id",
+    "started",
+    "sequence",
+    "max_length",
+    "fixed",
+    "seconds",
+    "status",
+    "error",
+    "results",
+    "top",
+    "path",
+)
+_INSERT = f"INSERT INTO runs VALUES ({', '.join('?' * len(_COLUMNS))})"
+
+
+def normalize(sequence: str) -> str:
+    """Canonical form of a sequence for storing and matching: upper case,
+    no whitespace."""
+    return "".join(sequence.split()).upper()
+
+
+def run_id(results_path: Path) -> str:
+    """A run's id: its results file name without ``-results.csv``."""
+    return results_path.name[: -len("-results.csv")]
+
+
+def started_at(run: str) -> Optional[float]:
+    """When a run started, from the timestamp its id begins with."""
+    found = _FILE_NAME.match(run)
+    if found is None:
+        return None
+    return time.mktime(time.strptime(found.group(1), "%Y%m%d-%H%M%S"))
+
+
+def read_results(path: Path) -> Tuple[int, List[Dict[str, str]]]:
+    """Count a results CSV's designs and read the best few.
+
+    Args:
+        path (Path): results CSV
+
+    Returns:
+        Tuple[int, List[Dict[str, str]]]: design count and the first
+            ``TOP_RESULTS`` rows; (0, []) if the file is missing
+    """
+    try:
+        with open(path, newline="", encoding="utf-8") as file:
+            rows = csv.DictReader(file)
+            top = [row for _, row in zip(range(TOP_RESULTS), rows)]
+            return (len(top) + sum(1 for _ in rows), top)
+    except OSError:
+        return (0, [])
+
+
+class RunHistory:
+    """SQLite index of Fealden runs, one connection per thread."""
+
+    def __init__(self, db_path: str = RUN_HISTORY) -> None:
+        self.db_path = db_path
+        self._local = threading.local()
+        self._trigram = True  # until SQLite says otherwise
+
+    def _connect(self) -> sqlite3.Connection:
+        db: Optional[sqlite3.Connection] = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.db_path, timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.row_factory = sqlite3.Row
+            with db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS runs ("
+                    " id TEXT PRIMARY KEY, started REAL, sequence TEXT,"
+                    " max_length INTEGER, fixed INTEGER, seconds REAL, status TEXT,"
+                    " error TEXT, results INTEGER, top TEXT, path TEXT)"
+                )
+                db.execute(
+                    "CREATE INDEX IF NOT EXISTS runs_sequence ON runs (sequence)"
+                )
+                db.execute("CREATE INDEX IF NOT EXISTS runs_started ON runs (started)")
+                try:  # trigram index of sequences, kept in step by triggers
+                    db.execute(
+                        "CREATE VIRTUAL TABLE IF NOT EXISTS run_sequences USING fts5("
+                        " sequence, tokenize='trigram', content='runs',"
+                        " content_rowid='rowid')"
+                    )
+                    db.execute(
+                        "CREATE TRIGGER IF NOT EXISTS runs_added AFTER INSERT ON runs"
+                        " BEGIN INSERT INTO run_sequences (rowid, sequence)"
+                        " VALUES (new.rowid, new.sequence); END"
+                    )
+                    db.execute(
+                        "CREATE TRIGGER IF NOT EXISTS runs_removed AFTER DELETE ON runs"
+                        " BEGIN INSERT INTO run_sequences"
+                        " (run_sequences, rowid, sequence)"
+                        " VALUES ('delete', old.rowid, old.sequence); END"
+                    )
+                except sqlite3.OperationalError:  # SQLite before 3.34
+                    self._trigram = False
+            self._local.db = db
+        return db
+
+    def add(self, *runs: Run) -> None:
+        """Insert or replace runs, in one transaction.
+
+        Args:
+            runs (Run): values for the ``runs`` columns; ``top`` as a list
+        """
+        db = self._connect()
+        with db:
+            for run in runs:
+                values = {name: run.get(name) for name in _COLUMNS}
+                values["sequence"] = normalize(values["sequence"] or "") or None
+                values["top"] = json.dumps(values["top"] or [])
+                # Not INSERT OR REPLACE: its implicit delete skips the triggers
+                db.execute("DELETE FROM runs WHERE id = ?", (values["id"],))
+                db.execute(_INSERT, [values[name] for name in _COLUMNS])
+
+    def record(
+        self,
+        results_path: Path,
+        sequence: str,
+        max_length: int,
+        fixed: bool,
+        started: float,
+        seconds: float,
+        error: Optional[str] = None,
+    ) -> Run:
+        """Index a finished run and write its sidecar next to its results.
+
+        Args:
+            results_path (Path): the run's ``...-results.csv``, which need not
+                exist if the run failed
+            sequence (str): input sequence
+            max_length (int): maximum sensor length
+            fixed (bool): 3' fixed methylene blue
+            started (float): start time, seconds since the epoch
+            seconds (float): wall time of the search
+            error (Optional[str]): why the run failed, None if it succeeded
+
+        Returns:
+            Run: the indexed run
+        """
+        count, top = read_results(results_path)
+        run: Run = {
+            "id": run_id(results_path),
+            "started": started,
+            "sequence": sequence,
+            "max_length": max_length,
+            "fixed": int(fixed),
+            "seconds": round(seconds, 3),
+            "status": "error" if error or not results_path.exists() else "ok",
+            "error": error,
+            "results": count,
+            "top": top,
+            "path": str(results_path),
+        }
+        sidecar = results_path.with_name(f"{run['id']}-run.json")
+        try:
+            sidecar.parent.mkdir(parents=True, exist_ok=True)
+            sidecar.write_text(
+                json.dumps({key: run[key] for key in _COLUMNS[:8]}), encoding="utf-8"
+            )
+        except OSError:
+            pass  # the index still has it; only a rebuild would miss it
+        self.add(run)
+        return run
+
+    def search(
+        self,
+        query: str = "",
+        match: str = "substring",
+        page: int = 0,
+        per_page: int = PAGE_SIZE,
+    ) -> Tuple[List[Run], int]:
+        """Find runs by sequence, newest first, one page at a time.
+
+        Args:
+            query (str): sequence or part of one; empty for every run
+            match (str): "substring", "prefix" or "exact"
+            page (int): zero-based page number
+            per_page (int): runs per page
+
+        Raises:
+            ValueError: for an unknown match
+
+        Returns:
+            Tuple[List[Run], int]: the page of runs and how many match in all
+        """
+        if match not in MATCHES:
+            raise ValueError(f"Unknown match {match!r}; choose from {list(MATCHES)}")
+        query = normalize(query)
+        per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+        db = self._connect()
+        where, parameters = "", []  # type: Tuple[str, List[Any]]
+        if query and match == "exact":
+            where, parameters = "WHERE sequence = ?", [query]
+        elif query and match == "prefix":
+            where, parameters = "WHERE sequence >= ? AND sequence < ?", [
+                query,
+                query + "\U0010ffff",
+            ]
+        elif query and self._trigram and len(query) >= MIN_TRIGRAM:
+            where = (
+                "WHERE rowid IN (SELECT rowid FROM run_sequences"
+                " WHERE run_sequences MATCH ?)"
+            )
+            parameters = ['"' + query.replace('"', '""') + '"']  # one phrase
+        elif query:
+            where = "WHERE sequence LIKE ? ESCAPE '\\'"
+            parameters = ["%" + re.sub(r"([\\%_])", r"\\\1", query) + "%"]
+        total = db.execute(f"SELECT COUNT(*) FROM runs {where}", parameters).fetchone()
+        rows = db.execute(
+            f"SELECT * FROM runs {where} ORDER BY started DESC, id DESC"
+            " LIMIT ? OFFSET ?",
+            parameters + [per_page, max(0, page) * per_page],
+        ).fetchall()
+        runs = [dict(row) for row in rows]
+        for run in runs:
+            run["top"] = json.loads(run["top"] or "[]")
+            run["fixed"] = bool(run["fixed"])
+        return (runs, int(total[0]))
+
+    def get(self, run: str) -> Optional[Run]:
+        """Look up one run by id."""
+        row = self._connect().execute("SELECT * FROM runs WHERE id = ?", (run,))
+        found = row.fetchone()
+        return dict(found) if found is not None else None
+
+    def rebuild(self, results_dir: Path = RESULTS_DIR) -> int:
+        """Recreate the index from a results directory's CSVs and sidecars.
+
+        Args:
+            results_dir (Path): directory of ``...-results.csv`` files
+
+        Returns:
+            int: runs indexed
+        """
+        runs = list(_scan(results_dir))
+        with self._connect() as db:
+            db.execute("DELETE FROM runs")
+            self.add(*runs)  # same transaction: readers never see it empty
+        return len(runs)
+
+
+def _scan(results_dir: Path) -> Iterator[Run]:
+    """Runs found in a results directory, from sidecars where they exist."""
+    ids = {run_id(path) for path in results_dir.glob("*-results.csv")}
+    ids |= {path.name[: -len("-run.json")] for path in results_dir.glob("*-run.json")}
+    for run in sorted(ids):
+        results_path = results_dir / f"{run}-results.csv"
+        try:
+            sidecar = json.loads(
+                (results_dir / f"{run}-run.json").read_text(encoding="utf-8")
+            )
+        except (OSError, ValueError):
+            sidecar = {"id": run, "started": started_at(run), "status": "ok"}
+        count, top = read_results(results_path)
+        if not results_path.exists():
+            sidecar["status"] = "error"
+        yield {**sidecar, "results": count, "top": top, "path": str(results_path)}
+
+
+HISTORY = RunHistory()
+
+
+def _serve_history() -> flask.Response:
+    args = flask.request.args
+    try:
+        page = int(args.get("page", "0"))
+        per_page = int(args.get("per_page", str(PAGE_SIZE)))
+        runs, total = HISTORY.search(
+            args.get("q", ""), args.get("match", "substring"), page, per_page
+        )
+    except ValueError as err:
+        return flask.Response(
+            json.dumps({"error": str(err)}), 400, mimetype="application/json"
+        )
+    for run in runs:
+        del run["path"]  # server-side detail; download via the CSV route
+    body = {"total": total, "page": page, "per_page": per_page, "runs": runs}
+    return flask.Response(json.dumps(body), mimetype="application/json")
+
+
+def _serve_results(run: str) -> flask.Response:
+    found = HISTORY.get(run)
+    if found is None or not found["path"] or not Path(found["path"]).is_file():
+        flask.abort(404)
+    return flask.send_file(
+        Path(found["path"]).resolve(),
+        mimetype="text/csv",
+        as_attachment=True,
+        download_name=f"{run}-results.csv",
+    )
+
+
+def register(server: flask.Flask) -> None:
+    """Add the history search and download routes to an app's server.
+
+    Args:
+        server (flask.Flask): the Dash app's Flask server
+    """
+    server.add_url_rule("/api/history", "run_history", _serve_history)
+    server.add_url_rule("/api/history/<run>.csv", "run_history_results", _serve_results)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Fealden run history index")
+    commands = parser.add_subparsers(dest="command", required=True)
+    rebuild = commands.add_parser("rebuild", help="re-index a results directory")
+    rebuild.add_argument("results", nargs="?", type=Path, default=RESULTS_DIR)
+    find = commands.add_parser("search", help="list runs matching a sequence")
+    find.add_argument("query", nargs="?", default="")
+    find.add_argument("--match", choices=MATCHES, default="substring")
+    find.add_argument("--page", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.command == "rebuild":
+        start = time.perf_counter()
+        count = HISTORY.rebuild(args.results)
+        print(
+            f"Indexed {count} runs from {args.results} into {HISTORY.db_path} "
+            f"in {time.perf_counter() - start:.1f} s",
+            file=sys.stderr,
+        )
+        return 0
+    runs, total = HISTORY.search(args.query, args.match, args.page)
+    for run in runs:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(run["started"] or 0))
+        print(f"{when}  {run['status']:5}  {run['sequence'] or '?':<30} {run['id']}")
+    print(f"{total} runs", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
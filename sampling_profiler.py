@@ -0,0 +1,249 @@
+"""
+Opt-in sampled profiling of slow callbacks, with a small admin page.
+
+Profiling is off unless enabled. ``BONHAM_PROFILE_RATE`` (0 to 1) profiles that
+fraction of calls; an admin can force a single request to be profiled by
+sending the ``X-Bonham-Profile`` header set to ``BONHAM_PROFILE_TOKEN``. A
+background thread samples the callback's stack every few milliseconds, and the
+folded stacks are written to ``BONHAM_PROFILE_DIR`` (oldest removed beyond
+``BONHAM_PROFILE_KEEP``). ``/admin/profiles?token=...`` lists the slowest
+captures and renders each as a flamegraph.
+"""
+
+import functools
+import html
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from types import CodeType
+from typing import Any, Callable, Dict, List, Optional, Tuple, TypeVar, cast
+
+import flask
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+PROFILE_RATE: float = float(os.environ.get("BONHAM_PROFILE_RATE", "0"))
+PROFILE_TOKEN: str = os.environ.get("BONHAM_PROFILE_TOKEN", "")
+PROFILE_DIR: Path = Path(os.environ.get("BONHAM_PROFILE_DIR", "./profiles"))
+PROFILE_KEEP: int = int(os.environ.get("BONHAM_PROFILE_KEEP", "200"))
+SAMPLE_INTERVAL: float = 0.005
+HEADER = "X-Bonham-Profile"
+
+
+class StackSampler:
+    """Periodically sample one thread's call stack into folded-stack counts."""
+
+    def __init__(
+        self,
+        thread_id: int,
+        root: Optional[CodeType] = None,
+        interval: float = SAMPLE_INTERVAL,
+    ) -> None:
+        self.thread_id = thread_id
+        self.root = root
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self) -> "StackSampler":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *_exc: Any) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names: List[str] = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(
+                    f"{code.co_name} ({Path(code.co_filename).name}:{frame.f_lineno})"
+                )
+                if code is self.root:  # ignore the server frames above the callback
+                    break
+                frame = frame.f_back
+            if names:
+                self.stacks[";".join(reversed(names))] += 1
+
+
+def _should_profile() -> bool:
+    if PROFILE_TOKEN and flask.has_request_context():
+        if flask.request.headers.get(HEADER) == PROFILE_TOKEN:
+            return True
+    return PROFILE_RATE > 0 and random.random() < PROFILE_RATE
+
+
+def _store(record: Dict[str, Any]) -> None:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    name = "{}-{}-{}-{}-{}ms.json".format(
+        time.strftime("%Y%m%d-%H%M%S"),
+        record["app"],
+        record["callback"],
+        os.getpid(),
+        int(record["duration"] * 1000),
+    )
+    (PROFILE_DIR / name).write_text(json.dumps(record))
+
+    profiles = sorted(PROFILE_DIR.glob("*.json"), key=lambda p: p.stat().st_mtime)
+    for old in profiles[: max(0, len(profiles) - PROFILE_KEEP)]:
+        old.unlink(missing_ok=True)
+
+
+def sampled(app_name: str) -> Callable[[F], F]:
+    """Decorate a callback so a sample of its calls is profiled and stored.
+
+    Args:
+        app_name (str): app label, e.g. "michaelis"
+
+    Returns:
+        Callable[[F], F]: decorator
+    """
+
+    def decorator(func: F) -> F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            if not _should_profile():
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            with StackSampler(threading.get_ident(), func.__code__) as sampler:
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    _store(
+                        {
+                            "app": app_name,
+                            "callback": func.__name__,
+                            "started": time.time(),
+                            "duration": time.perf_counter() - start,
+                            "interval": sampler.interval,
+                            "stacks": dict(sampler.stacks),
+                        }
+                    )
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+# Admin pages
+def _load_profiles() -> List[Tuple[str, Dict[str, Any]]]:
+    profiles = []
+    for path in PROFILE_DIR.glob("*.json"):
+        try:
+            profiles.append((path.stem, json.loads(path.read_text())))
+        except (OSError, ValueError):
+            continue
+    profiles.sort(key=lambda item: -float(item[1]["duration"]))
+    return profiles
+
+
+def _build_tree(stacks: Dict[str, int]) -> Dict[str, Any]:
+    root: Dict[str, Any] = {"count": 0, "children": {}}
+    for stack, count in stacks.items():
+        root["count"] += count
+        node = root
+        for name in stack.split(";"):
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+    return root
+
+
+def _render_node(name: str, node: Dict[str, Any], total: int) -> str:
+    width = 100.0 * node["count"] / total
+    hue = 20 + (hash(name) % 40)
+    children = "".join(
+        _render_node(child, sub, node["count"])
+        for child, sub in sorted(node["children"].items(), key=lambda i: -i[1]["count"])
+    )
+    label = html.escape(name)
+    return (
+        f'<div class="frame" style="width:{width:.3f}%">'
+        f'<div class="bar" style="background:hsl({hue},90%,60%)" '
+        f'title="{label} ({node["count"]} samples)">{label}</div>'
+        f'<div class="kids">{children}</div></div>'
+    )
+
+
+PAGE = """<!doctype html><html><head><title>Profiles</title><style>
+body{{font:13px sans-serif;margin:1em}} td,th{{padding:2px 8px;text-align:left}}
+.kids{{display:flex}} .frame{{overflow:hidden}}
+.bar{{white-space:nowrap;overflow:hidden;border:1px solid #fff;padding:1px 2px;
+font:11px monospace}}
+</style></head><body>{body}</body></html>"""
+
+
+def _authorized() -> bool:
+    supplied = flask.request.headers.get(HEADER) or flask.request.args.get("token")
+    return bool(PROFILE_TOKEN) and supplied == PROFILE_TOKEN
+
+
+def _profile_index() -> flask.Response:
+    if not _authorized():
+        flask.abort(404)
+    token = html.escape(flask.request.args.get("token", ""))
+    rows = "".join(
+        "<tr><td>{:.1f}</td><td>{}</td><td>{}</td><td>{}</td>"
+        '<td><a href="profiles/{}?token={}">flamegraph</a> '
+        '<a href="profiles/{}.folded?token={}">folded</a></td></tr>'.format(
+            record["duration"] * 1000,
+            html.escape(record["app"]),
+            html.escape(record["callback"]),
+            time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(record["started"])),
+            name,
+            token,
+            name,
+            token,
+        )
+        for name, record in _load_profiles()
+    )
+    body = (
+        "<h3>Captured profiles, slowest first</h3><table>"
+        "<tr><th>ms</th><th>app</th><th>callback</th><th>started</th><th></th></tr>"
+        f"{rows}</table>"
+    )
+    return flask.Response(PAGE.format(body=body))
+
+
+def _profile_detail(name: str) -> flask.Response:
+    if not _authorized():
+        flask.abort(404)
+    folded = name.endswith(".folded")
+    path = PROFILE_DIR / (name[: -len(".folded")] if folded else name)
+    path = path.with_suffix(".json")
+    if path.parent.resolve() != PROFILE_DIR.resolve() or not path.exists():
+        flask.abort(404)
+    record = json.loads(path.read_text())
+    stacks: Dict[str, int] = record["stacks"]
+
+    if folded:
+        text = "".join(f"{stack} {count}\n" for stack, count in stacks.items())
+        return flask.Response(text, mimetype="text/plain")
+
+    tree = _build_tree(stacks)
+    graph = _render_node("all", tree, max(tree["count"], 1)) if stacks else ""
+    body = (
+        f"<h3>{html.escape(record['app'])} / {html.escape(record['callback'])}: "
+        f"{record['duration'] * 1000:.1f} ms, {tree['count']} samples</h3>{graph}"
+    )
+    return flask.Response(PAGE.format(body=body))
+
+
+def register(server: flask.Flask) -> None:
+    """Add the profile admin pages to a server.
+
+    Args:
+        server (flask.Flask): the app's Flask server
+    """
+    server.add_url_rule("/admin/profiles", "bonham_profiles", _profile_index)
+    server.add_url_rule(
+        "/admin/profiles/<name>", "bonham_profile_detail", _profile_detail
+    )
@@ -0,0 +1,192 @@
+"""
+Server-side per-session state, so callbacks exchange ids and diffs, not tables.
+
+Values live in an in-process LRU with a TTL and a byte cap. When a SQLite
+path is configured (``BONHAM_SESSION_DB``, on by default) every write also
+goes to that file, which lets the several Passenger workers of one app share
+sessions: a worker serves from memory when its copy is current and reloads
+from SQLite when another worker has written since.
+"""
+
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+SESSION_DB: str = os.environ.get("BONHAM_SESSION_DB", "sessions.sqlite3")
+SESSION_TTL: float = float(os.environ.get("BONHAM_SESSION_TTL", str(2 * 3600)))
+SESSION_MEMORY_BYTES: int = int(
+    os.environ.get("BONHAM_SESSION_MEMORY_BYTES", str(64 * 1024 * 1024))
+)
+SESSION_DISK_BYTES: int = int(
+    os.environ.get("BONHAM_SESSION_DISK_BYTES", str(512 * 1024 * 1024))
+)
+
+Session = Dict[str, Any]
+
+
+class SessionStore:
+    """LRU + TTL session store with optional SQLite write-through."""
+
+    def __init__(
+        self,
+        namespace: str,
+        db_path: Optional[str] = SESSION_DB,
+        ttl: float = SESSION_TTL,
+        memory_bytes: int = SESSION_MEMORY_BYTES,
+        disk_bytes: int = SESSION_DISK_BYTES,
+    ) -> None:
+        self.namespace = namespace
+        self.ttl = ttl
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.db_path = Path(db_path) if db_path else None
+        self._lock = threading.Lock()
+        # session id -> (stamp, last used, size, value)
+        self._memory: "OrderedDict[str, Tuple[int, float, int, Session]]" = (
+            OrderedDict()
+        )
+        self._memory_total = 0
+        self._local = threading.local()
+        self._writes = 0
+        if hasattr(os, "register_at_fork"):  # a preloading server's workers
+            os.register_at_fork(after_in_child=self._after_fork)
+        if self.db_path is not None:
+            with self._connect() as db:
+                db.execute(
+                    "CREATE TABLE IF NOT EXISTS sessions ("
+                    " namespace TEXT, id TEXT, stamp INTEGER, updated REAL,"
+                    " size INTEGER, value BLOB, PRIMARY KEY (namespace, id))"
+                )
+                db.execute(
+                    "CREATE INDEX IF NOT EXISTS sessions_updated ON sessions (updated)"
+                )
+
+    def _after_fork(self) -> None:
+        """Open new connections in a forked child; SQLite ones must not be
+        shared across processes."""
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        db: Optional[sqlite3.Connection] = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(str(self.db_path), timeout=10)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """Return a session's state, if still held and not expired.
+
+        Args:
+            session_id (str): client session id
+
+        Returns:
+            Optional[Session]: session state, or None if unknown or expired
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._memory.get(session_id)
+            if cached is not None and now - cached[1] > self.ttl:
+                self._drop(session_id)
+                cached = None
+
+        if self.db_path is None:
+            if cached is None:
+                return None
+            with self._lock:
+                self._touch(session_id, now)
+            return cached[3]
+
+        db = self._connect()
+        row = db.execute(
+            "SELECT stamp, updated FROM sessions WHERE namespace = ? AND id = ?",
+            (self.namespace, session_id),
+        ).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            return None
+        if cached is not None and cached[0] == row[0]:
+            with self._lock:
+                self._touch(session_id, now)
+            return cached[3]
+
+        # Another worker wrote this session since we last saw it
+        blob = db.execute(
+            "SELECT value FROM sessions WHERE namespace = ? AND id = ?",
+            (self.namespace, session_id),
+        ).fetchone()
+        if blob is None:
+            return None
+        value: Session = pickle.loads(blob[0])
+        with self._lock:
+            self._remember(session_id, row[0], now, len(blob[0]), value)
+        return value
+
+    def put(self, session_id: str, value: Session) -> None:
+        """Store a session's state.
+
+        Args:
+            session_id (str): client session id
+            value (Session): picklable session state
+        """
+        now = time.time()
+        stamp = time.time_ns()
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._remember(session_id, stamp, now, len(blob), value)
+
+        if self.db_path is None:
+            return
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?, ?)",
+                (self.namespace, session_id, stamp, now, len(blob), blob),
+            )
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune_disk(now)
+
+    def _touch(self, session_id: str, now: float) -> None:
+        stamp, _, size, value = self._memory[session_id]
+        self._memory[session_id] = (stamp, now, size, value)
+        self._memory.move_to_end(session_id)
+
+    def _remember(
+        self, session_id: str, stamp: int, now: float, size: int, value: Session
+    ) -> None:
+        self._drop(session_id)
+        self._memory[session_id] = (stamp, now, size, value)
+        self._memory_total += size
+        while self._memory_total > self.memory_bytes and len(self._memory) > 1:
+            self._drop(next(iter(self._memory)))
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._memory.pop(session_id, None)
+        if entry is not None:
+            self._memory_total -= entry[2]
+
+    def _prune_disk(self, now: float) -> None:
+        with self._connect() as db:
+            db.execute("DELETE FROM sessions WHERE updated < ?", (now - self.ttl,))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM sessions").fetchone()
+            excess = total[0] - self.disk_bytes
+            if excess <= 0:
+                return
+            rows = db.execute(
+                "SELECT namespace, id, size FROM sessions ORDER BY updated"
+            ).fetchall()
+            doomed = []
+            for namespace, session_id, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((namespace, session_id))
+                excess -= size
+            db.executemany(
+                "DELETE FROM sessions WHERE namespace = ? AND id = ?", doomed
+            )
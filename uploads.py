@@ -0,0 +1,419 @@
+"""
+Parse uploaded data files into float matrices for the fitting apps.
+
+``dcc.Upload`` hands a callback the file as a base64 data URL. ``parse_upload``
+decodes it, streams CSV, TSV or XLSX rows and converts them to floats a chunk
+of rows at a time, so no table of Python objects for the whole file is ever
+built. Two layouts are recognized:
+
+* tables: optional metadata and header lines, then one row per point with X in
+  the first column and replicate Y values in the others;
+* plate-reader grids: a header row numbered 1, 2, 3... followed by rows
+  labelled A, B, C...; row A holds the X values and the other plate rows are
+  replicate readings, so each plate column becomes one point.
+
+``parse_pasted`` does the same job for values pasted into a text box: it
+accepts the separators spreadsheets and documents produce and reports each bad
+token by position instead of failing the callback.
+"""
+
+import base64
+import binascii
+import csv
+import datetime
+import io
+import itertools
+import re
+from dataclasses import dataclass
+from pathlib import PurePath
+from typing import Any, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    import openpyxl
+except ImportError:  # openpyxl is optional, needed only for .xlsx uploads
+    openpyxl = None
+
+NDArray = np.ndarray[Any, np.dtype[np.float64]]
+
+MAX_UPLOAD_BYTES = 32 * 1024 * 1024
+MAX_CELLS = 4_000_000  # 32 MB as float64
+CHUNK_ROWS = 8192
+SNIFF_ROWS = 64  # rows searched for a header or plate grid
+PLATE_ROW_LABELS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+XLSX_SUFFIXES = (".xlsx", ".xlsm")
+MAX_REPORTED_TOKENS = 5
+
+MINUS_SIGNS = str.maketrans({"\u2212": "-", "\u2013": "-"})
+SEPARATORS = str.maketrans({",": " ", ";": " "})  # whitespace splits natively
+DECIMAL_COMMAS = str.maketrans({",": ".", ";": " "})
+
+
+class UploadError(ValueError):
+    """An uploaded file that cannot be used; the message is shown to the user."""
+
+
+@dataclass
+class Upload:
+    """Numeric content of an uploaded file."""
+
+    matrix: NDArray  # points x columns, X first, NaN for blank cells
+    names: List[str]  # column names, from the file's header where it has one
+    layout: str  # "table" or "plate"
+
+
+def to_floats(cells: Sequence[Any]) -> NDArray:
+    """Convert cell values to floats in one pass, blanks and text as NaN.
+
+    Times, as plate readers write them in kinetic runs, become seconds.
+
+    Args:
+        cells (Sequence[Any]): numbers, numeric strings, blanks or None
+
+    Returns:
+        NDArray: float64 values
+    """
+    values = [None if cell == "" else cell for cell in cells]
+    try:
+        parsed: NDArray = np.asarray(values, dtype=np.float64)
+    except (TypeError, ValueError):  # text or times; only now go cell by cell
+        parsed = np.fromiter(
+            (_cell_to_float(value) for value in values), np.float64, len(values)
+        )
+    return parsed
+
+
+def _cell_to_float(value: Any) -> float:
+    """Convert one cell, reading [h:]mm:ss text and time cells as seconds."""
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, datetime.time):
+        return (
+            value.hour * 3600 + value.minute * 60 + value.second
+        ) + value.microsecond / 1e6
+    try:
+        if isinstance(value, str) and ":" in value:
+            seconds = 0.0
+            for part in value.strip().split(":"):
+                seconds = seconds * 60 + float(part)
+            return seconds
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _is_number(cell: Any) -> bool:
+    if isinstance(cell, bool):
+        return False
+    return not np.isnan(_cell_to_float(cell))
+
+
+def _text(cell: Any) -> str:
+    if cell is None:
+        return ""
+    if isinstance(cell, float) and cell.is_integer():
+        return str(int(cell))
+    return str(cell).strip()
+
+
+def _trim(row: Sequence[Any]) -> List[Any]:
+    cells = list(row)
+    while cells and _text(cells[-1]) == "":
+        cells.pop()
+    return cells
+
+
+def decode(contents: str) -> bytes:
+    """Decode the data URL that ``dcc.Upload`` provides.
+
+    Args:
+        contents (str): "data:<mimetype>;base64,<data>"
+
+    Raises:
+        UploadError: if it is not base64 data or is too large
+
+    Returns:
+        bytes: file content
+    """
+    _, _, encoded = contents.partition(",")
+    if len(encoded) * 3 // 4 > MAX_UPLOAD_BYTES:
+        raise UploadError(f"File is larger than {MAX_UPLOAD_BYTES // (1024 * 1024)} MB")
+    try:
+        return base64.b64decode(encoded, validate=True)
+    except (binascii.Error, ValueError):
+        raise UploadError("Could not read the uploaded file") from None
+
+
+def _sniff_delimiter(data: bytes) -> str:
+    sample = data[:8192].decode("utf-8", errors="replace")
+    lines = [line for line in sample.splitlines()[:SNIFF_ROWS] if line.strip()]
+    counts = {
+        delimiter: sum(line.count(delimiter) for line in lines)
+        for delimiter in ("\t", ";", ",")
+    }
+    if counts["\t"]:
+        return "\t"
+    return ";" if counts[";"] > counts[","] else ","
+
+
+def _text_rows(data: bytes, delimiter: str) -> Iterator[Sequence[Any]]:
+    stream = io.TextIOWrapper(
+        io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline=""
+    )
+    return csv.reader(stream, delimiter=delimiter)
+
+
+def _xlsx_rows(data: bytes) -> Iterator[Sequence[Any]]:
+    if openpyxl is None:
+        raise UploadError("Reading .xlsx files needs openpyxl installed on the server")
+    try:
+        workbook = openpyxl.load_workbook(
+            io.BytesIO(data), read_only=True, data_only=True
+        )
+    except Exception:  # openpyxl raises a variety of zip and xml errors
+        raise UploadError("Could not read the uploaded spreadsheet") from None
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _plate_header(row: Sequence[Any]) -> int:
+    """Return the number of plate columns if ``row`` is numbered 1, 2, ..."""
+    cells = [_text(cell) for cell in _trim(row)[1:]]
+    if len(cells) < 2 or cells != [str(i) for i in range(1, len(cells) + 1)]:
+        return 0
+    return len(cells)
+
+
+def _read_plate(rows: Iterator[Sequence[Any]], width: int) -> Upload:
+    labels: List[str] = []
+    cells: List[Any] = []
+    for row, label in zip(rows, PLATE_ROW_LABELS):
+        if not row or _text(row[0]).upper() != label:
+            break
+        values = list(row[1 : width + 1])
+        cells.extend(values + [""] * (width - len(values)))
+        labels.append(label)
+    if len(labels) < 2:
+        raise UploadError("Plate layouts need row A for X and at least one more row")
+    grid = to_floats(cells).reshape(len(labels), width)
+    return Upload(grid.T.copy(), labels, "plate")
+
+
+def _read_table(head: List[Sequence[Any]], rest: Iterator[Sequence[Any]]) -> Upload:
+    start = next(
+        (
+            i
+            for i, row in enumerate(head)
+            if row and _is_number(row[0]) and any(_is_number(cell) for cell in row[1:])
+        ),
+        None,
+    )
+    if start is None:
+        raise UploadError("No rows with an X value and a Y value were found")
+
+    header = _trim(head[start - 1]) if start > 0 else []
+    if any(_is_number(cell) for cell in header):
+        header = []
+    width = max(len(_trim(head[start])), len(header))
+    if width < 2:
+        raise UploadError("Data needs an X column and at least one Y column")
+
+    chunks: List[NDArray] = []
+    flat: List[Any] = []
+    n_rows = total_rows = 0
+    padding = [""] * width
+    for row in itertools.chain(head[start:], rest):
+        if len(row) == width:
+            flat.extend(row)
+        elif len(row) > width:
+            flat.extend(row[:width])
+        else:
+            flat.extend(row)
+            flat.extend(padding[len(row) :])
+        n_rows += 1
+        if n_rows == CHUNK_ROWS:
+            chunks.append(to_floats(flat).reshape(n_rows, width))
+            total_rows += n_rows
+            if total_rows * width > MAX_CELLS:
+                raise UploadError(f"File has more than {MAX_CELLS:,} values")
+            flat, n_rows = [], 0
+    if n_rows:
+        chunks.append(to_floats(flat).reshape(n_rows, width))
+
+    names = [_text(cell) for cell in header] + [""] * (width - len(header))
+    return Upload(np.concatenate(chunks), names, "table")
+
+
+def _clean(upload: Upload, min_points: int) -> Upload:
+    """Drop unusable rows and empty Y columns, then check enough remain."""
+    matrix = upload.matrix
+    y_columns = [0] + [
+        j for j in range(1, matrix.shape[1]) if not np.all(np.isnan(matrix[:, j]))
+    ]
+    if len(y_columns) < 2:
+        raise UploadError("No Y values were found")
+    matrix = matrix[:, y_columns]
+    usable = ~np.isnan(matrix[:, 0]) & ~np.all(np.isnan(matrix[:, 1:]), axis=1)
+    matrix = matrix[usable]
+    if len(matrix) < min_points:
+        raise UploadError(
+            f"Found {len(matrix)} usable points; at least {min_points} are needed"
+        )
+
+    default = ["X"] + [f"Y{j}" for j in range(1, len(y_columns))]
+    names = [upload.names[j] or default[k] for k, j in enumerate(y_columns)]
+    return Upload(np.ascontiguousarray(matrix), names, upload.layout)
+
+
+def parse_upload(contents: str, filename: Optional[str], min_points: int = 2) -> Upload:
+    """Parse an uploaded CSV, TSV, XLSX or plate-reader export.
+
+    Args:
+        contents (str): data URL from ``dcc.Upload``
+        filename (Optional[str]): uploaded file name, used to pick the format
+        min_points (int): fewest usable points to accept
+
+    Raises:
+        UploadError: with a user-facing message if the file cannot be used
+
+    Returns:
+        Upload: X and Y columns, rows without X or any Y value dropped
+    """
+    return parse_bytes(decode(contents), filename, min_points)
+
+
+def parse_bytes(data: bytes, filename: Optional[str], min_points: int = 2) -> Upload:
+    """Parse the content of a CSV, TSV, XLSX or plate-reader export.
+
+    Args:
+        data (bytes): file content
+        filename (Optional[str]): file name, used to pick the format
+        min_points (int): fewest usable points to accept
+
+    Raises:
+        UploadError: with a user-facing message if the file cannot be used
+
+    Returns:
+        Upload: X and Y columns, rows without X or any Y value dropped
+    """
+    suffix = PurePath(filename or "").suffix.lower()
+    if suffix in XLSX_SUFFIXES or data[:4] == b"PK\x03\x04":
+        rows = _xlsx_rows(data)
+    else:
+        delimiter = "\t" if suffix in (".tsv", ".tab") else _sniff_delimiter(data)
+        rows = _text_rows(data, delimiter)
+
+    head = list(itertools.islice(rows, SNIFF_ROWS))
+    for i, row in enumerate(head):
+        width = _plate_header(row)
+        if width:
+            return _clean(
+                _read_plate(itertools.chain(head[i + 1 :], rows), width), min_points
+            )
+    return _clean(_read_table(head, rows), min_points)
+
+
+def parse_values(text: Optional[str], label: str) -> NDArray:
+    """Parse pasted numbers in one vectorized conversion.
+
+    Spreadsheets in comma-decimal locales paste values separated by
+    semicolons or tabs, so commas are read as decimal marks when one of those
+    separates the values, no value holds more than one comma and no comma is
+    followed by a space. Values with one comma each separated only by spaces
+    or line breaks ("10,20" on each line) could be read either way and are
+    reported as ambiguous rather than guessed at.
+
+    Args:
+        text (Optional[str]): values separated by commas, semicolons, tabs,
+            spaces or line breaks
+        label (str): name of the field, used in error messages
+
+    Raises:
+        UploadError: naming the position and text of each bad token, or if
+            commas could be decimal marks or separators
+
+    Returns:
+        NDArray: float64 values
+    """
+    text = (text or "").translate(MINUS_SIGNS)
+    cells = text.replace(";", " ").split()
+    if (
+        "," in text
+        and len(cells) > 1
+        and all(cell.count(",") <= 1 for cell in cells)
+        and not re.search(r",\s", text)
+    ):
+        if ";" not in text and "\t" not in text:
+            raise UploadError(
+                f"{label} values are ambiguous: commas could be decimal marks or "
+                "separators; use points for decimals or semicolons between values"
+            )
+        try:
+            decimal: NDArray = np.asarray(
+                text.translate(DECIMAL_COMMAS).split(), dtype=np.float64
+            )
+        except ValueError:
+            pass
+        else:
+            if np.all(np.isfinite(decimal)):
+                return decimal
+
+    tokens = text.translate(SEPARATORS).split()
+    if not tokens:
+        raise UploadError(f"No {label} values were entered")
+    try:
+        values: NDArray = np.asarray(tokens, dtype=np.float64)
+    except ValueError:
+        values = np.full(len(tokens), np.nan)  # only the error path goes by token
+        for i, token in enumerate(tokens):
+            try:
+                values[i] = float(token)
+            except ValueError:
+                pass
+
+    bad = np.flatnonzero(~np.isfinite(values))
+    if len(bad):
+        problems = [f'{label} value {i + 1} ("{tokens[i]}")' for i in bad]
+        if len(problems) > MAX_REPORTED_TOKENS:
+            more = len(problems) - MAX_REPORTED_TOKENS
+            problems = problems[:MAX_REPORTED_TOKENS] + [f"{more} more"]
+        raise UploadError("Not a number: " + ", ".join(problems))
+    return values
+
+
+def parse_pasted(
+    xs: Optional[str], ys: Optional[str], min_points: int = 2
+) -> Tuple[NDArray, NDArray]:
+    """Parse pasted X and Y values and check they pair up before fitting.
+
+    Args:
+        xs (Optional[str]): pasted X values
+        ys (Optional[str]): pasted Y values
+        min_points (int): fewest points to accept
+
+    Raises:
+        UploadError: listing bad tokens in either field, mismatched lengths or
+            too few points
+
+    Returns:
+        Tuple[NDArray, NDArray]: X and Y values
+    """
+    errors = []
+    parsed = []
+    for text, label in ((xs, "X"), (ys, "Y")):
+        try:
+            parsed.append(parse_values(text, label))
+        except UploadError as err:
+            errors.append(str(err))
+    if errors:
+        raise UploadError("; ".join(errors))
+
+    x, y = parsed
+    if len(x) != len(y):
+        raise UploadError(f"{len(x)} X values but {len(y)} Y values were entered")
+    if len(x) < min_points:
+        raise UploadError(f"At least {min_points} points are needed")
+    return (x, y)
@@ -0,0 +1,48 @@
+"""
+WSGI entry point for serving one app with a production server.
+
+The app files are not importable module names (``dbc-dose.py``), so the app
+to serve is named by path in ``BONHAM_APP`` and loaded from it:
+
+    BONHAM_APP=dbc-dose.py gunicorn -c gunicorn.conf.py wsgi:application
+
+See ``gunicorn.conf.py`` for the recommended worker settings.
+"""
+
+import importlib.util
+import os
+import sys
+from pathlib import Path
+from types import ModuleType
+from typing import Any
+
+ROOT = Path(__file__).resolve().parent
+APP: str = os.environ.get("BONHAM_APP", "dashmichaelis.py")
+
+
+def load_app(app_path: Path) -> ModuleType:
+    """Import an app file by path, with this directory on ``sys.path``.
+
+    Args:
+        app_path (Path): app file, relative to this directory or absolute
+
+    Raises:
+        ImportError: if the file cannot be loaded
+
+    Returns:
+        ModuleType: the app module, with its Flask ``server``
+    """
+    app_path = ROOT / app_path
+    spec = importlib.util.spec_from_file_location(
+        app_path.stem.replace("-", "_"), app_path
+    )
+    if spec is None or spec.loader is None:
+        raise ImportError(f"Cannot load {app_path}")
+    module = importlib.util.module_from_spec(spec)
+    if str(ROOT) not in sys.path:
+        sys.path.insert(0, str(ROOT))
+    spec.loader.exec_module(module)
+    return module
+
+
+application: Any = load_app(Path(APP)).server